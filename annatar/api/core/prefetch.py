@@ -0,0 +1,148 @@
+"""
+Prefetching of the episodes after the one a user just opened, which is
+almost always what they open next. Runs in the background after the
+response is served: the debrid availability of the next episodes is looked
+up so it is cached, and a background search is published if there are no
+torrents for them yet. Prefetches are dropped rather than queued when too
+many are running, and each episode is prefetched once per
+PREFETCH_LOCK_TTL for each debrid account (or each service when the
+service shares its cache between accounts).
+"""
+
+import asyncio
+import hashlib
+import os
+from datetime import timedelta
+
+import structlog
+from prometheus_client import Counter
+
+from annatar import instrumentation
+from annatar.api.filters import Filter
+from annatar.database import db, odm
+from annatar.database.semaphore import Priority
+from annatar.debrid.debrid_service import DebridService
+from annatar.pubsub import events
+from annatar.torrent import Category
+
+log = structlog.get_logger(__name__)
+
+PREFETCH_ENABLED = os.getenv("PREFETCH_ENABLED", "true").lower() == "true"
+PREFETCH_EPISODES = int(os.getenv("PREFETCH_EPISODES", "2"))
+# prefetches running at once in each process
+PREFETCH_MAX_CONCURRENT = int(os.getenv("PREFETCH_MAX_CONCURRENT", "4"))
+PREFETCH_LOCK_TTL = timedelta(hours=1)
+
+PREFETCHES = Counter(
+    name="prefetch_episodes",
+    documentation="Next episodes prefetched after a series request, by result",
+    labelnames=["result"],
+    registry=instrumentation.registry(),
+)
+
+_running: set[asyncio.Task[None]] = set()
+
+
+def schedule(
+    debrid: DebridService,
+    imdb: str,
+    season: int,
+    episode: int,
+    max_results: int,
+    filters: list[Filter],
+) -> bool:
+    """
+    Prefetch the episodes after season/episode in the background. Returns
+    False if too many prefetches are running already.
+    """
+    if not PREFETCH_ENABLED:
+        return False
+    if len(_running) >= PREFETCH_MAX_CONCURRENT:
+        PREFETCHES.labels(result="busy").inc()
+        return False
+    task = asyncio.create_task(
+        next_episodes(debrid, imdb, season, episode, max_results, filters),
+        name=f"prefetch_{imdb}_{season}_{episode}",
+    )
+    _running.add(task)
+    task.add_done_callback(_running.discard)
+    return True
+
+
+def lock_key(debrid: DebridService, imdb: str, season: int, episode: int) -> str:
+    account = debrid.id()
+    if not debrid.shared_cache():
+        key_hash = hashlib.sha256(debrid.api_key.encode()).hexdigest()[:16]
+        account = f"{account}:{key_hash}"
+    return f"prefetch:{account}:{imdb}:{season}:{episode}"
+
+
+async def next_episodes(
+    debrid: DebridService,
+    imdb: str,
+    season: int,
+    episode: int,
+    max_results: int,
+    filters: list[Filter],
+) -> None:
+    searched = False
+    for next_episode in range(episode + 1, episode + 1 + PREFETCH_EPISODES):
+        key = lock_key(debrid, imdb, season, next_episode)
+        try:
+            if not await db.try_lock(key, PREFETCH_LOCK_TTL):
+                PREFETCHES.labels(result="recent").inc()
+                continue
+            torrents = await odm.list_torrents(
+                imdb=imdb,
+                season=season,
+                episode=next_episode,
+                filters=filters,
+            )
+            if torrents:
+                await warm(debrid, torrents, season, next_episode, max_results)
+                PREFETCHES.labels(result="warmed").inc()
+                continue
+            # every episode of the season comes from the same search
+            if not searched:
+                await events.SearchRequest.publish(
+                    events.SearchRequest(
+                        imdb=imdb,
+                        category=Category.Series,
+                        season=season,
+                        episode=next_episode,
+                        priority=Priority.BACKGROUND,
+                    )
+                )
+                searched = True
+            PREFETCHES.labels(result="searched").inc()
+            # warmed by a later request once the search found torrents
+            await db.unlock(key)
+        except Exception as e:
+            log.warning("failed to prefetch episode", imdb=imdb, episode=next_episode, exc_info=e)
+
+
+async def warm(
+    debrid: DebridService,
+    torrents: list[str],
+    season: int,
+    episode: int,
+    max_results: int,
+) -> None:
+    """
+    Look up the stream links so the debrid service's availability of the
+    torrents is cached
+    """
+    stop = asyncio.Event()
+    found = 0
+    async for _ in debrid.get_stream_links(
+        torrents=torrents,
+        stop=stop,
+        max_results=max_results,
+        season=season,
+        episode=episode,
+    ):
+        found += 1
+        if found >= max_results:
+            stop.set()
+            break
+    log.debug("prefetched episode", season=season, episode=episode, links=found)
@@ -10,12 +10,13 @@ import structlog
 from prometheus_client import Counter, Histogram
 from pydantic import ValidationError
 
-from annatar import human, instrumentation
+from annatar import human, instrumentation, title_parser
+from annatar.api.core import prefetch
 from annatar.api.filters import Filter
 from annatar.database import db, odm
 from annatar.debrid.models import StreamLink
 from annatar.debrid.providers import DebridService
-from annatar.pubsub import events
+from annatar.pubsub import dispatcher, events, popularity
 from annatar.stremio import Stream, StreamResponse
 from annatar.torrent import Category, TorrentMeta
 
@@ -43,17 +44,16 @@ async def _search(
         log.debug("unique search")
         UNIQUE_SEARCHES.inc()
 
-    await events.SearchRequest.publish(
-        events.SearchRequest(
-            imdb=imdb_id,
-            category=Category(type),
-            season=season_episode[0] if len(season_episode) == 2 else None,
-            episode=season_episode[1] if len(season_episode) == 2 else None,
-        )
+    request = events.SearchRequest(
+        imdb=imdb_id,
+        category=Category(type),
+        season=season_episode[0] if len(season_episode) == 2 else None,
+        episode=season_episode[1] if len(season_episode) == 2 else None,
     )
+    await asyncio.gather(events.SearchRequest.publish(request), popularity.record(request))
     log.info("searching for stream links")
 
-    stream_links: list[StreamLink] = await get_stream_links(
+    stream_links: list[tuple[StreamLink, TorrentMeta]] = await get_stream_links(
         debrid=debrid,
         imdb=imdb_id,
         max_results=max_results,
@@ -63,37 +63,30 @@ async def _search(
     )
 
     log.info("got stream links", count=len(stream_links))
-    sorted_links: list[StreamLink] = list(
+    sorted_links: list[tuple[StreamLink, TorrentMeta]] = list(
         sorted(
             chain(stream_links),
-            key=lambda x: (human.rank_quality(x.name), float(x.size)),
+            key=lambda x: (human.rank_quality(x[0].name), float(x[0].size)),
             reverse=True,
         )
     )
 
-    streams: list[Stream] = [map_stream_link(link=link, debrid=debrid) for link in sorted_links]
+    streams: list[Stream] = [
+        map_stream_link(link=link, debrid=debrid, meta=meta) for link, meta in sorted_links
+    ]
 
+    if request.season and request.episode:
+        prefetch.schedule(
+            debrid=debrid,
+            imdb=imdb_id,
+            season=request.season,
+            episode=request.episode,
+            max_results=max_results,
+            filters=filters,
+        )
     return StreamResponse(streams=streams)
 
 
-async def wait_for_results(
-    q: asyncio.Queue[events.TorrentAdded],
-    imdb: str,
-    season: int,
-    episode: int,
-    max_results: int,
-) -> None:
-    num_results = 0
-    while num_results < max_results:
-        new_torrent = await q.get()
-        if (
-            new_torrent.imdb == imdb
-            and new_torrent.season == season
-            and new_torrent.episode == episode
-        ):
-            num_results += 1
-
-
 async def wait_for_new_torrents(
     imdb: str,
     season: int,
@@ -101,22 +94,9 @@ async def wait_for_new_torrents(
     max_results: int,
     torrent_resolution_done: asyncio.Event,
 ):
-    q = asyncio.Queue[events.TorrentAdded]()
-    tasks = [
-        asyncio.create_task(
-            events.TorrentAdded.listen(q, f"stream_links:{imdb}:{season}:{episode}")
-        ),
-        asyncio.create_task(wait_for_results(q, imdb, season, episode, max_results // 3)),
-    ]
-    with contextlib.suppress(asyncio.TimeoutError):
-        await asyncio.wait(
-            return_when=asyncio.FIRST_EXCEPTION,
-            timeout=SEARCH_TIMEOUT,
-            fs=tasks,
-        )
-    for task in tasks:
-        if not task.done():
-            task.cancel()
+    async with dispatcher.watch(imdb, season, episode) as waiter:
+        with contextlib.suppress(asyncio.TimeoutError):
+            await asyncio.wait_for(waiter.wait(max_results // 3), timeout=SEARCH_TIMEOUT)
     torrent_resolution_done.set()
 
 
@@ -127,7 +107,11 @@ async def get_stream_links(
     filters: list[Filter],
     season: int = 0,
     episode: int = 0,
-) -> list[StreamLink]:
+) -> list[tuple[StreamLink, TorrentMeta]]:
+    """
+    Get stream links along with the TorrentMeta parsed from their names so
+    each name is only parsed once per request
+    """
     log.debug("getting stream links", imdb=imdb, max_results=max_results, filters=filters)
 
     torrent_resolution_done = asyncio.Event()
@@ -157,7 +141,7 @@ async def get_stream_links(
     else:
         torrent_resolution_done.set()
 
-    resolution_links: dict[str, list[StreamLink]] = defaultdict(list)
+    resolution_links: dict[str, list[tuple[StreamLink, TorrentMeta]]] = defaultdict(list)
     total_links: int = 0
     total_processed: int = 0
     stop = asyncio.Event()
@@ -170,18 +154,18 @@ async def get_stream_links(
         max_results=max_results,
     ):
         total_processed += 1
-        resolution: str = ""
         try:
-            resolution: str = next(iter(TorrentMeta.parse_title(link.name).resolution), "NONE")
+            meta: TorrentMeta = title_parser.parse_title(link.name)
         except ValidationError as e:
             log.debug("error parsing title", title=link.name, exc_info=e)
             continue
+        resolution: str = next(iter(meta.resolution), "NONE")
 
         if len(resolution_links[resolution]) >= math.ceil(max_results / 3):
             log.debug("max results for resolution", resolution=resolution)
             continue
 
-        resolution_links[resolution].append(link)
+        resolution_links[resolution].append((link, meta))
         total_links += 1
         if total_links >= max_results:
             log.debug("max results total")
@@ -193,8 +177,13 @@ async def get_stream_links(
     return list(chain.from_iterable(resolution_links.values()))
 
 
-def map_stream_link(link: StreamLink, debrid: DebridService) -> Stream:
-    meta: TorrentMeta = TorrentMeta.parse_title(link.name)
+def map_stream_link(
+    link: StreamLink,
+    debrid: DebridService,
+    meta: TorrentMeta | None = None,
+) -> Stream:
+    if meta is None:
+        meta = title_parser.parse_title(link.name)
 
     meta_parts: list[str] = []
     if resolution := next(iter(meta.resolution), None):
@@ -11,6 +11,10 @@ class Filter(BaseModel):
     name: str
     apply: Callable[[TorrentMeta], bool] = Field(..., exclude=True)
     category: str
+    # Position of this filter in the feature bitmask stored with each torrent.
+    # Bits must never be reused. Bump torrent.META_SCHEMA_VERSION when a
+    # filter is added or its predicate changes so stored masks are rebuilt.
+    bit: int = Field(..., exclude=True)
 
     def __str__(self) -> str:
         return self.name
@@ -24,36 +28,42 @@ ALL = (
             name="4K (2160p)",
             apply=lambda meta: "4K" in meta.resolution,
             category="Resolution",
+            bit=0,
         ),
         Filter(
             id="qhd",
             name="QHD (1440p)",
             apply=lambda meta: "1440p" in meta.resolution,
             category="Resolution",
+            bit=1,
         ),
         Filter(
             id="1080p",
             name="1080p",
             apply=lambda meta: "1080p" in meta.resolution,
             category="Resolution",
+            bit=2,
         ),
         Filter(
             id="720p",
             name="720p",
             apply=lambda meta: "720p" in meta.resolution,
             category="Resolution",
+            bit=3,
         ),
         Filter(
             id="480p",
             name="480p",
             apply=lambda meta: "480p" in meta.resolution,
             category="Resolution",
+            bit=4,
         ),
         Filter(
             id="unknown_resolution",
             name="Unknown Resolution",
             apply=lambda meta: meta.resolution == [],
             category="Resolution",
+            bit=5,
         ),
         # Video Quality
         Filter(
@@ -61,36 +71,42 @@ ALL = (
             name="YTS",
             apply=lambda meta: bool(re.search(r"(YTS|YIFY)", meta.raw_title, re.IGNORECASE)),
             category="Video Quality",
+            bit=6,
         ),
         Filter(
             id="remux",
             name="REMUX",
             apply=lambda meta: meta.remux,
             category="Video Quality",
+            bit=7,
         ),
         Filter(
             id="hdr",
             name="HDR",
             apply=lambda meta: meta.hdr,
             category="Video Quality",
+            bit=8,
         ),
         Filter(
             id="x265",
             name="H.265 (HEVC)",
             apply=lambda meta: "H.265" in meta.codec,
             category="Video Quality",
+            bit=9,
         ),
         Filter(
             id="x264",
             name="H.264 (AVC)",
             apply=lambda meta: "H.264" in meta.codec,
             category="Video Quality",
+            bit=10,
         ),
         Filter(
             id="ten_bit",
             name="10bit",
             apply=lambda meta: [10] == meta.bitDepth,
             category="Video Quality",
+            bit=11,
         ),
     ]
     + [
@@ -123,3 +139,25 @@ def by_id(id: str) -> Filter:
 
 def by_category(category: str) -> list[Filter]:
     return list(filter(lambda f: f.category == category, ALL))
+
+
+def features(meta: TorrentMeta) -> int:
+    """
+    Bitmask of every filter that applies to the torrent
+    """
+    result = 0
+    for f in ALL:
+        if f.apply(meta):
+            result |= 1 << f.bit
+    return result
+
+
+def mask(filters: list[Filter]) -> int:
+    """
+    Compile filters into a mask. A torrent is filtered out when its features
+    share any bit with the mask.
+    """
+    result = 0
+    for f in filters:
+        result |= 1 << f.bit
+    return result
@@ -112,15 +112,16 @@ async def search_imdb(
                 ),
             )
 
-    mapped = await asyncio.gather(*[build_media(info_hash) for info_hash in torrents])
-    return MediaResponse(media=[media for media in mapped if media is not None])
+    return MediaResponse(media=await build_media(torrents))
 
 
-async def build_media(info_hash: str) -> None | Media:
-    title = await odm.get_torrent_title(info_hash)
-    if title is None:
-        return None
-    return Media(hash=info_hash, title=title)
+async def build_media(info_hashes: list[str]) -> list[Media]:
+    metas = await odm.get_torrent_meta_many(info_hashes)
+    return [
+        Media(hash=info_hash, title=metas[info_hash]["title"])
+        for info_hash in info_hashes
+        if "title" in metas.get(info_hash, {})
+    ]
 
 
 async def wait_for_torrents(
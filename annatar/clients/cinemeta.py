@@ -1,16 +1,27 @@
+import os
 import re
 from datetime import datetime, timedelta
 from typing import Optional
 
-import aiohttp
 import structlog
 from pydantic import BaseModel
 
-from annatar.database import db
+from annatar.clients import http
+from annatar.database import swr
 from annatar.instrumentation import HTTP_CLIENT_REQUEST_DURATION
 
 log = structlog.get_logger(__name__)
 
+# how long other processes wait for a lookup in flight before making their own
+CINEMETA_LEASE = timedelta(seconds=10)
+CINEMETA_CACHE = swr.Policy(
+    fresh=timedelta(days=int(os.getenv("CINEMETA_CACHE_DAYS", "30"))),
+    # metadata rarely changes so it is served for long while refreshing it
+    stale=timedelta(days=int(os.getenv("CINEMETA_STALE_DAYS", "30"))),
+    # unknown ids and failed lookups
+    negative=timedelta(minutes=int(os.getenv("CINEMETA_NEGATIVE_CACHE_MINUTES", "10"))),
+)
+
 
 class MediaInfo(BaseModel):
     id: str
@@ -57,7 +68,7 @@ async def _get_media_info(id: str, type: str) -> MediaInfo | None:
     error = False
     start_time = datetime.now()
     try:
-        async with aiohttp.ClientSession() as session, session.get(api_url) as response:
+        async with http.session(http.Upstream.Cinemeta).get(api_url) as response:
             status = f"{response.status // 100}xx"
             if response.status not in range(200, 300):
                 log.error(
@@ -90,19 +101,12 @@ async def _get_media_info(id: str, type: str) -> MediaInfo | None:
 
 
 async def get_media_info(id: str, type: str) -> Optional[MediaInfo]:
-    cache_key = f"cinemeta:{type}:{id}"
-
-    cached_result: Optional[MediaInfo] = await db.get_model(cache_key, model=MediaInfo)
-    if cached_result:
-        return cached_result
-
-    res: Optional[MediaInfo] = await _get_media_info(id=id, type=type)
-    if res is None:
-        return None
-
-    await db.set(
-        cache_key,
-        res.model_dump_json(),
-        ttl=timedelta(days=30),
+    result = await swr.get(
+        name="cinemeta",
+        key=f"cinemeta:{type}:{id}",
+        model=MediaInfo,
+        fetch=lambda: _get_media_info(id=id, type=type),
+        policy=CINEMETA_CACHE,
+        lease=CINEMETA_LEASE,
     )
-    return res
+    return result.value
@@ -0,0 +1,136 @@
+"""
+Pooled HTTP sessions shared by the outbound clients. Each upstream gets one
+aiohttp session per event loop so connections, TLS sessions and DNS lookups
+are reused across requests instead of being set up for every call.
+"""
+
+import asyncio
+import os
+import time
+from enum import Enum
+from types import SimpleNamespace
+from weakref import WeakKeyDictionary
+
+import aiohttp
+import structlog
+from prometheus_client import Counter, Gauge, Histogram
+
+from annatar import instrumentation
+
+log = structlog.get_logger(__name__)
+
+HTTP_MAX_CONNECTIONS = int(os.getenv("HTTP_MAX_CONNECTIONS", "100"))
+HTTP_MAX_CONNECTIONS_PER_HOST = int(os.getenv("HTTP_MAX_CONNECTIONS_PER_HOST", "20"))
+HTTP_KEEPALIVE_SECONDS = float(os.getenv("HTTP_KEEPALIVE_SECONDS", "30"))
+HTTP_DNS_CACHE_SECONDS = int(os.getenv("HTTP_DNS_CACHE_SECONDS", "300"))
+
+HTTP_POOL_REQUESTS = Gauge(
+    name="http_client_pool_requests_in_flight",
+    documentation="Requests waiting for a pooled connection or for response headers",
+    multiprocess_mode="livesum",
+    labelnames=["upstream"],
+    registry=instrumentation.registry(),
+)
+
+HTTP_POOL_CONNECTIONS = Counter(
+    name="http_client_pool_connections",
+    documentation="Connections taken from the pool, by whether they were reused or created",
+    labelnames=["upstream", "result"],
+    registry=instrumentation.registry(),
+)
+
+HTTP_POOL_WAIT = Histogram(
+    name="http_client_pool_wait_seconds",
+    documentation="Time spent waiting for a free connection in the pool",
+    labelnames=["upstream"],
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10),
+    registry=instrumentation.registry(),
+)
+
+
+class Upstream(str, Enum):
+    AllDebrid = "alldebrid"
+    Cinemeta = "cinemeta"
+    DebridLink = "debridlink"
+    Jackett = "jackett"
+    # redirects from Jackett to the magnet link of a torrent
+    Magnet = "magnet"
+    Premiumize = "premiumize"
+    RealDebrid = "real_debrid"
+
+    def __str__(self):
+        return self.value
+
+
+_sessions: WeakKeyDictionary[asyncio.AbstractEventLoop, dict[Upstream, aiohttp.ClientSession]] = (
+    WeakKeyDictionary()
+)
+
+
+def session(upstream: Upstream) -> aiohttp.ClientSession:
+    """
+    The pooled session for the upstream on the running event loop
+    """
+    loop = asyncio.get_running_loop()
+    sessions = _sessions.setdefault(loop, {})
+    current = sessions.get(upstream)
+    if current is None or current.closed:
+        current = sessions[upstream] = _new_session(upstream)
+    return current
+
+
+def _new_session(upstream: Upstream) -> aiohttp.ClientSession:
+    log.debug("creating http session", upstream=upstream)
+    return aiohttp.ClientSession(
+        connector=aiohttp.TCPConnector(
+            limit=HTTP_MAX_CONNECTIONS,
+            limit_per_host=HTTP_MAX_CONNECTIONS_PER_HOST,
+            keepalive_timeout=HTTP_KEEPALIVE_SECONDS,
+            ttl_dns_cache=HTTP_DNS_CACHE_SECONDS,
+        ),
+        # sessions are shared between users so nothing may carry over
+        cookie_jar=aiohttp.DummyCookieJar(),
+        trace_configs=[_trace_config(upstream)],
+    )
+
+
+def _trace_config(upstream: Upstream) -> aiohttp.TraceConfig:
+    in_flight = HTTP_POOL_REQUESTS.labels(upstream=upstream)
+    wait = HTTP_POOL_WAIT.labels(upstream=upstream)
+
+    async def on_request_start(_s, _ctx, _params) -> None:
+        in_flight.inc()
+
+    async def on_request_done(_s, _ctx, _params) -> None:
+        in_flight.dec()
+
+    async def on_queued_start(_s, ctx: SimpleNamespace, _params) -> None:
+        ctx.queued_at = time.monotonic()
+
+    async def on_queued_end(_s, ctx: SimpleNamespace, _params) -> None:
+        wait.observe(time.monotonic() - ctx.queued_at)
+
+    async def on_created(_s, _ctx, _params) -> None:
+        HTTP_POOL_CONNECTIONS.labels(upstream=upstream, result="created").inc()
+
+    async def on_reused(_s, _ctx, _params) -> None:
+        HTTP_POOL_CONNECTIONS.labels(upstream=upstream, result="reused").inc()
+
+    trace = aiohttp.TraceConfig()
+    trace.on_request_start.append(on_request_start)
+    trace.on_request_end.append(on_request_done)
+    trace.on_request_exception.append(on_request_done)
+    trace.on_connection_queued_start.append(on_queued_start)
+    trace.on_connection_queued_end.append(on_queued_end)
+    trace.on_connection_create_end.append(on_created)
+    trace.on_connection_reuseconn.append(on_reused)
+    return trace
+
+
+async def close() -> None:
+    """
+    Close the sessions of the running event loop
+    """
+    sessions = _sessions.pop(asyncio.get_running_loop(), {})
+    for s in sessions.values():
+        await s.close()
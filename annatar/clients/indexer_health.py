@@ -0,0 +1,175 @@
+"""
+Health and yield of the Jackett indexers, shared by every process through
+Redis. Each query is recorded in hourly buckets by indexer, category and
+query type. The search processors use the totals to stop querying indexers
+that keep failing (circuit breaker) and to skip query types that never
+yield anything for a category, such as series searches on a movie-only
+indexer. The configure page shows them.
+"""
+
+import os
+import time
+from datetime import timedelta
+from enum import Enum
+
+import structlog
+from pydantic import BaseModel, computed_field
+
+from annatar.database import db
+
+log = structlog.get_logger(__name__)
+
+# consecutive failed queries that open the circuit of an indexer
+BREAKER_THRESHOLD = int(os.getenv("INDEXER_BREAKER_THRESHOLD", "5"))
+# how long an open circuit skips the indexer before it is tried again
+BREAKER_COOLDOWN = timedelta(seconds=int(os.getenv("INDEXER_BREAKER_COOLDOWN_SECONDS", "120")))
+STATS_WINDOW_HOURS = 24
+# a query type is only skipped after this many queries yielded nothing
+MIN_QUERIES_TO_SKIP = int(os.getenv("INDEXER_MIN_QUERIES_TO_SKIP", "20"))
+# stats read by the search processors are refreshed this often
+STATS_REFRESH_SECONDS = 60
+
+
+class QueryType(str, Enum):
+    IMDB = "imdb"
+    TITLE = "title"
+    SEASON = "season"
+
+    def __str__(self):
+        return self.value
+
+
+class QueryStats(BaseModel):
+    queries: int = 0
+    errors: int = 0
+    # relevant results, whether or not another query of the same search
+    # returned them first
+    results: int = 0
+    # results no other query of the same search returned first. This depends
+    # on which query completed first so it is only shown, never used to skip
+    # a query.
+    unique: int = 0
+    latency_ms: int = 0
+
+    @computed_field
+    @property
+    def error_rate(self) -> float:
+        return self.errors / self.queries if self.queries else 0.0
+
+    @computed_field
+    @property
+    def mean_latency(self) -> float:
+        return self.latency_ms / self.queries / 1000 if self.queries else 0.0
+
+    def add(self, other: "QueryStats") -> None:
+        self.queries += other.queries
+        self.errors += other.errors
+        self.results += other.results
+        self.unique += other.unique
+        self.latency_ms += other.latency_ms
+
+
+class IndexerStats(BaseModel):
+    indexer: str
+    breaker_open: bool = False
+    # by "{category}:{query type}"
+    queries: dict[str, QueryStats] = {}
+
+    def query(self, category: str, query: QueryType) -> QueryStats:
+        return self.queries.get(f"{category}:{query}", QueryStats())
+
+    @computed_field
+    @property
+    def total(self) -> QueryStats:
+        total = QueryStats()
+        for stats in self.queries.values():
+            total.add(stats)
+        return total
+
+    def should_skip(self, category: str, query: QueryType) -> bool:
+        stats = self.query(category, query)
+        return stats.queries - stats.errors >= MIN_QUERIES_TO_SKIP and stats.results == 0
+
+
+class Keys:
+    @staticmethod
+    def stats(indexer: str, hour: int) -> str:
+        return f"indexer:v1:stats:{indexer}:{hour}"
+
+    @staticmethod
+    def failures(indexer: str) -> str:
+        return f"indexer:v1:breaker:{indexer}:failures"
+
+    @staticmethod
+    def breaker(indexer: str) -> str:
+        return f"indexer:v1:breaker:{indexer}:open"
+
+
+async def record(
+    indexer: str,
+    category: str,
+    query: QueryType,
+    latency: float,
+    failed: bool,
+    results: int,
+    unique: int = 0,
+) -> None:
+    """
+    Record a query that reached the indexer. results is the number of
+    relevant results it returned, unique the number of those no other query
+    of the search returned first.
+    """
+    prefix = f"{category}:{query}"
+    await db.hincrby_many(
+        Keys.stats(indexer, int(time.time() // 3600)),
+        {
+            f"{prefix}:queries": 1,
+            f"{prefix}:errors": int(failed),
+            f"{prefix}:results": results,
+            f"{prefix}:unique": unique,
+            f"{prefix}:latency_ms": int(latency * 1000),
+        },
+        ttl=timedelta(hours=STATS_WINDOW_HOURS + 1),
+    )
+    if not failed:
+        await db.delete(Keys.failures(indexer))
+        return
+    # the counter is not reset when the circuit opens so a single failure
+    # after the cooldown opens it again
+    failures = await db.incr(Keys.failures(indexer), ttl=BREAKER_COOLDOWN * 10)
+    if failures >= BREAKER_THRESHOLD:
+        log.warning("opening indexer circuit", indexer=indexer, failures=failures)
+        await db.set(Keys.breaker(indexer), str(failures), ttl=BREAKER_COOLDOWN)
+
+
+async def stats(indexer: str) -> IndexerStats:
+    """
+    The stats of the indexer over the last STATS_WINDOW_HOURS
+    """
+    hour = int(time.time() // 3600)
+    keys = [Keys.stats(indexer, h) for h in range(hour - STATS_WINDOW_HOURS + 1, hour + 1)]
+    result = IndexerStats(
+        indexer=indexer,
+        breaker_open=await db.get(Keys.breaker(indexer)) is not None,
+    )
+    for bucket in await db.hgetall_many(keys):
+        for field, value in bucket.items():
+            category_query, _, counter = field.rpartition(":")
+            stats = result.queries.setdefault(category_query, QueryStats())
+            setattr(stats, counter, getattr(stats, counter) + int(value))
+    return result
+
+
+_cached: dict[str, tuple[float, IndexerStats]] = {}
+
+
+async def cached_stats(indexer: str) -> IndexerStats:
+    """
+    stats refreshed at most every STATS_REFRESH_SECONDS. The circuit state
+    is always current.
+    """
+    entry = _cached.get(indexer)
+    if entry is None or time.monotonic() - entry[0] > STATS_REFRESH_SECONDS:
+        entry = _cached[indexer] = (time.monotonic(), await stats(indexer))
+    breaker_open = await db.get(Keys.breaker(indexer)) is not None
+    return entry[1].model_copy(update={"breaker_open": breaker_open})
@@ -1,19 +1,24 @@
 import asyncio
 import contextlib
+import math
 import os
 import re
+import threading
+import time
+from collections import deque
 from datetime import datetime, timedelta
 from typing import Any, Type, TypeVar
 
-import aiohttp
 import structlog
-from prometheus_client import Histogram
+from prometheus_client import Gauge, Histogram
 from pydantic import BaseModel
 from structlog.contextvars import bound_contextvars
 
 from annatar import instrumentation
+from annatar.clients import http
 from annatar.clients.jackett_models import SearchResponse
-from annatar.database import db
+from annatar.database import semaphore, swr
+from annatar.database.semaphore import Priority
 from annatar.torrent import Category
 
 log = structlog.get_logger(__name__)
@@ -22,7 +27,27 @@ T = TypeVar("T", bound=BaseModel)
 
 JACKETT_API_KEY: str = os.environ.get("JACKETT_API_KEY", "")
 JACKETT_CACHE_MINUTES = timedelta(minutes=int(os.environ.get("JACKETT_CACHE_MINUTES", "15")))
+# results older than JACKETT_CACHE_MINUTES are served this much longer while
+# they are refreshed in the background
+JACKETT_STALE_MINUTES = timedelta(minutes=int(os.environ.get("JACKETT_STALE_MINUTES", "60")))
+# empty results and timed out requests are cached this long
+JACKETT_NEGATIVE_CACHE_SECONDS = timedelta(
+    seconds=int(os.environ.get("JACKETT_NEGATIVE_CACHE_SECONDS", "120"))
+)
 JACKETT_URL: str = os.environ.get("JACKETT_URL", "http://localhost:9117")
+# Requests get this many times the p95 latency of their indexer, bounded by
+# JACKETT_MIN_TIMEOUT and the timeout of the caller
+JACKETT_DEADLINE_FACTOR = float(os.environ.get("JACKETT_DEADLINE_FACTOR", "2"))
+JACKETT_MIN_TIMEOUT = int(os.environ.get("JACKETT_MIN_TIMEOUT", "5"))
+LATENCY_WINDOW = 200
+# concurrent requests to Jackett from every process, and to each indexer
+JACKETT_MAX_CONCURRENCY = int(os.environ.get("JACKETT_MAX_CONCURRENCY", "16"))
+JACKETT_MAX_CONCURRENCY_PER_INDEXER = int(
+    os.environ.get("JACKETT_MAX_CONCURRENCY_PER_INDEXER", "4")
+)
+# fraction of the concurrency only user searches may use
+JACKETT_USER_RESERVED = float(os.environ.get("JACKETT_USER_RESERVED", "0.25"))
+LATENCY_MIN_SAMPLES = 20
 
 REQUEST_DURATION = Histogram(
     name="jackett_request_duration_seconds",
@@ -32,6 +57,61 @@ REQUEST_DURATION = Histogram(
 )
 
 
+INDEXER_DEADLINE = Gauge(
+    name="jackett_indexer_deadline_seconds",
+    documentation="Timeout given to requests for an indexer",
+    multiprocess_mode="livemax",
+    labelnames=["indexer"],
+    registry=instrumentation.registry(),
+)
+
+
+class Latencies:
+    """
+    The most recent upstream latencies of each indexer. Requests that time
+    out count with the time they waited so the deadline grows back when an
+    indexer slows down.
+    """
+
+    def __init__(self, window: int):
+        self.window = window
+        self._samples: dict[str, deque[float]] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, indexer: str, seconds: float) -> None:
+        with self._lock:
+            self._samples.setdefault(indexer, deque(maxlen=self.window)).append(seconds)
+
+    def quantile(self, indexer: str, q: float) -> float | None:
+        with self._lock:
+            samples = sorted(self._samples.get(indexer, ()))
+        if len(samples) < LATENCY_MIN_SAMPLES:
+            return None
+        return samples[min(len(samples) - 1, int(q * len(samples)))]
+
+
+LATENCIES = Latencies(LATENCY_WINDOW)
+
+
+def deadline(indexer: str, timeout: int) -> int:
+    """
+    The timeout for a request to the indexer. Until enough requests have
+    been observed it is the given timeout.
+    """
+    p95 = LATENCIES.quantile(indexer, 0.95)
+    if p95 is not None:
+        timeout = max(JACKETT_MIN_TIMEOUT, min(timeout, math.ceil(p95 * JACKETT_DEADLINE_FACTOR)))
+    INDEXER_DEADLINE.labels(indexer=indexer).set(timeout)
+    return timeout
+
+
+class RecentlyFailed(Exception):
+    """
+    The same request timed out recently and is not retried until the
+    negative cache expires
+    """
+
+
 class JackettSearchError(Exception):
     def __init__(self, message: str, status: int | None, body: str | None = None):
         self.message = message
@@ -44,6 +124,7 @@ async def search_imdb(
     category: Category,
     timeout: int,
     indexers: list[str],
+    priority: Priority = Priority.USER,
 ) -> SearchResponse:
     """
     Search all indexers for torrents and insert them into the unique list
@@ -65,13 +146,21 @@ async def search_imdb(
                 params=params,
                 timeout=timeout,
                 model=SearchResponse,
+                priority=priority,
             )
-            or SearchResponse()
+            # timed out
+            or SearchResponse(failed=True)
         )
+    except semaphore.Timeout as e:
+        log.warning("jackett is busy, dropping search", priority=priority)
+        error = e
+        return SearchResponse(failed=True, throttled=True)
+    except RecentlyFailed:
+        return SearchResponse(failed=True, cached=True)
     except Exception as e:
         log.error("jackett search failed", exc_info=e)
         error = e
-        return SearchResponse()
+        return SearchResponse(failed=True)
     finally:
         REQUEST_DURATION.labels(
             method="indexer_search", indexer=",".join(indexers), error=error
@@ -85,6 +174,7 @@ async def search(
     category: Category,
     indexers: list[str],
     timeout: int,
+    priority: Priority = Priority.USER,
 ) -> SearchResponse:
     """
     Search a single indexer for torrents and insert them into the unique list
@@ -107,13 +197,21 @@ async def search(
                 params=params,
                 timeout=timeout,
                 model=SearchResponse,
+                priority=priority,
             )
-            or SearchResponse()
+            # timed out
+            or SearchResponse(failed=True)
         )
+    except semaphore.Timeout as e:
+        log.warning("jackett is busy, dropping search", priority=priority)
+        error = e
+        return SearchResponse(failed=True, throttled=True)
+    except RecentlyFailed:
+        return SearchResponse(failed=True, cached=True)
     except Exception as e:
         log.error("jackett search failed", exc_info=e)
         error = e
-        return SearchResponse()
+        return SearchResponse(failed=True)
     finally:
         REQUEST_DURATION.labels(
             method="indexer_search", indexer=",".join(indexers), error=error
@@ -127,32 +225,90 @@ async def make_request(
     params: dict[str, Any],
     timeout: int,
     model: Type[T],
+    priority: Priority = Priority.USER,
 ) -> T | None:
+    """
+    Request from Jackett, or the cache. Requests wait for a permit of the
+    concurrency limits and raise semaphore.Timeout if none was free within
+    the timeout.
+    """
     with bound_contextvars(
         url=url,
         params=params.copy(),
         timeout=timeout,
     ):
         cache_key: str = f"jackett:{url}:{params}"
-        cached = await db.get_model(cache_key, model)
-        if cached:
-            log.debug("results are fresh", key=cache_key)
-            return cached
+        result = await swr.get(
+            name="jackett",
+            key=cache_key,
+            model=model,
+            fetch=lambda: _make_request(url, params, timeout, model, priority),
+            refresh=lambda: _make_request(url, params, timeout, model, Priority.BACKGROUND),
+            policy=swr.Policy(
+                fresh=JACKETT_CACHE_MINUTES,
+                stale=JACKETT_STALE_MINUTES,
+                negative=JACKETT_NEGATIVE_CACHE_SECONDS,
+            ),
+            lease=timedelta(seconds=timeout),
+            empty=lambda r: isinstance(r, SearchResponse) and not r.Results,
+        )
+        if result.hit == swr.Hit.MISS:
+            return result.value
+        log.debug("results are cached", key=cache_key, hit=result.hit)
+        if result.value is None:
+            raise RecentlyFailed
+        if isinstance(result.value, SearchResponse):
+            # cached values are shared so they are copied before changing them
+            return result.value.model_copy(update={"cached": True})
+        return result.value
+
+
+async def _make_request(
+    url: str,
+    params: dict[str, Any],
+    timeout: int,
+    model: Type[T],
+    priority: Priority,
+) -> T | None:
+    indexer = str(params.get("Tracker[]", ""))
+    start_time = time.monotonic()
+    async with semaphore.acquire(
+        name="jackett",
+        semaphores=[
+            semaphore.Semaphore("jackett", JACKETT_MAX_CONCURRENCY, JACKETT_USER_RESERVED),
+            semaphore.Semaphore(
+                f"jackett:{indexer}", JACKETT_MAX_CONCURRENCY_PER_INDEXER, JACKETT_USER_RESERVED
+            ),
+        ],
+        priority=priority,
+        wait=timeout,
+        lease=timedelta(seconds=timeout + 5),
+    ):
+        # the wait for the permit counts against the timeout
+        remaining = max(1, int(timeout - (time.monotonic() - start_time)))
+        return await _request(url, params, remaining, model, indexer)
+
 
-        params["apikey"] = JACKETT_API_KEY
-        log.debug("jackett request")
+async def _request(
+    url: str,
+    params: dict[str, Any],
+    timeout: int,
+    model: Type[T],
+    indexer: str,
+) -> T | None:
+    log.debug("jackett request")
+    start_time = time.monotonic()
+    try:
         with contextlib.suppress(asyncio.TimeoutError):
-            async with aiohttp.ClientSession() as session, session.get(
+            async with http.session(http.Upstream.Jackett).get(
                 url=f"{JACKETT_URL}{url}",
-                params=params,
+                params={**params, "apikey": JACKETT_API_KEY},
                 timeout=timeout,
                 headers={"Accept": "application/json"},
             ) as response:
                 if response.status == 200:
                     raw: dict[str, Any] = await response.json()
-                    res = model.model_validate(raw)
-                    await db.set_model(cache_key, res, JACKETT_CACHE_MINUTES)
-                    return res
+                    return model.model_validate(raw)
 
                 body = await response.text()
                 log.error(
@@ -167,3 +323,9 @@ async def make_request(
                     status=response.status,
                     body=body,
                 )
+        return None
+    finally:
+        # a cancelled request says nothing about the indexer
+        task = asyncio.current_task()
+        if not (task and task.cancelling()):
+            LATENCIES.observe(indexer, time.monotonic() - start_time)
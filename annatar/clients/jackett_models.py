@@ -64,4 +64,12 @@ class Indexer(BaseModel):
 class SearchResponse(BaseModel):
     Results: list[SearchResult] = []
     Indexers: list[Indexer] = []
+    # served from the cache without querying the indexers
     cached: bool = False
+    # the request failed or timed out
+    failed: bool = False
+    # no concurrency permit was free so the indexers were not queried
+    throttled: bool = False
+
+    def has_errors(self) -> bool:
+        return self.failed or any(i.Error for i in self.Indexers)
@@ -22,6 +22,9 @@ ENV = os.getenv("ENV", "dev")
 HOST: str = os.getenv("LISTEN_HOST", "0.0.0.0")
 JACKETT_INDEXERS_LIST = (os.getenv("JACKETT_INDEXERS") or DEFAULT_INDEXERS).split(",")
 PORT: int = int(os.getenv("LISTEN_PORT", "8000"))
+# "redis" or "memory". The in-process broker only reaches consumers in the
+# same process so it requires a single API worker.
+PUBSUB_BROKER = os.getenv("PUBSUB_BROKER", "redis")
 PROM_DIR = os.getenv(
     "PROMETHEUS_MULTIPROC_DIR", f"/tmp/annatar.metrics-{datetime.now().timestamp()}"
 )
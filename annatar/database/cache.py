@@ -0,0 +1,240 @@
+"""
+Bounded in-process (L1) cache in front of Redis for hot, read-mostly keys.
+
+Entries hold the decoded value (usually a pydantic model) so a hit skips both
+the Redis round trip and the JSON validation. Entries are copied when they
+are stored and when they are hit so callers can change the values they get
+without changing the cached ones. Each key family has its own size bound and
+TTL ceiling, and an entry never outlives the Redis key it was read from. Entries are only served while this process is subscribed to the
+Redis keyspace notifications of the cached families so a write or delete from
+any other process invalidates the local copy.
+"""
+
+import asyncio
+import copy
+import os
+import threading
+import time
+from collections import OrderedDict
+from datetime import timedelta
+from typing import Any
+
+import structlog
+from prometheus_client import Counter
+from pydantic import BaseModel
+from redis.exceptions import ResponseError
+
+from annatar import instrumentation
+
+log = structlog.get_logger(__name__)
+
+L1_CACHE_ENABLED = os.environ.get("L1_CACHE_ENABLED", "true").lower() == "true"
+
+# Keyspace notifications required for invalidation. K: keyspace channel,
+# g: generic commands (DEL, EXPIRE, RENAME, ...), $: string commands,
+# x: expired events, e: evicted events
+KEYSPACE_EVENTS = "Kg$xe"
+
+RECONNECT_MIN_DELAY = 0.1
+RECONNECT_MAX_DELAY = 5.0
+
+L1_CACHE_REQUEST = Counter(
+    name="l1_cache_request",
+    documentation="number of in-process cache requests",
+    labelnames=["family", "result"],
+    registry=instrumentation.registry(),
+)
+
+
+class Family:
+    """
+    A family of keys sharing a prefix, a size bound and a TTL ceiling
+    """
+
+    def __init__(self, name: str, prefix: str, max_entries: int, max_ttl: timedelta):
+        self.name = name
+        self.prefix = prefix
+        self.max_entries = max_entries
+        self.max_ttl = max_ttl
+        # bumped on every invalidation so reads that raced with it are not cached
+        self.generation = 0
+        # key -> (expiry of the entry, value, expiry of the Redis key)
+        self._entries: OrderedDict[str, tuple[float, Any, float | None]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Any | None:
+        found = self.get_with_ttl(key)
+        return found[0] if found else None
+
+    def get_with_ttl(self, key: str) -> tuple[Any, timedelta | None] | None:
+        """
+        The cached value and the remaining TTL of the Redis key it was read
+        from (None if it does not expire)
+        """
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] <= now:
+                del self._entries[key]
+                entry = None
+            if entry is not None:
+                self._entries.move_to_end(key)
+        L1_CACHE_REQUEST.labels(family=self.name, result="hit" if entry else "miss").inc()
+        if entry is None:
+            return None
+        _, value, redis_expiry = entry
+        return _copy(value), timedelta(seconds=redis_expiry - now) if redis_expiry else None
+
+    def put(self, key: str, value: Any, ttl: timedelta | None, generation: int) -> None:
+        """
+        Cache a value read from Redis. ttl is the remaining TTL of the Redis
+        key (None if it does not expire) and generation is the family
+        generation captured before the read.
+        """
+        now = time.monotonic()
+        seconds = self.max_ttl.total_seconds()
+        redis_expiry = None
+        if ttl is not None:
+            seconds = min(seconds, ttl.total_seconds())
+            redis_expiry = now + ttl.total_seconds()
+        if seconds <= 0 or not watching():
+            return
+        # the caller keeps the value it read so the entry needs its own copy
+        value = _copy(value)
+        with self._lock:
+            if generation != self.generation:
+                return
+            self._entries[key] = (now + seconds, value, redis_expiry)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, key: str) -> None:
+        with self._lock:
+            self.generation += 1
+            self._entries.pop(key, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self.generation += 1
+            self._entries.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+def _copy(value: Any) -> Any:
+    if isinstance(value, BaseModel):
+        return value.model_copy(deep=True)
+    return copy.deepcopy(value)
+
+
+FAMILIES: list[Family] = [
+    Family("cinemeta", "cinemeta:", max_entries=2048, max_ttl=timedelta(hours=1)),
+    Family("jackett", "jackett:", max_entries=512, max_ttl=timedelta(minutes=5)),
+    Family(
+        "premiumize_directdl",
+        "premiumize:directdl:",
+        max_entries=4096,
+        max_ttl=timedelta(minutes=30),
+    ),
+    Family(
+        "rd_instant_file_set",
+        "rd:instant_file_set:",
+        max_entries=4096,
+        max_ttl=timedelta(minutes=30),
+    ),
+]
+
+_watching = threading.Event()
+
+
+def family(key: str) -> Family | None:
+    return next((f for f in FAMILIES if key.startswith(f.prefix)), None)
+
+
+def watching() -> bool:
+    """
+    True while this process receives keyspace notifications. The cache is
+    bypassed otherwise because nothing would invalidate it.
+    """
+    return _watching.is_set()
+
+
+def clear() -> None:
+    for f in FAMILIES:
+        f.clear()
+
+
+def invalidate(channel: str) -> None:
+    """
+    Invalidate the key of a keyspace notification channel such as
+    __keyspace@0__:cinemeta:movie:tt0120737
+    """
+    _, _, key = channel.partition("__:")
+    if f := family(key):
+        f.invalidate(key)
+
+
+async def watch_invalidations() -> None:
+    """
+    Subscribe to keyspace notifications for every family and invalidate
+    local entries as their Redis keys change. Runs until cancelled and
+    resubscribes after connection errors. Returns if the server refuses to
+    enable the notifications, which leaves the cache disabled.
+    """
+    if not L1_CACHE_ENABLED:
+        log.info("l1 cache is disabled")
+        return
+
+    # imported here because the database module imports this one
+    from annatar.database import db
+
+    backoff = RECONNECT_MIN_DELAY
+    while True:
+        pubsub = db.client().pubsub()
+        try:
+            if not await enable_keyspace_events():
+                return
+            await pubsub.psubscribe(*[f"__keyspace@*__:{f.prefix}*" for f in FAMILIES])
+            _watching.set()
+            backoff = RECONNECT_MIN_DELAY
+            log.info("watching keyspace for l1 cache invalidation")
+            while True:
+                message = await pubsub.get_message(ignore_subscribe_messages=True, timeout=30)
+                if message and message.get("type") == "pmessage":
+                    invalidate(message["channel"].decode("utf-8"))
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            log.error("l1 cache invalidation stopped", retry_in=backoff, exc_info=e)
+        finally:
+            _watching.clear()
+            clear()
+            await pubsub.aclose()
+        await asyncio.sleep(backoff)
+        backoff = min(backoff * 2, RECONNECT_MAX_DELAY)
+
+
+async def enable_keyspace_events() -> bool:
+    """
+    Add the notifications required by the cache to the server configuration
+    while keeping any that are already enabled. Returns False if the server
+    refuses CONFIG, as managed Redis services often do.
+    """
+    from annatar.database import db
+
+    redis = db.client()
+    try:
+        current: str = (await redis.config_get("notify-keyspace-events")).get(
+            "notify-keyspace-events", ""
+        )
+        if isinstance(current, bytes):
+            current = current.decode("utf-8")
+        missing = "".join(c for c in KEYSPACE_EVENTS if c not in current)
+        if missing:
+            await redis.config_set("notify-keyspace-events", current + missing)
+    except ResponseError as e:
+        log.warning("l1 cache is disabled, keyspace events cannot be enabled", exc_info=e)
+        return False
+    return True
@@ -1,15 +1,23 @@
+import asyncio
+import hashlib
 import os
 import sys
+import threading
 from collections import defaultdict
 from datetime import timedelta
 from typing import Any, Callable, Coroutine, Optional, Type, TypeVar
+from weakref import WeakKeyDictionary
 
 import structlog
 from prometheus_client import Counter, Histogram
 from pydantic import BaseModel, ValidationError
-from redislite.client import StrictRedis
+from redis.asyncio import BlockingConnectionPool, ConnectionPool, StrictRedis
+from redis.asyncio.connection import UnixDomainSocketConnection
+from redis.exceptions import NoScriptError
+from redislite.client import StrictRedis as EmbeddedRedis
 
 from annatar import instrumentation
+from annatar.database import cache
 from annatar.database.lock import AsyncLockManager
 
 log = structlog.get_logger(__name__)
@@ -18,9 +26,91 @@ log = structlog.get_logger(__name__)
 DB_PATH = os.environ.get("DB_PATH", "annatar.db")
 REDIS_URL = os.environ.get("REDIS_URL", "")
 REDIS_FLAGS = {"socket_timeout": 3.0, "socket_connect_timeout": 3.0}
-redis: StrictRedis = (
-    StrictRedis(host=REDIS_URL, **REDIS_FLAGS) if REDIS_URL else StrictRedis(DB_PATH, **REDIS_FLAGS)
-)
+REDIS_MAX_CONNECTIONS = int(os.environ.get("REDIS_MAX_CONNECTIONS", "64"))
+# Seconds a command waits for a free connection when all of them are in use
+REDIS_POOL_TIMEOUT = float(os.environ.get("REDIS_POOL_TIMEOUT", "5"))
+
+# The embedded redislite server. Only used when REDIS_URL is not set. The
+# server lives as long as this object does, all commands go through the async
+# client over its unix socket.
+embedded: EmbeddedRedis | None = None
+_embedded_lock = threading.Lock()
+
+# asyncio connections are bound to the loop that created them and every
+# processor thread in run.py runs its own loop, so each loop gets its own pool.
+_clients: WeakKeyDictionary[asyncio.AbstractEventLoop, StrictRedis] = WeakKeyDictionary()
+
+
+def configure(redis_url: str = "", db_path: str | None = DB_PATH) -> None:
+    """
+    Point the database at a Redis server. An empty redis_url starts (or
+    reuses) an embedded redislite server backed by db_path. A db_path of None
+    uses a temporary database. The embedded server is kept if neither
+    changed.
+    """
+    global REDIS_URL, DB_PATH, embedded  # noqa: PLW0603
+    with _embedded_lock:
+        if (redis_url, db_path or "") != (REDIS_URL, DB_PATH):
+            # the previous embedded server shuts down once it is released
+            embedded = None
+        REDIS_URL = redis_url
+        DB_PATH = db_path or ""
+    _clients.clear()
+
+
+def _pool() -> ConnectionPool:
+    """
+    A pool of the running event loop. Commands wait for a free connection
+    when all of them are in use instead of failing.
+    """
+    if REDIS_URL:
+        return BlockingConnectionPool(
+            host=REDIS_URL,
+            max_connections=REDIS_MAX_CONNECTIONS,
+            timeout=REDIS_POOL_TIMEOUT,
+            **REDIS_FLAGS,
+        )
+    return BlockingConnectionPool(
+        connection_class=UnixDomainSocketConnection,
+        path=_embedded().socket_file,
+        max_connections=REDIS_MAX_CONNECTIONS,
+        timeout=REDIS_POOL_TIMEOUT,
+        **REDIS_FLAGS,
+    )
+
+
+def _embedded() -> EmbeddedRedis:
+    """
+    The embedded server shared by the event loops of every thread. Started
+    under a lock so threads do not start several servers on the same file.
+    """
+    global embedded  # noqa: PLW0603
+    with _embedded_lock:
+        if embedded is None:
+            embedded = EmbeddedRedis(DB_PATH or None, **REDIS_FLAGS)
+        return embedded
+
+
+def client() -> StrictRedis:
+    """
+    Returns the pooled async client for the running event loop
+    """
+    loop = asyncio.get_running_loop()
+    redis: StrictRedis | None = _clients.get(loop)
+    if redis is None:
+        redis = StrictRedis(connection_pool=_pool())
+        _clients[loop] = redis
+    return redis
+
+
+async def close() -> None:
+    """
+    Close the connection pool of the running event loop
+    """
+    redis: StrictRedis | None = _clients.pop(asyncio.get_running_loop(), None)
+    if redis is not None:
+        await redis.aclose(close_connection_pool=True)
+
 
 REQUEST_DURATION = Histogram(
     name="redis_command_duration_seconds",
@@ -49,27 +139,80 @@ async def measure_hits(key: str, task: Callable[[], Coroutine[None, None, T]]) -
 
 @REQUEST_DURATION.labels("PING").time()
 async def ping() -> bool:
-    redis.ping()
-    return True
+    return bool(await client().ping())
 
 
 TBaseModel = TypeVar("TBaseModel", bound=BaseModel)
 
 
 async def get_model(key: str, model: Type[TBaseModel]) -> Optional[TBaseModel]:
-    res: Optional[str] = await get(key)
-    if res is None:
-        return None
-    try:
-        return model.model_validate_json(res)
-    except ValidationError as e:
-        log.error("failed to validate model", key=key, model=model.__name__, json=res, exc_info=e)
+    return await _get_cached(key, model, _validator(key, model))
+
+
+async def get_model_with_ttl(
+    key: str, model: Type[TBaseModel]
+) -> Optional[tuple[TBaseModel, Optional[timedelta]]]:
+    """
+    get_model and the remaining TTL of the key (None if it does not expire)
+    """
+    return await _get_cached_with_ttl(key, model, _validator(key, model))
+
+
+def _validator(key: str, model: Type[TBaseModel]) -> Callable[[str], Optional[TBaseModel]]:
+    def validate(res: str) -> Optional[TBaseModel]:
+        try:
+            return model.model_validate_json(res)
+        except ValidationError as e:
+            log.error(
+                "failed to validate model", key=key, model=model.__name__, json=res, exc_info=e
+            )
+            return None
+
+    return validate
+
+
+async def _get_cached(
+    key: str,
+    kind: Type[T],
+    decode: Callable[[str], Optional[T]],
+) -> Optional[T]:
+    """
+    Read a key through the in-process cache if the key belongs to a cached
+    family. The decoded value is cached so hits skip decoding as well.
+    """
+    family = cache.family(key)
+    if family is None or not cache.watching():
+        res: Optional[str] = await measure_hits(key, lambda: _get(key))
+        return decode(res) if res is not None else None
+
+    found = await _get_cached_with_ttl(key, kind, decode)
+    return found[0] if found else None
+
+
+async def _get_cached_with_ttl(
+    key: str,
+    kind: Type[T],
+    decode: Callable[[str], Optional[T]],
+) -> Optional[tuple[T, Optional[timedelta]]]:
+    family = cache.family(key) if cache.watching() else None
+    generation = 0
+    if family is not None:
+        cached = family.get_with_ttl(key)
+        if cached and isinstance(cached[0], kind):
+            return cached
+        generation = family.generation
+    found = await measure_hits(key, lambda: _get_with_ttl(key))
+    if found is None:
         return None
+    value = decode(found[0])
+    if value is not None and family is not None:
+        family.put(key, value, found[1], generation)
+    return (value, found[1]) if value is not None else None
 
 
 @REQUEST_DURATION.labels("KEYS").time()
 async def list_keys(pattern: str) -> list[str]:
-    return [key.decode("utf-8") for key in redis.keys(pattern)]
+    return [key.decode("utf-8") for key in await client().keys(pattern)]
 
 
 @REQUEST_DURATION.labels("ZADD").time()
@@ -79,7 +222,7 @@ async def unique_list_add(
     score: int = 0,
     ttl: timedelta = timedelta(0),
 ) -> bool:
-    added: int = redis.zadd(name, {item: score})
+    added: int = await client().zadd(name, {item: score})
     if ttl.total_seconds() > 0:
         await set_ttl(name, ttl)
     return bool(added)
@@ -140,7 +283,7 @@ async def _unique_list_get_scored(
 ) -> list[ScoredItem]:
     try:
         results: dict[int, list[ScoredItem]] = defaultdict(list)
-        redis_items = redis.zrange(
+        redis_items = await client().zrange(
             name=name,
             start=max_score,
             end=min_score,
@@ -172,7 +315,7 @@ async def set_model(key: str, model: BaseModel, ttl: timedelta) -> bool:
 @REQUEST_DURATION.labels("EXPIRE").time()
 async def set_ttl(key: str, ttl: timedelta) -> bool:
     try:
-        if redis.expire(key, time=ttl):
+        if await client().expire(key, time=ttl):
             return True
         return False
     except Exception as e:
@@ -187,7 +330,7 @@ async def unique_count(key: str) -> int:
 @REQUEST_DURATION.labels("PFCOUNT").time()
 async def _unique_count(key: str) -> int:
     try:
-        return redis.pfcount(key)
+        return await client().pfcount(key)
     except Exception as e:
         log.error("failed to pfcount", key=key, exc_info=e)
         return False
@@ -196,7 +339,7 @@ async def _unique_count(key: str) -> int:
 @REQUEST_DURATION.labels("PFADD").time()
 async def unique_add(key: str, value: str) -> bool:
     try:
-        res = redis.pfadd(key, value)
+        res = await client().pfadd(key, value)
         return bool(res)
     except Exception as e:
         log.error("failed to pfadd", key=key, exc_info=e)
@@ -208,7 +351,7 @@ async def set(key: str, value: str, ttl: timedelta | None = None) -> bool:
     try:
         # ttl or None
         # TTL is sometimes already expired such as timedelta(0) but redis doesn't like that
-        return bool(redis.set(key, value, ex=ttl or None))
+        return bool(await client().set(key, value, ex=ttl or None))
     except Exception as e:
         log.error("failed to set cache", key=key, exc_info=e)
         return False
@@ -221,7 +364,7 @@ async def hset(key: str, field: str, value: str) -> bool:
 
 async def _hset(key: str, field: str, value: str) -> bool:
     try:
-        return bool(redis.hset(key, field, value))
+        return bool(await client().hset(key, field, value))
     except Exception as e:
         log.error("failed to hset cache", key=key, exc_info=e)
         return False
@@ -234,12 +377,147 @@ async def hmset(key: str, mapping: dict[Any, Any]) -> bool:
 
 async def _hmset(key: str, mapping: dict[Any, Any]) -> bool:
     try:
-        return bool(redis.hmset(key, mapping))
+        return bool(await client().hmset(key, mapping))
     except Exception as e:
         log.error("failed to hmset cache", key=key, exc_info=e)
         return False
 
 
+@REQUEST_DURATION.labels("HINCRBY").time()
+async def hincrby_many(key: str, amounts: dict[str, int], ttl: timedelta) -> bool:
+    """
+    HINCRBY many fields of a key and refresh its TTL in a single round trip
+    """
+    try:
+        async with client().pipeline(transaction=False) as pipe:
+            for field, amount in amounts.items():
+                pipe.hincrby(key, field, amount)
+            pipe.expire(key, ttl)
+            await pipe.execute()
+        return True
+    except Exception as e:
+        log.error("failed to hincrby", key=key, exc_info=e)
+        return False
+
+
+@REQUEST_DURATION.labels("INCR").time()
+async def incr(key: str, ttl: timedelta) -> int:
+    """
+    Increment a counter that expires ttl after its last increment
+    """
+    try:
+        async with client().pipeline(transaction=False) as pipe:
+            pipe.incr(key)
+            pipe.expire(key, ttl)
+            count, _ = await pipe.execute()
+        return int(count)
+    except Exception as e:
+        log.error("failed to incr", key=key, exc_info=e)
+        return 0
+
+
+@REQUEST_DURATION.labels("DEL").time()
+async def delete(key: str) -> bool:
+    try:
+        return bool(await client().delete(key))
+    except Exception as e:
+        log.error("failed to delete", key=key, exc_info=e)
+        return False
+
+
+@REQUEST_DURATION.labels("ZINCRBY").time()
+async def zincrby(name: str, item: str, amount: float) -> float:
+    try:
+        return float(await client().zincrby(name, amount, item))
+    except Exception as e:
+        log.error("failed to increment sorted set", name=name, exc_info=e)
+        return 0.0
+
+
+@REQUEST_DURATION.labels("ZDECAY").time()
+async def zdecay(name: str, factor: float, keep: int, min_score: float) -> None:
+    """
+    Multiply every score of the sorted set by factor, then drop items
+    scored below min_score and all but the keep highest scored
+    """
+    try:
+        async with client().pipeline(transaction=True) as pipe:
+            pipe.zunionstore(name, {name: factor})
+            pipe.zremrangebyscore(name, "-inf", f"({min_score}")
+            pipe.zremrangebyrank(name, 0, -(keep + 1))
+            await pipe.execute()
+    except Exception as e:
+        log.error("failed to decay sorted set", name=name, exc_info=e)
+
+
+@REQUEST_DURATION.labels("ZRANGE").time()
+async def zrange_desc(
+    name: str, min_score: float, offset: int, limit: int
+) -> list[tuple[str, float]]:
+    """
+    Items scored at least min_score, highest first
+    """
+    try:
+        items = await client().zrange(
+            name=name,
+            start="+inf",
+            end=min_score,
+            desc=True,
+            withscores=True,
+            byscore=True,
+            offset=offset,
+            num=limit,
+        )
+        return [(item.decode("utf-8"), float(score)) for item, score in items]
+    except Exception as e:
+        log.error("failed to get sorted set", name=name, exc_info=e)
+        return []
+
+
+@REQUEST_DURATION.labels("ZRANGE_MANY").time()
+async def zrange_desc_many(
+    names: list[str], min_score: float, offsets: list[int], limit: int
+) -> list[list[tuple[str, float]]]:
+    """
+    A page of the items scored at least min_score, highest first, of many
+    sorted sets in a single pipelined round trip
+    """
+    if not names:
+        return []
+    async with client().pipeline(transaction=False) as pipe:
+        for name, offset in zip(names, offsets, strict=True):
+            pipe.zrange(
+                name=name,
+                start="+inf",
+                end=min_score,
+                desc=True,
+                withscores=True,
+                byscore=True,
+                offset=offset,
+                num=limit,
+            )
+        pages = await pipe.execute()
+    return [[(item.decode("utf-8"), float(score)) for item, score in page] for page in pages]
+
+
+@REQUEST_DURATION.labels("HMSET_MANY").time()
+async def hmset_many(mappings: dict[str, dict[Any, Any]]) -> bool:
+    """
+    HSET the fields of many keys in a single pipelined round trip
+    """
+    if not mappings:
+        return True
+    try:
+        async with client().pipeline(transaction=False) as pipe:
+            for key, mapping in mappings.items():
+                pipe.hset(key, mapping=mapping)
+            await pipe.execute()
+        return True
+    except Exception as e:
+        log.error("failed to hmset_many cache", count=len(mappings), exc_info=e)
+        return False
+
+
 @REQUEST_DURATION.labels("HGET").time()
 async def hget(key: str, field: str) -> Optional[str]:
     return await measure_hits(key, lambda: _hget(key, field))
@@ -247,7 +525,7 @@ async def hget(key: str, field: str) -> Optional[str]:
 
 async def _hget(key: str, field: str) -> Optional[str]:
     try:
-        if res := redis.hget(key, field):
+        if res := await client().hget(key, field):
             return res.decode("utf-8")
         return None
     except Exception as e:
@@ -262,25 +540,68 @@ async def hgetall(key: str) -> dict[str, str]:
 
 async def _hgetall(key: str) -> dict[str, str]:
     try:
-        return {k.decode("utf-8"): v.decode("utf-8") for k, v in redis.hgetall(key).items()}
+        res = await client().hgetall(key)
+        return {k.decode("utf-8"): v.decode("utf-8") for k, v in res.items()}
     except Exception as e:
         log.error("failed to hgetall cache", key=key, exc_info=e)
         return {}
 
 
+@REQUEST_DURATION.labels("HMGET_MANY").time()
+async def hmget_many(keys: list[str], fields: list[str]) -> list[list[str | None]]:
+    """
+    HMGET the same fields of many keys in a single pipelined round trip
+    """
+    if not keys:
+        return []
+    async with client().pipeline(transaction=False) as pipe:
+        for key in keys:
+            pipe.hmget(key, fields)
+        results: list[list[bytes | None]] = await pipe.execute()
+    return [[v.decode("utf-8") if v is not None else None for v in r] for r in results]
+
+
+async def hgetall_many(keys: list[str]) -> list[dict[str, str]]:
+    """
+    HGETALL for many keys in a single pipelined round trip. Results are in
+    the same order as keys, missing keys are returned as empty dicts.
+    """
+    results = await _hgetall_many(keys)
+    for key, res in zip(keys, results, strict=True):
+        label: str = "hit" if res else "miss"
+        CACHE_REQUEST.labels(result=label).inc()
+        log.debug(f"cache {label}", key=key)
+    return results
+
+
+@REQUEST_DURATION.labels("HGETALL_MANY").time()
+async def _hgetall_many(keys: list[str]) -> list[dict[str, str]]:
+    if not keys:
+        return []
+    try:
+        async with client().pipeline(transaction=False) as pipe:
+            for key in keys:
+                pipe.hgetall(key)
+            results: list[dict[bytes, bytes]] = await pipe.execute()
+        return [{k.decode("utf-8"): v.decode("utf-8") for k, v in r.items()} for r in results]
+    except Exception as e:
+        log.error("failed to hgetall_many cache", count=len(keys), exc_info=e)
+        return [{} for _ in keys]
+
+
 @REQUEST_DURATION.labels("TTL").time()
 async def ttl(key: str) -> int:
-    return redis.ttl(key)
+    return await client().ttl(key)
 
 
 async def get(key: str) -> Optional[str]:
-    return await measure_hits(key, lambda: _get(key))
+    return await _get_cached(key, str, lambda res: res)
 
 
 @REQUEST_DURATION.labels("GET").time()
 async def _get(key: str) -> Optional[str]:
     try:
-        if res := redis.get(key):
+        if res := await client().get(key):
             return res.decode("utf-8")
         return None
     except Exception as e:
@@ -288,16 +609,62 @@ async def _get(key: str) -> Optional[str]:
         return None
 
 
+@REQUEST_DURATION.labels("GET_PTTL").time()
+async def _get_with_ttl(key: str) -> Optional[tuple[str, Optional[timedelta]]]:
+    """
+    GET a key along with its remaining TTL (None if it does not expire)
+    """
+    try:
+        async with client().pipeline(transaction=False) as pipe:
+            res, pttl = await pipe.get(key).pttl(key).execute()
+        if not res:
+            return None
+        return res.decode("utf-8"), timedelta(milliseconds=pttl) if pttl >= 0 else None
+    except Exception as e:
+        log.error("failed to get cache", key=key, exc_info=e)
+        return None
+
+
+@REQUEST_DURATION.labels("EVALSHA").time()
+async def eval_script(script: str, keys: list[str], args: list[Any]) -> Any:
+    """
+    Run a Lua script by its SHA and only send the body when the server does
+    not have it cached yet
+    """
+    sha = hashlib.sha1(script.encode("utf-8"), usedforsecurity=False).hexdigest()
+    try:
+        return await client().evalsha(sha, len(keys), *keys, *args)
+    except NoScriptError:
+        return await client().eval(script, len(keys), *keys, *args)
+
+
 async def try_lock(key: str, timeout: timedelta | int = 10) -> bool:
-    return bool(redis.set(key, "locked", nx=True, ex=timeout))
+    return bool(await client().set(key, "locked", nx=True, ex=timeout))
+
+
+async def try_lock_many(keys: list[str], timeout: timedelta | int = 10) -> list[bool]:
+    """
+    try_lock every key in a single pipelined round trip. No key is locked if
+    Redis fails.
+    """
+    if not keys:
+        return []
+    try:
+        async with client().pipeline(transaction=False) as pipe:
+            for key in keys:
+                pipe.set(key, "locked", nx=True, ex=timeout)
+            return [bool(locked) for locked in await pipe.execute()]
+    except Exception as e:
+        log.error("failed to lock keys", count=len(keys), exc_info=e)
+        return [False] * len(keys)
 
 
 async def unlock(key: str) -> bool:
-    return bool(redis.delete(key))
+    return bool(await client().delete(key))
 
 
 async def lock(key: str) -> AsyncLockManager:
-    return AsyncLockManager(redis, key)
+    return AsyncLockManager(client(), key)
 
 
 if REDIS_URL:
@@ -1,7 +1,7 @@
 import asyncio
 from uuid import uuid4
 
-from redislite.client import StrictRedis
+from redis.asyncio import StrictRedis
 
 
 class AsyncLockManager:
@@ -13,11 +13,11 @@ class AsyncLockManager:
 
     async def __aenter__(self):
         while True:
-            acquired = self.redis.set(self.lock_key, self.lock_value, nx=True, ex=10)
+            acquired = await self.redis.set(self.lock_key, self.lock_value, nx=True, ex=10)
             if acquired:
                 return self
             await asyncio.sleep(self.delay)
 
     async def __aexit__(self, exc_type, exc, tb):
-        if self.redis.get(self.lock_key) == self.lock_value:
-            self.redis.delete(self.lock_key)
+        if await self.redis.get(self.lock_key) == self.lock_value.encode():
+            await self.redis.delete(self.lock_key)
@@ -4,25 +4,92 @@ provides utility functions to store and retrieve keys information from the
 database using uniform naming conventions and data structures.
 """
 
+import asyncio
+import math
+import os
 import sys
 from datetime import timedelta
+from typing import NamedTuple
+from weakref import WeakKeyDictionary
 
 import structlog
+from prometheus_client import Histogram
+from pydantic import BaseModel
 
-from annatar import torrent
-from annatar.api.filters import Filter
+from annatar import instrumentation, title_parser, torrent
+from annatar.api.filters import Filter, features, mask
 from annatar.database import db
-from annatar.pubsub.events import TorrentAdded
+from annatar.pubsub.events import TorrentAdded, TorrentsAdded
 
 log = structlog.get_logger(__name__)
 
+# torrents added within this window of each other are written together
+ADD_TORRENTS_WINDOW = timedelta(milliseconds=int(os.getenv("ADD_TORRENTS_WINDOW_MS", "50")))
+# a batch this large is written without waiting for the window to end
+ADD_TORRENTS_MAX_BATCH = int(os.getenv("ADD_TORRENTS_MAX_BATCH", "1000"))
+
+ADD_TORRENTS_BATCH_SIZE = Histogram(
+    name="add_torrents_batch_size",
+    documentation="Torrents written to Redis together by the write-behind batcher",
+    buckets=(1, 5, 10, 25, 50, 100, 250, 500, 1000),
+    registry=instrumentation.registry(),
+)
+
+# Add each member to its list, refresh the TTL of the lists and write the
+# meta hash of the members that were new, in a single round trip.
+#
+# KEYS: the list and the meta hash of each torrent
+# ARGV: TTL of the lists in seconds (0 for none), then for each torrent its
+#       member, score, number of meta fields and the fields and values
+# Returns 1 for each torrent that was new, else 0
+ADD_TORRENTS_SCRIPT = """
+local ttl, arg, added, expired = tonumber(ARGV[1]), 2, {}, {}
+for i = 1, #KEYS, 2 do
+    local list, meta = KEYS[i], KEYS[i + 1]
+    local member, score, fields = ARGV[arg], ARGV[arg + 1], tonumber(ARGV[arg + 2])
+    local new = redis.call("ZADD", list, score, member)
+    if new == 1 and fields > 0 then
+        redis.call("HSET", meta, unpack(ARGV, arg + 3, arg + 2 + fields * 2))
+    end
+    if ttl > 0 and not expired[list] then
+        redis.call("EXPIRE", list, ttl)
+        expired[list] = true
+    end
+    table.insert(added, new)
+    arg = arg + 3 + fields * 2
+end
+return added
+"""
+
+# torrents read from each list per round trip while listing torrents
+LIST_PAGE_SIZE = int(os.getenv("LIST_TORRENTS_PAGE_SIZE", "100"))
+
+
+class Fields:
+    """
+    Fields of the torrent metadata hash
+    """
+
+    TITLE = "title"
+    # TorrentMeta parsed from the title at ingest time
+    META = "meta"
+    META_VERSION = "meta_version"
+    # bitmask of the filters that apply to the torrent
+    FEATURES = "features"
+    # the seasons and episodes of a series the torrent covers, see
+    # encode_coverage
+    SEASONS = "seasons"
+    EPISODES = "episodes"
+
 
 class Keys:
+    TORRENT_PREFIX = "torrent:v1:meta:"
+
     @staticmethod
     def torrent(info_hash: str) -> str:
         if not info_hash:
             raise ValueError("info_hash is required")
-        return f"torrent:v1:meta:{info_hash.upper()}"
+        return f"{Keys.TORRENT_PREFIX}{info_hash.upper()}"
 
     @staticmethod
     def torrents(imdb: str, season: int | None = None, episode: int | None = None) -> str:
@@ -35,41 +102,213 @@ class Keys:
             cache_key = f"{cache_key}:{season}"
         return cache_key
 
+    @staticmethod
+    def season_torrents(imdb: str, season: int) -> str:
+        """
+        The episodes and season packs of one season of a series
+        """
+        if not imdb:
+            raise ValueError("imdb is required")
+        return f"torrents:v2:{imdb}:{season}"
 
-async def add_torrent(
-    info_hash: str,
-    title: str,
-    imdb: str,
-    score: int,
-    ttl: timedelta,
-    category: str,
-    size: int,
-    indexer: str,
-    season: int | None = None,
-    episode: int | None = None,
-) -> bool:
-    added = await db.unique_list_add(
-        name=Keys.torrents(imdb, season, episode),
-        item=info_hash,
-        score=score,
-        ttl=ttl,
-    )
-    if added:
-        log.debug("added torrent", info_hash=info_hash, title=title, imdb=imdb)
-        await set_torrent_title(info_hash, title)
-        await TorrentAdded.publish(
-            TorrentAdded(
-                info_hash=info_hash,
-                title=title,
-                imdb=imdb,
-                season=season,
-                episode=episode,
-                category=category,
-                size=size,
-                indexer=indexer,
+    @staticmethod
+    def series_packs(imdb: str) -> str:
+        """
+        The packs of a series that cover more than one season
+        """
+        if not imdb:
+            raise ValueError("imdb is required")
+        return f"torrents:v2:{imdb}:packs"
+
+    @staticmethod
+    def list_for(t: "NewTorrent") -> str:
+        """
+        The list a torrent is stored in. Series torrents are stored once in
+        the list of their season, or of the series if they cover several.
+        """
+        if len(t.seasons) > 1:
+            return Keys.series_packs(t.imdb)
+        if t.seasons:
+            return Keys.season_torrents(t.imdb, t.seasons[0])
+        return Keys.torrents(t.imdb, t.season, t.episode)
+
+    @staticmethod
+    def lists_for(imdb: str, season: int | None = None, episode: int | None = None) -> list[str]:
+        """
+        The lists that may hold torrents of a movie, season or episode. The
+        per episode lists written before packs were stored once are read
+        until they expire.
+        """
+        if not season:
+            return [Keys.torrents(imdb)]
+        return list(
+            dict.fromkeys(
+                [
+                    Keys.season_torrents(imdb, season),
+                    Keys.series_packs(imdb),
+                    Keys.torrents(imdb, season, episode),
+                    Keys.torrents(imdb, season),
+                ]
             )
         )
-    return bool(added)
+
+
+class NewTorrent(BaseModel):
+    info_hash: str
+    title: str
+    imdb: str
+    score: int
+    category: str
+    size: int
+    indexer: str
+    season: int | None = None
+    episode: int | None = None
+    # every season and episode a series torrent covers
+    seasons: list[int] = []
+    episodes: list[int] = []
+    meta: torrent.TorrentMeta | None = None
+
+
+async def add_torrents(torrents: list[NewTorrent], ttl: timedelta) -> list[NewTorrent]:
+    """
+    Add many torrents. They are written together with the torrents other
+    callers add within ADD_TORRENTS_WINDOW, see TorrentWriter. Returns the
+    new torrents.
+    """
+    if not torrents:
+        return []
+    return await writer().add(torrents, ttl)
+
+
+async def write_torrents(torrents: list[NewTorrent], ttl: timedelta) -> list[NewTorrent]:
+    """
+    Write torrents to their lists and their meta to Redis in one round trip.
+    Returns the torrents that were new.
+    """
+    keys: list[str] = []
+    args: list[str | int] = [max(0, math.ceil(ttl.total_seconds()))]
+    for t in torrents:
+        meta = {
+            **(encode_torrent_meta(t.title, t.meta) if t.meta else {Fields.TITLE: t.title}),
+            **encode_coverage(t.seasons, t.episodes),
+        }
+        keys += [Keys.list_for(t), Keys.torrent(t.info_hash)]
+        args += [t.info_hash, t.score, len(meta), *[x for kv in meta.items() for x in kv]]
+    results: list[int] = await db.eval_script(ADD_TORRENTS_SCRIPT, keys=keys, args=args)
+    return [t for t, new in zip(torrents, results, strict=True) if new]
+
+
+async def publish_added(added: list[NewTorrent]) -> None:
+    await TorrentsAdded.publish(
+        TorrentsAdded(
+            torrents=[
+                TorrentAdded(
+                    info_hash=t.info_hash,
+                    title=t.title,
+                    imdb=t.imdb,
+                    season=t.season,
+                    episode=t.episode,
+                    seasons=t.seasons,
+                    episodes=t.episodes,
+                    category=t.category,
+                    size=t.size,
+                    indexer=t.indexer,
+                )
+                for t in added
+            ]
+        )
+    )
+
+
+class _PendingAdd(NamedTuple):
+    torrents: list[NewTorrent]
+    ttl: timedelta
+    done: asyncio.Future[list[NewTorrent]]
+
+
+class TorrentWriter:
+    """
+    Write-behind batcher of added torrents. The torrents added within
+    ADD_TORRENTS_WINDOW, e.g. by the consumers processing the results of
+    concurrent searches, are written in one round trip per TTL and
+    announced in one TorrentsAdded notification. Callers wait for the
+    write of their torrents.
+    """
+
+    def __init__(self):
+        self._pending: list[_PendingAdd] = []
+        self._size = 0
+        self._timer: asyncio.TimerHandle | None = None
+        self._writes: set[asyncio.Task[None]] = set()
+
+    async def add(self, torrents: list[NewTorrent], ttl: timedelta) -> list[NewTorrent]:
+        loop = asyncio.get_running_loop()
+        done: asyncio.Future[list[NewTorrent]] = loop.create_future()
+        self._pending.append(_PendingAdd(torrents, ttl, done))
+        self._size += len(torrents)
+        if self._size >= ADD_TORRENTS_MAX_BATCH:
+            self.flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(ADD_TORRENTS_WINDOW.total_seconds(), self.flush)
+        # the write goes ahead if the caller is cancelled
+        return await asyncio.shield(done)
+
+    def flush(self) -> None:
+        """
+        Start writing the pending torrents
+        """
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if not self._pending:
+            return
+        pending, self._pending, self._size = self._pending, [], 0
+        task = asyncio.create_task(self._write(pending))
+        self._writes.add(task)
+        task.add_done_callback(self._writes.discard)
+
+    async def _write(self, pending: list[_PendingAdd]) -> None:
+        try:
+            new: set[int] = set()
+            for ttl in dict.fromkeys(p.ttl for p in pending):
+                torrents = [t for p in pending if p.ttl == ttl for t in p.torrents]
+                ADD_TORRENTS_BATCH_SIZE.observe(len(torrents))
+                new.update(id(t) for t in await write_torrents(torrents, ttl))
+            added = [[t for t in p.torrents if id(t) in new] for p in pending]
+            if new:
+                all_added = [t for a in added for t in a]
+                log.debug("added torrents", count=len(all_added), imdb=all_added[0].imdb)
+                await publish_added(all_added)
+        except Exception as e:
+            # the callers get the error so the messages they process are retried
+            dropped = [t for p in pending for t in p.torrents]
+            log.error(
+                "failed to add torrents",
+                count=len(dropped),
+                imdb=sorted({t.imdb for t in dropped}),
+                info_hashes=[t.info_hash for t in dropped],
+                exc_info=e,
+            )
+            for p in pending:
+                if not p.done.done():
+                    p.done.set_exception(e)
+            return
+        for p, a in zip(pending, added, strict=True):
+            if not p.done.done():
+                p.done.set_result(a)
+
+
+_writers: WeakKeyDictionary[asyncio.AbstractEventLoop, TorrentWriter] = WeakKeyDictionary()
+
+
+def writer() -> TorrentWriter:
+    """
+    Returns the torrent writer of the running event loop
+    """
+    loop = asyncio.get_running_loop()
+    if loop not in _writers:
+        _writers[loop] = TorrentWriter()
+    return _writers[loop]
 
 
 async def list_torrents(
@@ -79,44 +318,134 @@ async def list_torrents(
     episode: int | None = None,
     filters: list[Filter] | None = None,
 ) -> list[str]:
-    if filters is None:
-        filters = []
-    keys = set([Keys.torrents(imdb, season, episode), Keys.torrents(imdb, season)])
+    """
+    The info hashes of the torrents of a movie, or of the torrents that
+    cover a season or episode of a series, by descending score
+    """
+    keys = Keys.lists_for(imdb, season, episode)
     log.debug("looking up torrents", keys=keys, limit=limit)
+    results = await list_filtered_torrents(
+        keys, filters or [], limit, season=season or 0, episode=episode or 0
+    )
+    log.info("found torrents", count=len(results))
+    return [item.value for item in results if len(item.value) == 40]
+
+
+async def list_filtered_torrents(
+    keys: list[str],
+    filters: list[Filter],
+    limit: int,
+    season: int = 0,
+    episode: int = 0,
+) -> list[db.ScoredItem]:
+    """
+    List the highest scored torrents of keys that cover the season and
+    episode and that none of the filters apply to. The lists are merged by
+    descending score a page at a time and read no further than needed to
+    find limit torrents. Torrents stored without their coverage, e.g. in the
+    lists of a single episode, cover every season and episode they are
+    listed for.
+    """
+    filter_mask = mask(filters)
+    offsets = dict.fromkeys(keys, 0)
+    scores: dict[str, float] = {}
+    checked: set[str] = set()
     results: list[db.ScoredItem] = []
-    for key in keys:
-        for item in await db.unique_list_get_scored(name=key):
-            if filters:
-                title = await get_torrent_title(item.value)
-                if not title:
-                    continue
-                meta = torrent.TorrentMeta.parse_title(title)
-                if any(f.apply(meta) for f in filters):
-                    log.debug(
-                        "filtered torrent", title=title, filters=[f.id for f in filters], meta=meta
-                    )
-                    continue
-            results.append(item)
+    while len(results) < limit:
+        # members of the lists left to read all score at most this much
+        frontier = -math.inf
+        if offsets:
+            names = list(offsets)
+            pages = await db.zrange_desc_many(
+                names, 0, [offsets[name] for name in names], LIST_PAGE_SIZE
+            )
+            for name, page in zip(names, pages, strict=True):
+                for member, score in page:
+                    scores[member] = max(score, scores.get(member, score))
+                if len(page) < LIST_PAGE_SIZE:
+                    del offsets[name]
+                else:
+                    offsets[name] += len(page)
+                    frontier = max(frontier, page[-1][1])
+        ready = sorted(
+            (m for m, score in scores.items() if score > frontier and m not in checked),
+            key=lambda m: (-scores[m], m),
+        )
+        checked.update(ready)
+        for info_hash in await match_torrents(ready, filters, filter_mask, season, episode):
+            results.append(db.ScoredItem(value=info_hash, score=int(scores[info_hash])))
             if len(results) >= limit:
                 break
+        if not offsets:
+            break
+    return results
 
-    log.info("found torrents", count=len(results))
-    return list(
-        [
-            item.value
-            for item in sorted(results, key=lambda x: x.score, reverse=True)
-            if len(item.value) == 40
-        ]
+
+async def match_torrents(
+    info_hashes: list[str],
+    filters: list[Filter],
+    filter_mask: int,
+    season: int,
+    episode: int,
+) -> list[str]:
+    """
+    The torrents that cover the season and episode and that none of the
+    filters apply to, in the given order. The stored coverage and feature
+    bitmasks are read in one round trip. Torrents stored without current
+    features are parsed.
+    """
+    if not info_hashes or (not season and not filter_mask):
+        return info_hashes
+    rows = await db.hmget_many(
+        [Keys.torrent(info_hash) for info_hash in info_hashes],
+        [Fields.FEATURES, Fields.META_VERSION, Fields.SEASONS, Fields.EPISODES],
     )
+    matched: list[tuple[str, bool]] = []
+    for info_hash, (stored, version, seasons, episodes) in zip(info_hashes, rows, strict=True):
+        if season and not (covers(seasons, season) and covers(episodes, episode)):
+            continue
+        known = not filter_mask or (
+            stored is not None and version == str(torrent.META_SCHEMA_VERSION)
+        )
+        if known and int(stored or 0) & filter_mask:
+            continue
+        matched.append((info_hash, known))
+
+    unknown = [info_hash for info_hash, known in matched if not known]
+    metas = await get_parsed_torrent_meta_many(unknown) if unknown else {}
+    results: list[str] = []
+    for info_hash, known in matched:
+        if not known:
+            meta = metas.get(info_hash)
+            if not meta:
+                continue
+            if features(meta) & filter_mask:
+                log.debug(
+                    "filtered torrent",
+                    title=meta.raw_title,
+                    filters=[f.id for f in filters],
+                    meta=meta,
+                )
+                continue
+        results.append(info_hash)
+    return results
+
+
+def covers(coverage: str | None, number: int) -> bool:
+    """
+    Whether a coverage list of encode_coverage holds the number. Torrents
+    without one cover every season and episode.
+    """
+    return coverage is None or f",{number}," in coverage
 
 
 async def set_torrent_title(info_hash: str, title: str) -> bool:
-    return await db.hset(Keys.torrent(info_hash), "title", title)
+    return await db.hset(Keys.torrent(info_hash), Fields.TITLE, title)
 
 
 async def get_torrent_title(info_hash: str) -> str | None:
     meta = await get_torrent_meta(info_hash)
-    return meta.get("title") if meta else None
+    return meta.get(Fields.TITLE) if meta else None
 
 
 async def set_torrent_meta(info_hash: str, meta: dict[str, str]) -> bool:
@@ -125,3 +454,74 @@ async def set_torrent_meta(info_hash: str, meta: dict[str, str]) -> bool:
 
 async def get_torrent_meta(info_hash: str) -> dict[str, str] | None:
     return await db.hgetall(Keys.torrent(info_hash))
+
+
+async def get_torrent_meta_many(info_hashes: list[str]) -> dict[str, dict[str, str]]:
+    """
+    Get the metadata of many torrents in a single round trip. Torrents
+    without metadata are omitted from the result.
+    """
+    metas = await db.hgetall_many([Keys.torrent(info_hash) for info_hash in info_hashes])
+    return {info_hash: meta for info_hash, meta in zip(info_hashes, metas, strict=True) if meta}
+
+
+def encode_torrent_meta(title: str, meta: torrent.TorrentMeta) -> dict[str, str]:
+    return {
+        Fields.TITLE: title,
+        Fields.META: meta.dump_compact(),
+        Fields.META_VERSION: str(torrent.META_SCHEMA_VERSION),
+        Fields.FEATURES: str(features(meta)),
+    }
+
+
+def encode_coverage(seasons: list[int], episodes: list[int]) -> dict[str, str]:
+    """
+    The seasons and episodes a torrent covers as comma delimited lists, e.g.
+    ",1,2,3,", that covers searches for ",<season>,". Empty lists
+    are left out: they cover any season or episode.
+    """
+    coverage: dict[str, str] = {}
+    if seasons:
+        coverage[Fields.SEASONS] = f",{','.join(map(str, seasons))},"
+    if episodes:
+        coverage[Fields.EPISODES] = f",{','.join(map(str, episodes))},"
+    return coverage
+
+
+def decode_torrent_meta(meta: dict[str, str]) -> torrent.TorrentMeta | None:
+    """
+    Load the TorrentMeta stored with a torrent. Returns None if it was never
+    stored or was stored by an older schema version.
+    """
+    title = meta.get(Fields.TITLE)
+    if not title or meta.get(Fields.META_VERSION) != str(torrent.META_SCHEMA_VERSION):
+        return None
+    try:
+        return torrent.TorrentMeta.load_compact(meta.get(Fields.META, "{}"), raw_title=title)
+    except ValueError as e:
+        log.warning("failed to load stored torrent meta", title=title, exc_info=e)
+        return None
+
+
+async def get_parsed_torrent_meta_many(info_hashes: list[str]) -> dict[str, torrent.TorrentMeta]:
+    """
+    Get the parsed TorrentMeta of many torrents. Entries stored without a
+    current parsed form are parsed from their title and written back so they
+    are only parsed once.
+    """
+    parsed: dict[str, torrent.TorrentMeta] = {}
+    titles: dict[str, str] = {}
+    for info_hash, meta in (await get_torrent_meta_many(info_hashes)).items():
+        if decoded := decode_torrent_meta(meta):
+            parsed[info_hash] = decoded
+        elif title := meta.get(Fields.TITLE):
+            titles[info_hash] = title
+    stale: dict[str, dict[str, str]] = {}
+    metas = await title_parser.parse_titles(list(titles.values()))
+    for (info_hash, title), meta in zip(titles.items(), metas, strict=True):
+        parsed[info_hash] = meta
+        stale[Keys.torrent(info_hash)] = encode_torrent_meta(title, meta)
+    if stale:
+        log.debug("upgrading stored torrent meta", count=len(stale))
+        await db.hmset_many(stale)
+    return parsed
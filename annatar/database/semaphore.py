@@ -0,0 +1,167 @@
+"""
+Counting semaphores shared by every thread and process through Redis.
+
+Each semaphore is a sorted set of the permits it handed out, scored by when
+they expire so permits of a crashed holder are reclaimed. A permit is only
+granted if every semaphore it is requested from has room, e.g. a global
+limit and a per-indexer one. Background work may only use part of each
+limit so that user requests always find a free permit quickly.
+"""
+
+import asyncio
+import contextlib
+import math
+import random
+import time
+import uuid
+from datetime import timedelta
+from enum import Enum
+from typing import AsyncIterator
+
+import structlog
+from prometheus_client import Counter, Histogram
+
+from annatar import instrumentation
+from annatar.database import db
+
+log = structlog.get_logger(__name__)
+
+# KEYS: the semaphores
+# ARGV: now (ms), expiry of the permit (ms), permit id, then the limit of
+#       each semaphore
+# Returns 1 if the permit was granted
+ACQUIRE_SCRIPT = """
+local now, expires, permit = tonumber(ARGV[1]), tonumber(ARGV[2]), ARGV[3]
+for i, key in ipairs(KEYS) do
+    redis.call("ZREMRANGEBYSCORE", key, "-inf", now)
+    if redis.call("ZCARD", key) >= tonumber(ARGV[3 + i]) then
+        return 0
+    end
+end
+for _, key in ipairs(KEYS) do
+    redis.call("ZADD", key, expires, permit)
+    if redis.call("PTTL", key) < expires - now then
+        redis.call("PEXPIREAT", key, expires)
+    end
+end
+return 1
+"""
+
+SEMAPHORE_WAIT = Histogram(
+    name="semaphore_wait_seconds",
+    documentation="Time spent waiting for a semaphore permit",
+    labelnames=["name", "priority", "acquired"],
+    buckets=(0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60),
+    registry=instrumentation.registry(),
+)
+
+SEMAPHORE_ERRORS = Counter(
+    name="semaphore_errors",
+    documentation="Permits granted without the semaphore because Redis failed",
+    labelnames=["name"],
+    registry=instrumentation.registry(),
+)
+
+
+class Priority(str, Enum):
+    USER = "user"
+    BACKGROUND = "background"
+
+    def __str__(self):
+        return self.value
+
+
+# polling interval while waiting for a permit, doubled up to the maximum
+POLL_INTERVAL = {
+    Priority.USER: (0.02, 0.1),
+    Priority.BACKGROUND: (0.1, 1.0),
+}
+
+
+class Semaphore:
+    """
+    A limit of concurrent holders. reserved is the fraction of the limit
+    only user requests can use.
+    """
+
+    def __init__(self, key: str, limit: int, reserved: float = 0.0):
+        self.key = f"semaphore:v1:{key}"
+        self.limit = limit
+        self.reserved = reserved
+
+    def limit_for(self, priority: Priority) -> int:
+        if priority == Priority.USER:
+            return self.limit
+        return max(1, math.floor(self.limit * (1 - self.reserved)))
+
+
+class Timeout(Exception):
+    """
+    No permit was free before the wait ran out
+    """
+
+
+@contextlib.asynccontextmanager
+async def acquire(
+    name: str,
+    semaphores: list[Semaphore],
+    priority: Priority,
+    wait: float,
+    lease: timedelta,
+) -> AsyncIterator[None]:
+    """
+    Hold a permit of every semaphore for the duration of the block. Waits up
+    to wait seconds for one and raises Timeout otherwise. The permit is
+    released when the block exits or after lease if the holder dies. If
+    Redis is unavailable the block runs without a permit.
+    """
+    permit = uuid.uuid4().hex
+    keys = [s.key for s in semaphores]
+    start = time.monotonic()
+    interval, max_interval = POLL_INTERVAL[priority]
+    while True:
+        try:
+            now = int(time.time() * 1000)
+            granted = await db.eval_script(
+                ACQUIRE_SCRIPT,
+                keys=keys,
+                args=[
+                    now,
+                    now + int(lease.total_seconds() * 1000),
+                    permit,
+                    *[s.limit_for(priority) for s in semaphores],
+                ],
+            )
+        except Exception as e:
+            log.error("failed to acquire semaphore", name=name, exc_info=e)
+            SEMAPHORE_ERRORS.labels(name=name).inc()
+            keys = []
+            granted = True
+        waited = time.monotonic() - start
+        if granted:
+            break
+        if waited + interval > wait:
+            SEMAPHORE_WAIT.labels(name=name, priority=priority, acquired=False).observe(waited)
+            raise Timeout(f"no {name} permit after {waited:.1f}s")
+        # jittered so waiters do not poll in lockstep
+        await asyncio.sleep(interval * random.uniform(0.5, 1.0))
+        interval = min(interval * 2, max_interval)
+
+    SEMAPHORE_WAIT.labels(name=name, priority=priority, acquired=True).observe(waited)
+    try:
+        yield
+    finally:
+        await release(keys, permit)
+
+
+async def release(keys: list[str], permit: str) -> None:
+    if not keys:
+        return
+    try:
+        async with db.client().pipeline(transaction=False) as pipe:
+            for key in keys:
+                pipe.zrem(key, permit)
+            await pipe.execute()
+    except Exception as e:
+        # the permit expires with its lease
+        log.error("failed to release semaphore", keys=keys, exc_info=e)
@@ -0,0 +1,129 @@
+"""
+Coalesce concurrent cache misses for the same key into one upstream request.
+
+Within a process every caller awaits the same task. Across processes the
+first one to take a short Redis lease fetches the value, which it stores in
+the cache, and the others wait for its completion notification and then read
+the cache. Waiters fetch the value themselves if the lease expires or the
+leader did not store anything.
+"""
+
+import asyncio
+import math
+import time
+import uuid
+from datetime import timedelta
+from typing import Any, Awaitable, Callable, TypeVar
+from weakref import WeakKeyDictionary
+
+import structlog
+from prometheus_client import Counter
+
+from annatar import instrumentation
+from annatar.database import db
+
+log = structlog.get_logger(__name__)
+
+T = TypeVar("T")
+
+SINGLEFLIGHT_CALLS = Counter(
+    name="singleflight_calls",
+    documentation="Cache misses by whether they fetched or waited for another request",
+    labelnames=["name", "result"],
+    registry=instrumentation.registry(),
+)
+
+# KEYS: the lease
+# ARGV: the token of the leader
+# Deletes the lease only if the leader still holds it
+RELEASE_SCRIPT = """
+if redis.call("GET", KEYS[1]) == ARGV[1] then
+    return redis.call("DEL", KEYS[1])
+end
+return 0
+"""
+
+_flights: WeakKeyDictionary[asyncio.AbstractEventLoop, dict[str, asyncio.Task[Any]]] = (
+    WeakKeyDictionary()
+)
+
+
+async def do(
+    name: str,
+    key: str,
+    fetch: Callable[[], Awaitable[T | None]],
+    cached: Callable[[], Awaitable[T | None]],
+    lease: timedelta,
+) -> T | None:
+    """
+    Returns the result of fetch, sharing it with concurrent callers for the
+    same key. fetch must store its result where cached reads it from.
+    Cancelling a caller does not cancel the shared request.
+    """
+    flights = _flights.setdefault(asyncio.get_running_loop(), {})
+    task = flights.get(key)
+    if task is None:
+        task = asyncio.create_task(_fly(name, key, fetch, cached, lease))
+        flights[key] = task
+        task.add_done_callback(lambda t: flights.pop(key) if flights.get(key) is t else None)
+    else:
+        SINGLEFLIGHT_CALLS.labels(name=name, result="process").inc()
+    return await asyncio.shield(task)
+
+
+async def _fly(
+    name: str,
+    key: str,
+    fetch: Callable[[], Awaitable[T | None]],
+    cached: Callable[[], Awaitable[T | None]],
+    lease: timedelta,
+) -> T | None:
+    lease_key = f"singleflight:lease:{key}"
+    channel = f"singleflight:done:{key}"
+    # the lease may expire while fetching and be taken by another process,
+    # so it is only released with the token it was taken with
+    token = uuid.uuid4().hex
+    # the lease is held for whole seconds
+    if await db.client().set(
+        lease_key, token, nx=True, ex=max(1, math.ceil(lease.total_seconds()))
+    ):
+        SINGLEFLIGHT_CALLS.labels(name=name, result="leader").inc()
+        try:
+            return await fetch()
+        finally:
+            await db.eval_script(RELEASE_SCRIPT, keys=[lease_key], args=[token])
+            await db.client().publish(channel, "done")
+
+    log.debug("waiting for request in another process", key=key)
+    result = await _wait(channel, cached, lease)
+    if result is not None:
+        SINGLEFLIGHT_CALLS.labels(name=name, result="cluster").inc()
+        return result
+    SINGLEFLIGHT_CALLS.labels(name=name, result="fallback").inc()
+    return await fetch()
+
+
+async def _wait(
+    channel: str,
+    cached: Callable[[], Awaitable[T | None]],
+    lease: timedelta,
+) -> T | None:
+    """
+    Wait for the completion notification, or the lease to expire, and read
+    the cache
+    """
+    pubsub = db.client().pubsub()
+    try:
+        await pubsub.subscribe(channel)
+        # the leader may have finished before the subscription
+        if (result := await cached()) is not None:
+            return result
+        deadline = time.monotonic() + lease.total_seconds()
+        while (remaining := deadline - time.monotonic()) > 0:
+            if await pubsub.get_message(ignore_subscribe_messages=True, timeout=remaining):
+                break
+    except Exception as e:
+        log.warning("failed to wait for request in another process", exc_info=e)
+    finally:
+        await pubsub.aclose()
+    return await cached()
@@ -0,0 +1,173 @@
+"""
+Stale-while-revalidate caching of upstream lookups.
+
+Values stay in Redis for longer than they are fresh. Once a value is past
+its fresh period it is still served while one process refreshes it in the
+background, so callers only wait for the upstream on a cold miss. Lookups
+that found nothing are remembered for a short time so a missing title or a
+timing out indexer is not queried again by every request.
+"""
+
+import asyncio
+import math
+from datetime import timedelta
+from enum import Enum
+from typing import Awaitable, Callable, Generic, NamedTuple, Type, TypeVar
+
+import structlog
+from prometheus_client import Counter
+from pydantic import BaseModel
+
+from annatar import instrumentation
+from annatar.database import db, singleflight
+
+log = structlog.get_logger(__name__)
+
+T = TypeVar("T", bound=BaseModel)
+
+SWR_CACHE_REQUEST = Counter(
+    name="swr_cache_request",
+    documentation="Cached upstream lookups by whether they were fresh, stale, negative or missed",
+    labelnames=["name", "result"],
+    registry=instrumentation.registry(),
+)
+
+
+class Hit(str, Enum):
+    FRESH = "fresh"
+    # served while it is refreshed in the background
+    STALE = "stale"
+    # the upstream found nothing the last time
+    NEGATIVE = "negative"
+    MISS = "miss"
+
+    def __str__(self):
+        return self.value
+
+
+class Policy(NamedTuple):
+    # how long a value is served without refreshing it
+    fresh: timedelta
+    # how long after that it is served while refreshing it
+    stale: timedelta
+    # how long a lookup that found nothing is remembered
+    negative: timedelta
+
+
+class Result(NamedTuple, Generic[T]):
+    value: T | None
+    hit: Hit
+
+
+def negative_key(key: str) -> str:
+    return f"swr:negative:{key}"
+
+
+_refreshes: set[asyncio.Task[None]] = set()
+
+
+async def get(
+    name: str,
+    key: str,
+    model: Type[T],
+    fetch: Callable[[], Awaitable[T | None]],
+    policy: Policy,
+    lease: timedelta,
+    empty: Callable[[T], bool] = lambda _: False,
+    refresh: Callable[[], Awaitable[T | None]] | None = None,
+) -> Result[T]:
+    """
+    The cached value of key, fetched on a miss and refreshed in the
+    background with refresh (fetch by default) once stale. fetch returns
+    None if the upstream has nothing. Values for which empty is true are
+    cached like None but still returned. Concurrent misses share one fetch.
+    """
+    found = await lookup(key, model, policy, empty)
+    if found is None:
+        fetched = await singleflight.do(
+            name=name,
+            key=key,
+            fetch=lambda: _fill(key, fetch, policy, empty),
+            cached=lambda: lookup(key, model, policy, empty),
+            lease=lease,
+        )
+        found = Result(fetched.value if fetched else None, Hit.MISS)
+    elif found.hit == Hit.STALE:
+        revalidate(key, refresh or fetch, policy, lease, empty)
+    SWR_CACHE_REQUEST.labels(name=name, result=found.hit).inc()
+    return found
+
+
+async def lookup(
+    key: str,
+    model: Type[T],
+    policy: Policy,
+    empty: Callable[[T], bool],
+) -> Result[T] | None:
+    found = await db.get_model_with_ttl(key, model)
+    if found is not None:
+        value, ttl = found
+        if empty(value):
+            return Result(value, Hit.NEGATIVE)
+        if ttl is not None and ttl <= policy.stale:
+            return Result(value, Hit.STALE)
+        return Result(value, Hit.FRESH)
+    if await db.get(negative_key(key)) is not None:
+        return Result(None, Hit.NEGATIVE)
+    return None
+
+
+async def store(key: str, value: T | None, policy: Policy, empty: Callable[[T], bool]) -> None:
+    if value is None:
+        await db.set(negative_key(key), "1", ttl=policy.negative)
+    elif empty(value):
+        await db.set_model(key, value, ttl=policy.negative)
+    else:
+        await db.set_model(key, value, ttl=policy.fresh + policy.stale)
+
+
+async def _fill(
+    key: str,
+    fetch: Callable[[], Awaitable[T | None]],
+    policy: Policy,
+    empty: Callable[[T], bool],
+) -> Result[T]:
+    value = await fetch()
+    await store(key, value, policy, empty)
+    return Result(value, Hit.MISS)
+
+
+def revalidate(
+    key: str,
+    fetch: Callable[[], Awaitable[T | None]],
+    policy: Policy,
+    lease: timedelta,
+    empty: Callable[[T], bool],
+) -> None:
+    """
+    Refresh the value in the background unless another process already is
+    """
+    task = asyncio.create_task(_refresh(key, fetch, policy, lease, empty))
+    _refreshes.add(task)
+    task.add_done_callback(_refreshes.discard)
+
+
+async def _refresh(
+    key: str,
+    fetch: Callable[[], Awaitable[T | None]],
+    policy: Policy,
+    lease: timedelta,
+    empty: Callable[[T], bool],
+) -> None:
+    lock = f"swr:refresh:{key}"
+    if not await db.try_lock(lock, max(1, math.ceil(lease.total_seconds()))):
+        return
+    try:
+        value = await fetch()
+        # a failed or empty refresh keeps serving the stale value
+        if value is not None and not empty(value):
+            await store(key, value, policy, empty)
+    except Exception as e:
+        log.warning("failed to refresh stale value", key=key, exc_info=e)
+    finally:
+        await db.unlock(lock)
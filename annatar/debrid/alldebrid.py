@@ -6,7 +6,8 @@ import aiohttp
 import structlog
 from pydantic import BaseModel
 
-from annatar import human
+from annatar import human, title_parser
+from annatar.clients import http
 from annatar.debrid.alldebrid_models import (
     AddTorrentResponse,
     CachedFile,
@@ -17,7 +18,6 @@ from annatar.debrid.alldebrid_models import (
     UnlockLink,
 )
 from annatar.debrid.debrid_service import DebridService, StreamLink
-from annatar.torrent import TorrentMeta
 
 log = structlog.get_logger(__name__)
 
@@ -44,7 +44,7 @@ class AllDebridProvider(DebridService):
         query["agent"] = "https://gitlab.com/stremio-add-ons/annatar"
         log.debug("making request", method=method, url=url, query=query, body=body, form=form)
         query["apikey"] = self.api_key
-        async with aiohttp.ClientSession() as session, session.request(
+        async with http.session(http.Upstream.AllDebrid).request(
             method,
             f"{self.BASE_URL}{url}",
             params=query,
@@ -213,7 +213,7 @@ def get_matched_file(files: list[CachedFile], season: int, episode: int) -> Cach
         return None
 
     for file in by_size:
-        meta = TorrentMeta.parse_title(file.name)
+        meta = title_parser.parse_title(file.name)
         if meta.is_trash():
             log.debug("skipping trash file", file=file.name)
             continue
@@ -2,11 +2,11 @@ import asyncio
 import urllib.parse
 from typing import Any, AsyncGenerator
 
-import aiohttp
 import structlog
 from pydantic import BaseModel
 
-from annatar import human, magnet
+from annatar import human, magnet, title_parser
+from annatar.clients import http
 from annatar.debrid.debrid_service import DebridService, StreamLink
 from annatar.debrid.debridlink_models import (
     CachedFile,
@@ -14,7 +14,6 @@ from annatar.debrid.debridlink_models import (
     CachedResponse,
     TorrentInfo,
 )
-from annatar.torrent import TorrentMeta
 
 log = structlog.get_logger(__name__)
 
@@ -40,7 +39,7 @@ class DebridLink(DebridService):
             "Authorization": f"Bearer {self.api_key}",
             "Content-Type": "application/json",
         }
-        async with aiohttp.ClientSession() as session, session.request(
+        async with http.session(http.Upstream.DebridLink).request(
             method, f"{self.BASE_URL}{url}", params=query, json=body, headers=headers
         ) as response:
             response.raise_for_status()
@@ -169,7 +168,7 @@ def get_matched_file(files: list[CachedFile], season: int, episode: int) -> Cach
         return None
 
     for file in by_size:
-        meta = TorrentMeta.parse_title(file.name)
+        meta = title_parser.parse_title(file.name)
         if meta.is_trash():
             log.debug("skipping trash file", file=file.name)
             continue
@@ -3,7 +3,7 @@ from typing import AsyncGenerator, Optional
 
 import structlog
 
-from annatar import human
+from annatar import human, title_parser
 from annatar.debrid import premiumize_api as api
 from annatar.debrid.models import StreamLink
 from annatar.debrid.pm_models import DirectDL, DirectDLResponse
@@ -32,7 +32,7 @@ async def select_stream_file(
             continue
 
         path = file.path.split("/")[-1].lower()
-        meta: TorrentMeta = TorrentMeta.parse_title(path)
+        meta: TorrentMeta = title_parser.parse_title(path)
         if meta.is_season_episode(season=season, episode=episode):
             log.debug("path matches season and episode", path=path, season=season, episode=episode)
             return StreamLink(
@@ -6,6 +6,7 @@ import structlog
 from pydantic import BaseModel
 
 from annatar import magnet
+from annatar.clients import http
 from annatar.database import db
 from annatar.debrid.pm_models import DirectDLResponse
 from annatar.instrumentation import HTTP_CLIENT_REQUEST_DURATION
@@ -44,20 +45,19 @@ async def make_request(
     start_time = datetime.now()
     error = True
     try:
-        async with aiohttp.ClientSession() as session:
-            params["apikey"] = api_token
-            async with session.request(
-                method=method,
-                url=f"{ROOT_URL}{url}",
-                params=params,
-                data=data,
-                headers=headers,
-            ) as response:
-                status_code = response.status if response.status else 0
-                raw: dict[str, Any] = await response.json()
-                model_instance = model.model_validate(raw)
-                error = False
-                return HTTPResponse(model=model_instance, response=response)
+        params["apikey"] = api_token
+        async with http.session(http.Upstream.Premiumize).request(
+            method=method,
+            url=f"{ROOT_URL}{url}",
+            params=params,
+            data=data,
+            headers=headers,
+        ) as response:
+            status_code = response.status if response.status else 0
+            raw: dict[str, Any] = await response.json()
+            model_instance = model.model_validate(raw)
+            error = False
+            return HTTPResponse(model=model_instance, response=response)
     finally:
         HTTP_CLIENT_REQUEST_DURATION.labels(
             client="premiumize.me",
@@ -73,9 +73,9 @@ async def directdl(
     info_hash: str,
 ) -> Optional[DirectDLResponse]:
     cache_key: str = f"premiumize:directdl:{info_hash}"
-    cached: Optional[str] = await db.get(cache_key)
+    cached: Optional[DirectDLResponse] = await db.get_model(cache_key, model=DirectDLResponse)
     if cached:
-        return DirectDLResponse.model_validate_json(cached)
+        return cached
 
     dl_res: HTTPResponse[DirectDLResponse] = await make_request(
         api_token=api_token,
@@ -93,5 +93,5 @@ async def directdl(
             exc_info=True,
         )
         return None
-    await db.set(key=cache_key, value=dl_res.model.model_dump_json(), ttl=timedelta(hours=24))
+    await db.set_model(key=cache_key, model=dl_res.model, ttl=timedelta(hours=24))
     return dl_res.model
@@ -1,10 +1,10 @@
 from datetime import datetime
 from typing import Any, AsyncGenerator
 
-import aiohttp
 import structlog
 
 from annatar import instrumentation, magnet
+from annatar.clients import http
 from annatar.debrid.rd_models import InstantFile, TorrentInfo, UnrestrictedLink
 
 ROOT_URL = "https://api.real-debrid.com/rest/1.0"
@@ -34,7 +34,7 @@ async def make_request(
     error = False
     try:
         api_headers = {"Authorization": f"Bearer {debrid_token}"}
-        async with aiohttp.ClientSession() as session, session.request(
+        async with http.session(http.Upstream.RealDebrid).request(
             method, api_url, headers=api_headers, data=body
         ) as response:
             status_code = f"{response.status//100}xx"
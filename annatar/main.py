@@ -1,3 +1,4 @@
+import asyncio
 from contextlib import asynccontextmanager
 from typing import Any
 
@@ -8,6 +9,8 @@ from fastapi.staticfiles import StaticFiles
 
 from annatar import instrumentation, logging, middleware, web
 from annatar.api import search, stremio
+from annatar.clients import http
+from annatar.database import cache, db
 
 logging.init()
 instrumentation.init()
@@ -17,7 +20,11 @@ log = structlog.get_logger(__name__)
 
 @asynccontextmanager
 async def lifespan(_: FastAPI):
+    invalidator = asyncio.create_task(cache.watch_invalidations())
     yield
+    invalidator.cancel()
+    await http.close()
+    await db.close()
     instrumentation.shutdown()
     log.info("shutting down")
 
@@ -1,20 +1,28 @@
 import asyncio
 import os
 from datetime import timedelta
-from itertools import product
+from itertools import chain
 
-import aiohttp
 import structlog
 
-from annatar import magnet
+from annatar import magnet, title_parser
+from annatar.clients import http
 from annatar.database import db, odm
-from annatar.pubsub.events import TorrentSearchCriteria, TorrentSearchResult
+from annatar.pubsub.events import (
+    TorrentSearchCriteria,
+    TorrentSearchResult,
+    TorrentSearchResults,
+)
+from annatar.pubsub.pubsub import Delivery
 from annatar.torrent import Category, Torrent, TorrentMeta
 
 log = structlog.get_logger(__name__)
 
 MAGNET_RESOLVE_TIMEOUT = int(os.getenv("MAGNET_RESOLVE_TIMEOUT", "30"))
-TORRENT_PROCESSOR_MAX_QUEUE_DEPTH = int(os.getenv("TORRENT_PROCESSOR_MAX_QUEUE_DEPTH", "10000"))
+# 0 sizes the queue to the number of workers so that other consumers get the
+# messages this one has no worker for
+TORRENT_PROCESSOR_MAX_QUEUE_DEPTH = int(os.getenv("TORRENT_PROCESSOR_MAX_QUEUE_DEPTH", "0"))
+TORRENT_TTL = timedelta(weeks=8)
 
 
 class TorrentProcessor:
@@ -23,13 +31,13 @@ class TorrentProcessor:
         while True:
             workers: list[asyncio.Task] = []
             try:
-                queue: asyncio.Queue[TorrentSearchResult] = asyncio.Queue(
-                    maxsize=TORRENT_PROCESSOR_MAX_QUEUE_DEPTH
+                queue: asyncio.Queue[Delivery[TorrentSearchResults]] = asyncio.Queue(
+                    maxsize=TORRENT_PROCESSOR_MAX_QUEUE_DEPTH or num_workers
                 )
                 workers = [
                     asyncio.create_task(process_queue(queue), name=f"torrent_processor_{i}")
                     for i in range(num_workers)
-                ] + [asyncio.create_task(TorrentSearchResult.listen(queue, "torrent_processor"))]
+                ] + [asyncio.create_task(TorrentSearchResults.listen(queue, "torrent_processor"))]
 
                 await asyncio.wait(workers, return_when=asyncio.FIRST_COMPLETED)
 
@@ -45,114 +53,145 @@ class TorrentProcessor:
                         w.cancel()
 
 
-async def process_queue(queue: asyncio.Queue[TorrentSearchResult]):
+async def process_queue(queue: asyncio.Queue[Delivery[TorrentSearchResults]]):
     while True:
-        result: TorrentSearchResult = await queue.get()
-        if not result:
-            continue
+        delivery: Delivery[TorrentSearchResults] = await queue.get()
         try:
-            if await db.try_lock(
-                f"lock:torrent_processor:{result.guid}", timeout=timedelta(minutes=60)
-            ):
-                log.debug("processing torrent", torrent=result.info_hash or result.guid)
-                await process_message(result)
-                log.debug("finished processing torrent", torrent=result.info_hash or result.guid)
+            await process_batch(delivery.message)
         except asyncio.exceptions.CancelledError:
+            # left pending so that another consumer reclaims it
+            queue.task_done()
             break
         except Exception as err:
             log.error("torrent processor error", exc_info=err)
+            await delivery.fail()
+            queue.task_done()
             await asyncio.sleep(5)
-        finally:
-            if result:
-                queue.task_done()
+            continue
+        await delivery.ack()
+        queue.task_done()
+
+
+async def process_batch(batch: TorrentSearchResults) -> list[odm.NewTorrent]:
+    """
+    Process the results of one search as a unit. Results already processed
+    by another consumer are skipped with a single round trip and the new
+    torrents are written together.
+    """
+    results = batch.unpack()
+    keys = [f"lock:torrent_processor:{result.guid}" for result in results]
+    locked = await db.try_lock_many(keys, timeout=timedelta(minutes=60))
+    pending = [result for result, ok in zip(results, locked, strict=True) if ok]
+    log.debug(
+        "processing torrents",
+        imdb=batch.search_criteria.imdb,
+        count=len(pending),
+        skipped=len(results) - len(pending),
+    )
+    try:
+        metas = await title_parser.parse_titles([result.title for result in pending])
+        torrents = await asyncio.gather(
+            *[map_torrents(result, meta) for result, meta in zip(pending, metas, strict=True)]
+        )
+        added = await odm.add_torrents(list(chain.from_iterable(torrents)), ttl=TORRENT_TTL)
+    except Exception:
+        # let the redelivered batch process them again
+        await asyncio.gather(*[db.unlock(key) for key, ok in zip(keys, locked, strict=True) if ok])
+        raise
+    log.debug("finished processing torrents", imdb=batch.search_criteria.imdb, added=len(added))
+    return added
 
 
-async def process_message(result: TorrentSearchResult):
+async def map_torrents(
+    result: TorrentSearchResult, meta: TorrentMeta | None = None
+) -> list[odm.NewTorrent]:
+    """
+    The torrent list entries for a search result. meta is the parsed title
+    if it was already parsed.
+    """
     criteria = result.search_criteria
     if result.imdb and criteria.imdb and result.imdb != criteria.imdb:
         log.info("skipping mismatched IMDB", wanted=criteria.imdb, got=result.imdb)
-        return
-    torrent: Torrent | None = await map_search_result(result)
+        return []
+    torrent: Torrent | None = await map_search_result(result, meta)
     if not torrent:
-        return
+        return []
 
     # if result.imdb != criteria.imdb and not torrent.matches_name(criteria.query):
     #     log.info("skipping mismatched title", wanted=criteria.query, got=torrent.title)
     #     return
 
-    ttl = timedelta(weeks=8)
     if result.search_criteria.category == Category.Movie:
-        await process_movie(torrent, result.indexer, result.size, criteria, ttl)
-    else:
-        await process_show(torrent, result.indexer, result.size, criteria, ttl)
+        return map_movie(torrent, result.indexer, result.size, criteria)
+    return map_show(torrent, result.indexer, result.size, criteria)
 
 
-async def process_movie(
+def map_movie(
     torrent: Torrent,
     indexer: str,
     size: int,
     criteria: TorrentSearchCriteria,
-    ttl: timedelta,
-):
+) -> list[odm.NewTorrent]:
     score = torrent.match_score(title=torrent.title, year=criteria.year)
-    if score > 0:
-        await odm.add_torrent(
+    if score <= 0:
+        return []
+    return [
+        odm.NewTorrent(
             info_hash=torrent.info_hash,
             title=torrent.raw_title,
             imdb=criteria.imdb,
             score=score,
             size=size,
-            ttl=ttl,
             indexer=indexer,
             category=Category.Movie,
+            meta=torrent,
         )
+    ]
 
 
-async def process_show(
+def map_show(
     torrent: Torrent,
     indexer: str,
     size: int,
     criteria: TorrentSearchCriteria,
-    ttl: timedelta,
-):
-    if not torrent.episode:
-        for season in torrent.season:
-            score = torrent.match_score(title=torrent.title, year=criteria.year, season=season)
-            await odm.add_torrent(
-                info_hash=torrent.info_hash,
-                title=torrent.raw_title,
-                imdb=criteria.imdb,
-                score=score,
-                ttl=ttl,
-                season=season,
-                category=Category.Series,
-                indexer=indexer,
-                size=size,
-            )
-    elif torrent.season:
-        for season, episode in product(torrent.season, torrent.episode):
-            score = torrent.match_score(
-                title=torrent.title,
-                year=criteria.year,
-                season=season,
-                episode=episode,
-            )
-            if score > 0:
-                await odm.add_torrent(
-                    info_hash=torrent.info_hash,
-                    title=torrent.raw_title,
-                    imdb=criteria.imdb,
-                    score=score,
-                    ttl=ttl,
-                    season=season,
-                    episode=episode,
-                    category=Category.Series,
-                    indexer=indexer,
-                    size=size,
-                )
+) -> list[odm.NewTorrent]:
+    """
+    A series torrent is listed once with every season and episode it
+    covers. The score is the same for each of them.
+    """
+    if not torrent.season:
+        return []
+    season = torrent.season[0]
+    episode = torrent.episode[0] if torrent.episode else 0
+    score = torrent.match_score(
+        title=torrent.title,
+        year=criteria.year,
+        season=season,
+        episode=episode,
+    )
+    if torrent.episode and score <= 0:
+        return []
+    return [
+        odm.NewTorrent(
+            info_hash=torrent.info_hash,
+            title=torrent.raw_title,
+            imdb=criteria.imdb,
+            score=score,
+            season=season,
+            episode=episode or None,
+            seasons=torrent.season,
+            episodes=torrent.episode,
+            category=Category.Series,
+            indexer=indexer,
+            size=size,
+            meta=torrent,
+        )
+    ]
 
 
-async def map_search_result(result: TorrentSearchResult) -> Torrent | None:
+async def map_search_result(
+    result: TorrentSearchResult, meta: TorrentMeta | None = None
+) -> Torrent | None:
     info_hash: str | None = (
         result.info_hash
         if result.info_hash
@@ -165,7 +204,8 @@ async def map_search_result(result: TorrentSearchResult) -> Torrent | None:
     )
 
     if info_hash:
-        meta: TorrentMeta = TorrentMeta.parse_title(result.title)
+        if meta is None:
+            meta = title_parser.parse_title(result.title)
         torrent: Torrent = meta.with_info_hash(info_hash)
         return torrent
     log.debug("no info hash found", guid=result.guid, link=result.magnet_link)
@@ -191,7 +231,7 @@ async def resolve_magnet_link(guid: str, link: str) -> str | None:
             return info_hash
 
         log.debug("magnet resolve: following redirect", guid=guid, link=link)
-        async with aiohttp.ClientSession() as session, session.get(
+        async with http.session(http.Upstream.Magnet).get(
             link,
             allow_redirects=False,
             timeout=MAGNET_RESOLVE_TIMEOUT,
@@ -1,15 +1,25 @@
 import asyncio
 import os
-from itertools import chain
+import time
+from typing import Awaitable, NamedTuple
 
 import structlog
+from prometheus_client import Counter
 from pydantic import BaseModel
 
-from annatar.clients import jackett
+from annatar import instrumentation, title_parser
+from annatar.clients import indexer_health, jackett
 from annatar.clients.cinemeta import MediaInfo, get_media_info
-from annatar.clients.jackett_models import SearchResult
+from annatar.clients.indexer_health import IndexerStats, QueryType
+from annatar.clients.jackett_models import SearchResponse, SearchResult
 from annatar.database import db
-from annatar.pubsub.events import SearchRequest, TorrentSearchCriteria, TorrentSearchResult
+from annatar.pubsub.events import (
+    SearchRequest,
+    TorrentSearchCriteria,
+    TorrentSearchHit,
+    TorrentSearchResults,
+)
+from annatar.pubsub.pubsub import Delivery
 from annatar.torrent import Category, TorrentMeta
 
 log = structlog.get_logger(__name__)
@@ -17,6 +27,24 @@ log = structlog.get_logger(__name__)
 JACKETT_MAX_RESULTS = int(os.environ.get("JACKETT_MAX_RESULTS", 100))
 JACKETT_TIMEOUT = int(os.environ.get("JACKETT_TIMEOUT", 60))
 
+RESULTS_DROPPED = Counter(
+    name="jackett_search_results_dropped",
+    documentation="Search results dropped before publishing, by reason",
+    labelnames=["indexer", "reason"],
+    registry=instrumentation.registry(),
+)
+
+
+class QueryResult(NamedTuple):
+    query: QueryType
+    response: SearchResponse
+    seconds: float
+
+
+class Candidate(NamedTuple):
+    result: SearchResult
+    meta: TorrentMeta
+
 
 class BaseJackettProcessor(BaseModel):
     indexer: str
@@ -29,7 +57,9 @@ class BaseJackettProcessor(BaseModel):
         workers: list[asyncio.Task] = []
         while True:
             try:
-                queue: asyncio.Queue[SearchRequest] = asyncio.Queue(maxsize=self.queue_size)
+                queue: asyncio.Queue[Delivery[SearchRequest]] = asyncio.Queue(
+                    maxsize=self.queue_size
+                )
 
                 workers = [
                     asyncio.create_task(
@@ -51,70 +81,240 @@ class BaseJackettProcessor(BaseModel):
                     if not worker.done():
                         worker.cancel()
 
-    async def process_queue(self, queue: asyncio.Queue[SearchRequest]):
-        while request := await queue.get():
+    async def process_queue(self, queue: asyncio.Queue[Delivery[SearchRequest]]):
+        while delivery := await queue.get():
             try:
-                key = f"{self.indexer}-search-processor-{request.imdb}"
-                if not await db.try_lock(key, jackett.JACKETT_CACHE_MINUTES):
-                    continue
-                media_info = await get_media_info(request.imdb, request.category)
-                if not media_info:
-                    continue
-                await self.process_message(request, media_info)
+                await self.process_request(delivery.message)
             except asyncio.CancelledError:
+                # left pending so that another consumer reclaims it
                 return
             except Exception as e:
                 log.error("search processor stopped unexpectedly", indexer=self.indexer, exc_info=e)
+                await delivery.fail()
                 await asyncio.sleep(1)
+                continue
+            await delivery.ack()
+
+    async def process_request(self, request: SearchRequest):
+        if request.category not in self.categories:
+            return
+        health = await indexer_health.cached_stats(self.indexer)
+        if health.breaker_open:
+            log.info("indexer circuit is open, skipping search", indexer=self.indexer)
+            return
+        queries = self.plan(request, health)
+        if not queries:
+            return
+        key = f"{self.indexer}-search-processor-{request.imdb}"
+        if not await db.try_lock(key, jackett.JACKETT_CACHE_MINUTES):
+            return
+        try:
+            await self.run_queries(request, queries)
+        except Exception:
+            # let the redelivered request search again
+            await db.unlock(key)
+            raise
+
+    async def run_queries(self, request: SearchRequest, queries: list[QueryType]):
+        # the IMDb query does not need the metadata so it runs meanwhile
+        imdb_query = (
+            asyncio.create_task(self.run_query(QueryType.IMDB, self.search_imdb(request)))
+            if QueryType.IMDB in queries
+            else None
+        )
+        try:
+            media_info = await get_media_info(request.imdb, request.category)
+        except BaseException:
+            if imdb_query:
+                imdb_query.cancel()
+            raise
+        if not media_info:
+            if imdb_query:
+                imdb_query.cancel()
+            return
+        await self.process_message(request, media_info, queries, imdb_query)
+
+    def plan(self, request: SearchRequest, health: IndexerStats) -> list[QueryType]:
+        """
+        The queries to run for the request. Query types that have not
+        yielded anything from this indexer for the category are skipped.
+        """
+        queries = [QueryType.IMDB] if self.supports_imdb else []
+        queries.append(QueryType.TITLE)
+        if request.season:
+            queries.append(QueryType.SEASON)
+        planned = [q for q in queries if not health.should_skip(request.category, q)]
+        if len(planned) < len(queries):
+            log.debug(
+                "skipping unproductive queries",
+                indexer=self.indexer,
+                category=request.category,
+                skipped=[str(q) for q in queries if q not in planned],
+            )
+        return planned
+
+    async def search_imdb(self, request: SearchRequest) -> SearchResponse:
+        return await jackett.search_imdb(
+            imdb=request.imdb,
+            indexers=[self.indexer],
+            category=request.category,
+            timeout=jackett.deadline(self.indexer, JACKETT_TIMEOUT),
+            priority=request.priority,
+        )
+
+    async def run_query(self, query: QueryType, search: Awaitable[SearchResponse]) -> QueryResult:
+        start_time = time.monotonic()
+        response = await search
+        return QueryResult(query, response, time.monotonic() - start_time)
 
     async def process_message(
         self,
         request: SearchRequest,
         media_info: MediaInfo,
+        queries: list[QueryType] | None = None,
+        imdb_query: Awaitable[QueryResult] | None = None,
     ):
+        """
+        Run the queries for the request and publish the results of each one
+        as soon as it completes so slow queries do not hold back fast ones.
+        imdb_query is the IMDb query if it was already started.
+        """
         log.debug("processing search request", request=request, indexer=self.indexer)
-        tasks = [
-            jackett.search_imdb(
-                imdb=request.imdb,
-                indexers=[self.indexer],
-                category=request.category,
-                timeout=JACKETT_TIMEOUT,
-            ),
-            jackett.search(
-                query=media_info.name,
-                indexers=[self.indexer],
-                category=request.category,
-                timeout=JACKETT_TIMEOUT,
-            ),
-        ]
-        if request.season:
+        if queries is None:
+            queries = list(QueryType) if request.season else [QueryType.IMDB, QueryType.TITLE]
+        timeout = jackett.deadline(self.indexer, JACKETT_TIMEOUT)
+        tasks: list[Awaitable[QueryResult]] = []
+        if QueryType.IMDB in queries:
+            tasks.append(imdb_query or self.run_query(QueryType.IMDB, self.search_imdb(request)))
+        if QueryType.TITLE in queries:
             tasks.append(
-                jackett.search(
-                    query=f"{media_info.name} S{request.season:02d}",
-                    indexers=[self.indexer],
-                    category=request.category,
-                    timeout=JACKETT_TIMEOUT,
+                self.run_query(
+                    QueryType.TITLE,
+                    jackett.search(
+                        query=media_info.name,
+                        indexers=[self.indexer],
+                        category=request.category,
+                        timeout=timeout,
+                        priority=request.priority,
+                    ),
                 )
             )
-
-        results = list(
-            chain.from_iterable(
-                r.Results for r in await asyncio.gather(*tasks, return_exceptions=False)
+        if QueryType.SEASON in queries and request.season:
+            tasks.append(
+                self.run_query(
+                    QueryType.SEASON,
+                    jackett.search(
+                        query=f"{media_info.name} S{request.season:02d}",
+                        indexers=[self.indexer],
+                        category=request.category,
+                        timeout=timeout,
+                        priority=request.priority,
+                    ),
+                )
             )
-        )
-        log.debug("jackett search completed", request=len(results))
 
-        sorted_results = sorted(
-            results, key=lambda x: self.prioritize_search_result(media_info, request, x)
-        )
-        for result in sorted_results[:JACKETT_MAX_RESULTS]:
-            await self.publish_search_result(request, result, media_info)
+        # guids and info hashes of what was published
+        seen: set[str] = set()
+        published = 0
+        for task in asyncio.as_completed(tasks):
+            result = await task
+            relevant = await self.prefilter(request, media_info, result.response.Results)
+            candidates = self.unpublished(relevant, seen)
+            if not (result.response.cached or result.response.throttled):
+                # the yield of a query does not depend on which query of the
+                # search completed first
+                await indexer_health.record(
+                    indexer=self.indexer,
+                    category=request.category,
+                    query=result.query,
+                    latency=result.seconds,
+                    failed=result.response.has_errors(),
+                    results=len(relevant),
+                    unique=len(candidates),
+                )
+            candidates = sorted(
+                candidates, key=lambda c: self.prioritize_search_result(media_info, request, c)
+            )[: JACKETT_MAX_RESULTS - published]
+            for c in candidates:
+                seen.update(result_ids(c.result))
+            published += len(candidates)
+            log.debug("jackett query completed", results=len(candidates), total=published)
+            await self.publish_search_results(request, [c.result for c in candidates], media_info)
+
+    async def prefilter(
+        self,
+        request: SearchRequest,
+        media_info: MediaInfo,
+        results: list[SearchResult],
+    ) -> list[Candidate]:
+        """
+        The distinct results of a query that the torrent processor would not
+        reject anyway
+        """
+        unique: list[SearchResult] = []
+        batch: set[str] = set()
+        for result in results:
+            ids = result_ids(result)
+            if not ids.isdisjoint(batch):
+                RESULTS_DROPPED.labels(indexer=self.indexer, reason="duplicate").inc()
+                continue
+            batch.update(ids)
+            unique.append(result)
+
+        metas = await title_parser.parse_titles([result.Title for result in unique])
+        candidates: list[Candidate] = []
+        for result, meta in zip(unique, metas, strict=True):
+            if reason := self.reject_reason(request, media_info, result, meta):
+                RESULTS_DROPPED.labels(indexer=self.indexer, reason=reason).inc()
+                continue
+            candidates.append(Candidate(result, meta))
+        return candidates
+
+    def unpublished(self, candidates: list[Candidate], seen: set[str]) -> list[Candidate]:
+        """
+        The candidates not published yet. The queries of a search overlap so
+        the results another query of the search published are dropped.
+        """
+        unpublished: list[Candidate] = []
+        for candidate in candidates:
+            if not result_ids(candidate.result).isdisjoint(seen):
+                RESULTS_DROPPED.labels(indexer=self.indexer, reason="duplicate").inc()
+                continue
+            unpublished.append(candidate)
+        return unpublished
+
+    def reject_reason(
+        self,
+        request: SearchRequest,
+        media_info: MediaInfo,
+        result: SearchResult,
+        meta: TorrentMeta,
+    ) -> str | None:
+        """
+        Why the torrent processor would not list the result, using the checks
+        of TorrentMeta.match_score. The title is only checked when the
+        indexer does not confirm the IMDb id.
+        """
+        imdb = f"tt{result.Imdb:07d}" if result.Imdb else None
+        if imdb and imdb != request.imdb:
+            return "imdb"
+        if meta.is_trash():
+            return "trash"
+        year = media_info.release_year or 0
+        if meta.year and year and year not in meta.year:
+            return "year"
+        if not imdb and not meta.matches_name(media_info.name):
+            return "title"
+        if request.category == Category.Movie and meta.match_score(year=year) <= 0:
+            return "score"
+        return None
 
     def prioritize_search_result(
-        self, media_info: MediaInfo, request: SearchRequest, result: SearchResult
+        self, media_info: MediaInfo, request: SearchRequest, candidate: Candidate
     ) -> tuple[int, int]:
+        result = candidate.result
         score = 5
-        if TorrentMeta.parse_title(result.Title).matches_name(media_info.name):
+        if candidate.meta.matches_name(media_info.name):
             score -= 1
         if request.season and f"S{request.season:02d}" in result.Title:
             score -= 1
@@ -122,22 +322,39 @@ class BaseJackettProcessor(BaseModel):
             score -= 1
         return (score, result.Size * -1)
 
-    async def publish_search_result(
-        self, request: SearchRequest, result: SearchResult, media_info: MediaInfo
+    async def publish_search_results(
+        self, request: SearchRequest, results: list[SearchResult], media_info: MediaInfo
     ):
-        await TorrentSearchResult.publish(
-            TorrentSearchResult(
-                title=result.Title,
-                info_hash=result.InfoHash if result.InfoHash else "",
-                guid=result.Guid,
-                magnet_link=result.Link or "",
-                indexer=self.indexer,
-                size=result.Size,
+        if not results:
+            return
+        await TorrentSearchResults.publish(
+            TorrentSearchResults(
                 search_criteria=TorrentSearchCriteria(
                     category=request.category,
                     imdb=request.imdb,
                     query=media_info.name,
                     year=media_info.release_year or 0,
                 ),
+                results=[
+                    TorrentSearchHit(
+                        title=result.Title,
+                        info_hash=result.InfoHash if result.InfoHash else "",
+                        guid=result.Guid,
+                        magnet_link=result.Link or "",
+                        indexer=self.indexer,
+                        size=result.Size,
+                    )
+                    for result in results
+                ],
             )
         )
+
+
+def result_ids(result: SearchResult) -> set[str]:
+    """
+    The ids a result is deduplicated by. Indexers give every release its own
+    guid but different releases of the same torrent share the info hash.
+    """
+    if result.InfoHash:
+        return {result.Guid, result.InfoHash.upper()}
+    return {result.Guid}
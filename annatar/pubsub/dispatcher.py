@@ -0,0 +1,114 @@
+"""
+Routes TorrentAdded events to the requests waiting for them. Each event loop
+holds a single subscription to the topic instead of one per request, and
+every event is decoded once and handed only to the waiters registered for
+its title.
+"""
+
+import asyncio
+import contextlib
+from collections import defaultdict
+from typing import AsyncIterator
+from weakref import WeakKeyDictionary
+
+import structlog
+
+from annatar.pubsub.events import TorrentAdded, TorrentsAdded
+
+log = structlog.get_logger(__name__)
+
+QUEUE_SIZE = 10000
+
+
+class Waiter:
+    """
+    Counts the torrents added for one (imdb, season, episode)
+    """
+
+    def __init__(self, episode: int):
+        self.episode = episode
+        self.received = 0
+        self._changed = asyncio.Event()
+
+    def matches(self, event: TorrentAdded) -> bool:
+        # season and series packs are results for every episode
+        if event.episodes:
+            return self.episode in event.episodes
+        return not event.episode or event.episode == self.episode
+
+    def notify(self) -> None:
+        self.received += 1
+        self._changed.set()
+
+    async def wait(self, count: int) -> None:
+        """
+        Wait until at least count torrents have been added
+        """
+        while self.received < count:
+            self._changed.clear()
+            await self._changed.wait()
+
+
+class TorrentAddedDispatcher:
+    def __init__(self):
+        self._waiters: dict[tuple[str, int], set[Waiter]] = defaultdict(set)
+        self._task: asyncio.Task[None] | None = None
+
+    @contextlib.asynccontextmanager
+    async def watch(self, imdb: str, season: int, episode: int) -> AsyncIterator[Waiter]:
+        """
+        Register a waiter for the duration of the context. The waiter is
+        removed even if the request is cancelled.
+        """
+        self._ensure_running()
+        key = (imdb, season or 0)
+        waiter = Waiter(episode or 0)
+        self._waiters[key].add(waiter)
+        try:
+            yield waiter
+        finally:
+            self._waiters[key].discard(waiter)
+            if not self._waiters[key]:
+                del self._waiters[key]
+
+    def dispatch(self, event: TorrentAdded) -> None:
+        for season in event.seasons or [event.season or 0]:
+            for waiter in self._waiters.get((event.imdb, season), ()):
+                if waiter.matches(event):
+                    waiter.notify()
+
+    def waiting(self) -> int:
+        return sum(len(w) for w in self._waiters.values())
+
+    def _ensure_running(self) -> None:
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run(), name="torrent_added_dispatcher")
+
+    async def _run(self) -> None:
+        queue: asyncio.Queue[TorrentsAdded] = asyncio.Queue(maxsize=QUEUE_SIZE)
+        consumer = asyncio.create_task(TorrentsAdded.listen(queue, "torrent_added_dispatcher"))
+        try:
+            while True:
+                for event in (await queue.get()).torrents:
+                    self.dispatch(event)
+        finally:
+            consumer.cancel()
+
+
+_dispatchers: WeakKeyDictionary[asyncio.AbstractEventLoop, TorrentAddedDispatcher] = (
+    WeakKeyDictionary()
+)
+
+
+def dispatcher() -> TorrentAddedDispatcher:
+    """
+    Returns the dispatcher of the running event loop
+    """
+    loop = asyncio.get_running_loop()
+    if loop not in _dispatchers:
+        _dispatchers[loop] = TorrentAddedDispatcher()
+    return _dispatchers[loop]
+
+
+def watch(imdb: str, season: int, episode: int) -> contextlib.AbstractAsyncContextManager[Waiter]:
+    return dispatcher().watch(imdb, season, episode)
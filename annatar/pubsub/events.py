@@ -2,10 +2,11 @@ import asyncio
 from typing import Any, TypeVar
 
 import structlog
-from pydantic import BaseModel, field_validator
+from pydantic import BaseModel, field_validator, model_validator
 
+from annatar.database.semaphore import Priority
 from annatar.pubsub import pubsub
-from annatar.pubsub.pubsub import Topic
+from annatar.pubsub.pubsub import Delivery, Topic
 from annatar.torrent import Category
 
 log = structlog.get_logger(__name__)
@@ -18,19 +19,25 @@ class SearchRequest(BaseModel):
     category: Category
     season: int | None = None
     episode: int | None = None
+    # background refreshes yield Jackett capacity to user searches
+    priority: Priority = Priority.USER
 
     @staticmethod
-    async def listen(queue: asyncio.Queue["SearchRequest"], consumer: str):
-        await pubsub.consume_topic(
+    async def listen(queue: asyncio.Queue[Delivery["SearchRequest"]], consumer: str):
+        await pubsub.consume_stream(
             topic=Topic.SearchRequest,
             model=SearchRequest,
             queue=queue,
-            consumer=consumer,
+            group=consumer,
         )
 
     @staticmethod
     async def publish(request: "SearchRequest") -> int:
-        return await pubsub.publish(Topic.SearchRequest, request.model_dump_json())
+        return await pubsub.publish(
+            Topic.SearchRequest,
+            request,
+            partition_key=request.imdb,
+        )
 
 
 class TorrentSearchCriteria(BaseModel):
@@ -40,8 +47,7 @@ class TorrentSearchCriteria(BaseModel):
     year: int = 0
 
 
-class TorrentSearchResult(BaseModel):
-    search_criteria: TorrentSearchCriteria
+class TorrentSearchHit(BaseModel):
     category: list[int] = []
     info_hash: str = ""
     title: str
@@ -66,18 +72,42 @@ class TorrentSearchResult(BaseModel):
             return v.upper()
         return v
 
+
+class TorrentSearchResult(TorrentSearchHit):
+    search_criteria: TorrentSearchCriteria
+
+
+class TorrentSearchResults(BaseModel):
+    """
+    The results of one search. They are published and processed together
+    so the criteria is sent once instead of with every result.
+    """
+
+    search_criteria: TorrentSearchCriteria
+    results: list[TorrentSearchHit] = []
+
+    def unpack(self) -> list[TorrentSearchResult]:
+        return [
+            TorrentSearchResult(search_criteria=self.search_criteria, **hit.model_dump())
+            for hit in self.results
+        ]
+
     @staticmethod
-    async def listen(queue: asyncio.Queue["TorrentSearchResult"], consumer: str):
-        await pubsub.consume_topic(
-            topic=Topic.TorrentSearchResult,
-            model=TorrentSearchResult,
+    async def listen(queue: asyncio.Queue[Delivery["TorrentSearchResults"]], consumer: str):
+        await pubsub.consume_stream(
+            topic=Topic.TorrentSearchResults,
+            model=TorrentSearchResults,
             queue=queue,
-            consumer=consumer,
+            group=consumer,
         )
 
     @staticmethod
-    async def publish(result: "TorrentSearchResult") -> int:
-        return await pubsub.publish(Topic.TorrentSearchResult, result.model_dump_json())
+    async def publish(batch: "TorrentSearchResults") -> int:
+        return await pubsub.publish(
+            Topic.TorrentSearchResults,
+            batch,
+            partition_key=batch.search_criteria.imdb,
+        )
 
 
 class TorrentAdded(BaseModel):
@@ -89,16 +119,39 @@ class TorrentAdded(BaseModel):
     category: str
     season: int | None = None
     episode: int | None = None
+    # every season and episode of a pack, empty in events of a single one
+    seasons: list[int] = []
+    episodes: list[int] = []
+
+    @staticmethod
+    async def publish(result: "TorrentAdded") -> int:
+        return await pubsub.publish(Topic.TorrentAdded, result)
+
+
+class TorrentsAdded(BaseModel):
+    """
+    The torrents added while processing one batch of search results. A
+    single TorrentAdded message is read as a batch of one.
+    """
+
+    torrents: list[TorrentAdded] = []
+
+    @model_validator(mode="before")
+    @classmethod
+    def single_torrent(cls: Any, v: Any):
+        if isinstance(v, dict) and "torrents" not in v:
+            return {"torrents": [v]}
+        return v
 
     @staticmethod
-    async def listen(queue: asyncio.Queue["TorrentAdded"], consumer: str):
+    async def listen(queue: asyncio.Queue["TorrentsAdded"], consumer: str):
         await pubsub.consume_topic(
             topic=Topic.TorrentAdded,
-            model=TorrentAdded,
+            model=TorrentsAdded,
             queue=queue,
             consumer=consumer,
         )
 
     @staticmethod
-    async def publish(result: "TorrentAdded") -> int:
-        return await pubsub.publish(Topic.TorrentAdded, result.model_dump_json())
+    async def publish(batch: "TorrentsAdded") -> int:
+        return await pubsub.publish(Topic.TorrentAdded, batch)
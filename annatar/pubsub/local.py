@@ -0,0 +1,130 @@
+"""
+In-process message broker for single node deployments where the API and the
+workers share a process. Published model objects are handed to consumers as
+they are, without serialization, so consumers must not modify them.
+Consumers may run on the event loops of other threads.
+"""
+
+import asyncio
+import itertools
+import threading
+from collections import defaultdict
+from typing import Any, Callable, Type
+
+import structlog
+from pydantic import BaseModel
+
+from annatar import instrumentation
+from annatar.pubsub.pubsub import (
+    REDIS_MESSAGES_CONSUMED,
+    Broker,
+    Delivery,
+    T,
+    Topic,
+)
+
+log = structlog.get_logger(__name__)
+
+
+class LocalDelivery(Delivery[T]):
+    """
+    A message handed over in process. There is nothing to redeliver it from
+    so acknowledging it is a no-op.
+    """
+
+    def __init__(self, message: T, topic: Topic, group: str):
+        super().__init__(message, stream=str(topic), group=group, entry_id=b"")
+
+    async def ack(self) -> None:
+        return
+
+
+class Inbox:
+    """
+    The messages of one consumer, buffered on the consumer's event loop
+    """
+
+    def __init__(self):
+        self.loop = asyncio.get_running_loop()
+        self.messages: asyncio.Queue[BaseModel] = asyncio.Queue()
+
+    def put(self, msg: BaseModel) -> bool:
+        try:
+            self.loop.call_soon_threadsafe(self.messages.put_nowait, msg)
+            return True
+        except RuntimeError:
+            # the consumer's event loop is closed
+            return False
+
+
+class LocalBroker(Broker):
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subscribers: dict[Topic, set[Inbox]] = defaultdict(set)
+        self._groups: dict[Topic, dict[str, list[Inbox]]] = defaultdict(dict)
+        self._turn = itertools.count()
+
+    async def publish(self, topic: Topic, msg: BaseModel, _partition_key: str | None) -> int:
+        """
+        Returns the number of consumers the message was handed to. Stream
+        topics rotate over the members of each group, there are no
+        partitions to pick with the partition key.
+        """
+        with self._lock:
+            if topic.is_stream:
+                turn = next(self._turn)
+                inboxes = [m[turn % len(m)] for m in self._groups[topic].values() if m]
+            else:
+                inboxes = list(self._subscribers[topic])
+        return sum(inbox.put(msg) for inbox in inboxes)
+
+    async def consume_topic(
+        self, topic: Topic, queue: asyncio.Queue[T], model: Type[T], consumer: str
+    ) -> None:
+        log.info("begin consuming topic", topic=topic, broker="memory")
+        inbox = Inbox()
+        with self._lock:
+            self._subscribers[topic].add(inbox)
+        try:
+            await self._pump(topic, inbox, queue, model, consumer, lambda msg: msg)
+        finally:
+            with self._lock:
+                self._subscribers[topic].discard(inbox)
+
+    async def consume_stream(
+        self, topic: Topic, queue: asyncio.Queue[Delivery[T]], model: Type[T], group: str
+    ) -> None:
+        log.info("begin consuming stream", topic=topic, group=group, broker="memory")
+        inbox = Inbox()
+        with self._lock:
+            self._groups[topic].setdefault(group, []).append(inbox)
+        try:
+            await self._pump(
+                topic, inbox, queue, model, group, lambda msg: LocalDelivery(msg, topic, group)
+            )
+        finally:
+            with self._lock:
+                self._groups[topic][group].remove(inbox)
+
+    async def _pump(
+        self,
+        topic: Topic,
+        inbox: Inbox,
+        queue: asyncio.Queue[Any],
+        model: Type[T],
+        consumer: str,
+        wrap: Callable[[T], Any],
+    ) -> None:
+        queue_depth = instrumentation.QUEUE_DEPTH.labels(
+            queue=topic,
+            consumer=consumer,
+            maxdepth=queue.maxsize,
+        )
+        while True:
+            msg = await inbox.messages.get()
+            if not isinstance(msg, model):
+                # e.g. a TorrentAdded read as a batch of one TorrentsAdded
+                msg = model.model_validate(msg.model_dump())
+            await queue.put(wrap(msg))
+            queue_depth.set(queue.qsize())
+            REDIS_MESSAGES_CONSUMED.labels(topic).inc()
@@ -0,0 +1,143 @@
+"""
+Popularity of the titles users search for, used to refresh the most popular
+ones before their cached search results expire.
+
+Every search adds one to a counter of the title in a sorted set. Once per
+tick one process halves the counters every POPULARITY_HALF_LIFE and
+publishes background SearchRequests for the hottest titles that nobody
+searched or refreshed within REFRESH_AHEAD_PERIOD, within a budget of
+Jackett requests per minute.
+"""
+
+import asyncio
+import os
+from datetime import timedelta
+
+import structlog
+from prometheus_client import Counter
+from pydantic import ValidationError
+
+from annatar import config, instrumentation
+from annatar.database import db
+from annatar.database.semaphore import Priority
+from annatar.pubsub.events import SearchRequest
+
+log = structlog.get_logger(__name__)
+
+REFRESH_AHEAD_ENABLED = os.getenv("REFRESH_AHEAD_ENABLED", "true").lower() == "true"
+POPULARITY_HALF_LIFE = timedelta(hours=float(os.getenv("POPULARITY_HALF_LIFE_HOURS", "6")))
+# titles below this score are not refreshed ahead
+REFRESH_AHEAD_MIN_SCORE = float(os.getenv("REFRESH_AHEAD_MIN_SCORE", "2"))
+# refreshed titles are searched again at most this often. Shorter than the
+# time Jackett results are served stale so they never expire.
+REFRESH_AHEAD_PERIOD = timedelta(minutes=int(os.getenv("REFRESH_AHEAD_PERIOD_MINUTES", "60")))
+REFRESH_AHEAD_JACKETT_CALLS_PER_MINUTE = int(
+    os.getenv("REFRESH_AHEAD_JACKETT_CALLS_PER_MINUTE", "30")
+)
+POPULARITY_MAX_TITLES = 10_000
+# decayed counters below this are forgotten
+POPULARITY_MIN_SCORE = 0.05
+TICK = timedelta(minutes=1)
+PAGE_SIZE = 20
+# hottest titles considered per tick
+MAX_SCAN = 500
+
+POPULARITY_KEY = "popularity:v1:searches"
+
+REFRESH_AHEAD_SEARCHES = Counter(
+    name="refresh_ahead_searches",
+    documentation="Background searches published for popular titles",
+    registry=instrumentation.registry(),
+)
+
+
+def member(request: SearchRequest) -> str:
+    return request.model_dump_json(include={"imdb", "category", "season", "episode"})
+
+
+def refreshed_key(member: str) -> str:
+    return f"popularity:v1:refreshed:{member}"
+
+
+def jackett_calls(request: SearchRequest) -> int:
+    """
+    The Jackett requests a search costs: the IMDb and title queries, and
+    the season query for series, on every indexer
+    """
+    return len(config.JACKETT_INDEXERS_LIST) * (3 if request.season else 2)
+
+
+async def record(request: SearchRequest) -> None:
+    """
+    Count a search of a user. The search refreshes the title so it is not
+    refreshed ahead until REFRESH_AHEAD_PERIOD later.
+    """
+    m = member(request)
+    await asyncio.gather(
+        db.zincrby(POPULARITY_KEY, m, 1),
+        db.set(refreshed_key(m), "1", ttl=REFRESH_AHEAD_PERIOD),
+    )
+
+
+async def tick() -> int:
+    """
+    Decay the counters and refresh the hottest titles that are due. Returns
+    the number of searches published.
+    """
+    await db.zdecay(
+        POPULARITY_KEY,
+        factor=0.5 ** (TICK / POPULARITY_HALF_LIFE),
+        keep=POPULARITY_MAX_TITLES,
+        min_score=POPULARITY_MIN_SCORE,
+    )
+    budget = REFRESH_AHEAD_JACKETT_CALLS_PER_MINUTE * TICK / timedelta(minutes=1)
+    cheapest = len(config.JACKETT_INDEXERS_LIST) * 2
+    published = 0
+    offset = 0
+    while budget >= cheapest and offset < MAX_SCAN:
+        hot = await db.zrange_desc(POPULARITY_KEY, REFRESH_AHEAD_MIN_SCORE, offset, PAGE_SIZE)
+        if not hot:
+            break
+        offset += len(hot)
+        members = [m for m, _ in hot]
+        due = await db.try_lock_many([refreshed_key(m) for m in members], REFRESH_AHEAD_PERIOD)
+        for m, locked in zip(members, due, strict=True):
+            if not locked:
+                continue
+            try:
+                request = SearchRequest.model_validate_json(m)
+            except ValidationError:
+                await db.unlock(refreshed_key(m))
+                continue
+            cost = jackett_calls(request)
+            if cost > budget:
+                # left for the next tick
+                await db.unlock(refreshed_key(m))
+                continue
+            budget -= cost
+            request.priority = Priority.BACKGROUND
+            await SearchRequest.publish(request)
+            published += 1
+    if published:
+        log.info("refreshing popular titles ahead", count=published)
+        REFRESH_AHEAD_SEARCHES.inc(published)
+    return published
+
+
+async def run() -> None:
+    """
+    Run a tick every TICK in one process of the deployment until cancelled
+    """
+    if not REFRESH_AHEAD_ENABLED:
+        log.info("refresh ahead is disabled")
+        return
+    log.info("starting refresh ahead scheduler")
+    while True:
+        try:
+            if await db.try_lock("popularity:v1:tick", TICK):
+                await tick()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            log.error("refresh ahead failed", exc_info=e)
+        await asyncio.sleep(TICK.total_seconds())
@@ -1,13 +1,22 @@
 import asyncio
+import json
+import os
+import platform
+import threading
+import time
+import zlib
+from abc import ABC, abstractmethod
+from datetime import timedelta
 from enum import Enum
-from typing import Type, TypeVar
+from typing import Any, Generic, Type, TypeVar
 
 import structlog
-from prometheus_client import Counter, Gauge
+from prometheus_client import Counter, Gauge, Histogram
 from pydantic import BaseModel
+from redis.exceptions import RedisError, ResponseError
 
-from annatar import instrumentation
-from annatar.database.db import redis
+from annatar import config, instrumentation
+from annatar.database import db
 
 log = structlog.get_logger(__name__)
 
@@ -28,18 +37,185 @@ REDIS_MESSAGES_PUBLISHED = Counter(
 )
 
 
+REDIS_MESSAGE_LAG = Histogram(
+    name="redis_pubsub_message_lag_seconds",
+    documentation="Time between publishing a message and a consumer receiving it",
+    labelnames=["topic"],
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10),
+    registry=instrumentation.registry(),
+)
+
+IDLE_TIMEOUT = 30.0
+RECONNECT_MIN_DELAY = 0.1
+RECONNECT_MAX_DELAY = 5.0
+
+# Streams are trimmed to roughly this many entries per partition
+STREAM_MAX_LEN = int(os.getenv("PUBSUB_STREAM_MAX_LEN", "10000"))
+# Number of streams each work topic is spread over by its partition key
+STREAM_PARTITIONS = max(1, int(os.getenv("PUBSUB_STREAM_PARTITIONS", "1")))
+# Pending entries idle for longer than this are reclaimed from their consumer
+STREAM_CLAIM_IDLE = timedelta(seconds=int(os.getenv("PUBSUB_STREAM_CLAIM_IDLE_SECONDS", "300")))
+STREAM_CLAIM_INTERVAL = timedelta(seconds=30)
+# Messages that failed this many deliveries are dropped instead of retried
+STREAM_MAX_DELIVERIES = max(1, int(os.getenv("PUBSUB_STREAM_MAX_DELIVERIES", "5")))
+# Must stay below the socket timeout of the database connections
+STREAM_BLOCK = timedelta(seconds=2)
+STREAM_READ_COUNT = 10
+
+
 class Topic(str, Enum):
-    TorrentSearchResult = "events:v1:torrent:search_result"
+    TorrentSearchResults = "events:v1:torrent:search_results"
     TorrentAdded = "events:v1:torrent:added"
     SearchRequest = "events:v1:search:request"
 
     def __str__(self):
         return self.value
 
+    @property
+    def is_stream(self) -> bool:
+        """
+        Work topics are Redis Streams read by consumer groups so every
+        message goes to exactly one worker of each group. Notification
+        topics are broadcast to every subscriber with pub/sub.
+        """
+        return self in (Topic.SearchRequest, Topic.TorrentSearchResults)
+
+    def partition(self, key: str | None) -> str:
+        """
+        The stream holding messages for the partition key
+        """
+        if not key or STREAM_PARTITIONS == 1:
+            return f"{self.value}:0"
+        return f"{self.value}:{zlib.crc32(key.encode()) % STREAM_PARTITIONS}"
+
+    def partitions(self) -> list[str]:
+        return [f"{self.value}:{p}" for p in range(STREAM_PARTITIONS)]
+
+
+class Delivery(Generic[T]):
+    """
+    A message read from a stream. It stays pending, and is eventually
+    redelivered to another consumer, until it is acknowledged. deliveries is
+    the number of times it has been delivered, including this one.
+    """
+
+    def __init__(self, message: T, stream: str, group: str, entry_id: bytes, deliveries: int = 1):
+        self.message = message
+        self.stream = stream
+        self.group = group
+        self.entry_id = entry_id
+        self.deliveries = deliveries
+
+    async def ack(self) -> None:
+        try:
+            await db.client().xack(self.stream, self.group, self.entry_id)
+        except RedisError as e:
+            log.warning("failed to ack message", stream=self.stream, id=self.entry_id, exc_info=e)
+
+    async def fail(self) -> None:
+        """
+        Record that processing the message failed. It stays pending so it is
+        redelivered after STREAM_CLAIM_IDLE, unless it has already been
+        delivered STREAM_MAX_DELIVERIES times in which case it is dropped.
+        """
+        if self.deliveries < STREAM_MAX_DELIVERIES:
+            return
+        log.error(
+            "dropping message that failed too many times",
+            stream=self.stream,
+            id=self.entry_id,
+            deliveries=self.deliveries,
+        )
+        await self.ack()
+
+
+class Broker(ABC):
+    """
+    Carries messages from publishers to the consumers of a topic. Notification
+    topics are delivered to every consumer, stream topics to one consumer of
+    each group.
+    """
+
+    @abstractmethod
+    async def publish(self, topic: Topic, msg: BaseModel, partition_key: str | None) -> int: ...
+
+    @abstractmethod
+    async def consume_topic(
+        self, topic: Topic, queue: asyncio.Queue[T], model: Type[T], consumer: str
+    ) -> None: ...
+
+    @abstractmethod
+    async def consume_stream(
+        self, topic: Topic, queue: asyncio.Queue[Delivery[T]], model: Type[T], group: str
+    ) -> None: ...
+
+
+class RedisBroker(Broker):
+    """
+    Pub/sub for notification topics and Redis Streams for work topics.
+    Required when the API and the workers run in different processes.
+    """
+
+    async def publish(self, topic: Topic, msg: BaseModel, partition_key: str | None) -> int:
+        data = msg.model_dump_json()
+        if topic.is_stream:
+            await db.client().xadd(
+                topic.partition(partition_key),
+                {"msg": data},
+                maxlen=STREAM_MAX_LEN,
+                approximate=True,
+            )
+            return 1
+        return await db.client().publish(str(topic), encode(data))
+
+    async def consume_topic(
+        self, topic: Topic, queue: asyncio.Queue[T], model: Type[T], consumer: str
+    ) -> None:
+        await redis_consume_topic(topic, queue, model, consumer)
+
+    async def consume_stream(
+        self, topic: Topic, queue: asyncio.Queue[Delivery[T]], model: Type[T], group: str
+    ) -> None:
+        await redis_consume_stream(topic, queue, model, group)
+
+
+_broker: Broker | None = None
+_broker_lock = threading.Lock()
+
+
+def configure(name: str = config.PUBSUB_BROKER) -> Broker:
+    """
+    Select the broker shared by every thread of this process
+    """
+    global _broker  # noqa: PLW0603
+    if name == "redis":
+        selected: Broker = RedisBroker()
+    elif name == "memory":
+        # imported here because it builds on this module
+        from annatar.pubsub.local import LocalBroker
+
+        selected = LocalBroker()
+    else:
+        raise ValueError(f"unknown pubsub broker: {name}")
+    with _broker_lock:
+        _broker = selected
+    log.info("configured pubsub broker", broker=name)
+    return selected
+
+
+def broker() -> Broker:
+    with _broker_lock:
+        if _broker is not None:
+            return _broker
+    return configure()
+
 
-async def publish(topic: Topic, msg: str) -> int:
+async def publish(topic: Topic, msg: BaseModel, partition_key: str | None = None) -> int:
+    """
+    Publish a message. Work topics are partitioned by partition_key.
+    """
     REDIS_MESSAGES_PUBLISHED.labels(topic).inc()
-    return redis.publish(topic, msg)
+    return await broker().publish(topic, msg, partition_key)
 
 
 async def consume_topic(
@@ -49,44 +225,276 @@ async def consume_topic(
     consumer: str,
 ):
     """
-    Consume a topic indefinitely. If timeout is set then consumption will end
-    if nothing has been received for the duration of the timeout.
+    Consume a notification topic indefinitely
+    """
+    await broker().consume_topic(topic, queue, model, consumer)
+
+
+async def consume_stream(
+    topic: Topic,
+    queue: asyncio.Queue[Delivery[T]],
+    model: Type[T],
+    group: str,
+):
+    """
+    Consume a work topic indefinitely as a member of a consumer group. Every
+    message is delivered to one consumer of the group and must be
+    acknowledged once processed.
+    """
+    await broker().consume_stream(topic, queue, model, group)
+
+
+def encode(msg: str) -> str:
+    """
+    Wrap a serialized message in an envelope carrying the publish time
+    """
+    return f'{{"published_at":{time.time()},"msg":{msg}}}'
+
+
+def decode(data: bytes | str, model: Type[T]) -> tuple[T, float | None]:
+    """
+    Returns the message and its publish time. Messages published without an
+    envelope have no publish time.
+    """
+    raw: Any = json.loads(data)
+    if isinstance(raw, dict) and raw.keys() == {"published_at", "msg"}:
+        return model.model_validate(raw["msg"]), float(raw["published_at"])
+    return model.model_validate(raw), None
+
+
+async def redis_consume_topic(
+    topic: Topic,
+    queue: asyncio.Queue[T],
+    model: Type[T],
+    consumer: str,
+):
+    """
+    Consume a pub/sub topic indefinitely. Messages are read as soon as they arrive
+    and the subscription is re-established if the connection is lost.
     """
     log.info("begin consuming topic", topic=topic)
-    pubsub = redis.pubsub()
-    pubsub.subscribe(topic)
-    pubsub.listen()
     queue_depth: Gauge = instrumentation.QUEUE_DEPTH.labels(
         queue=topic,
         consumer=consumer,
         maxdepth=queue.maxsize,
     )
+    backoff = RECONNECT_MIN_DELAY
     while True:
-        # timeout because this does not support asyncio so we have to give up after
-        # some time. If this timeout is too low then this will consume all of the
-        # process time. We have to delay between empty messages caused by timeout
-        # and retrying.
-        queue_depth.set(queue.qsize())
-        message = pubsub.get_message(ignore_subscribe_messages=True, timeout=0.10)
-        if message is None:
-            await asyncio.sleep(1)
-            continue
-        if message.get("type", "") != "message":
-            continue
-        data = message.get("data", {})
+        pubsub = db.client().pubsub()
         try:
-            await queue.put(model.model_validate_json(data))
-            REDIS_MESSAGES_CONSUMED.labels(topic).inc()
-        except asyncio.QueueFull:
-            log.error("queue is overflowing", topic=topic)
-            continue
-        except Exception as e:
-            log.error(
-                "failed to deserialize message from queue",
-                topic=topic,
-                model=model,
-                object=data,
-                exc_info=e,
-            )
-    log.info("closing subscription to topic", topic=topic)
-    pubsub.close()
+            await pubsub.subscribe(str(topic))
+            backoff = RECONNECT_MIN_DELAY
+            while True:
+                queue_depth.set(queue.qsize())
+                # This waits on the socket. The timeout only bounds how stale
+                # the queue depth gauge can get while the topic is idle.
+                message = await pubsub.get_message(
+                    ignore_subscribe_messages=True,
+                    timeout=IDLE_TIMEOUT,
+                )
+                if message is None or message.get("type", "") != "message":
+                    continue
+                await deliver(topic, queue, model, message.get("data", b""))
+        except asyncio.CancelledError:
+            log.info("closing subscription to topic", topic=topic)
+            raise
+        except (RedisError, OSError) as e:
+            log.warning("lost subscription to topic", topic=topic, retry_in=backoff, exc_info=e)
+        finally:
+            await pubsub.aclose()
+        await asyncio.sleep(backoff)
+        backoff = min(backoff * 2, RECONNECT_MAX_DELAY)
+
+
+async def deliver(topic: Topic, queue: asyncio.Queue[T], model: Type[T], data: bytes) -> None:
+    try:
+        msg, published_at = decode(data, model)
+    except Exception as e:
+        log.error(
+            "failed to deserialize message from queue",
+            topic=topic,
+            model=model,
+            object=data,
+            exc_info=e,
+        )
+        return
+    if published_at is not None:
+        REDIS_MESSAGE_LAG.labels(topic).observe(max(0.0, time.time() - published_at))
+    await queue.put(msg)
+    REDIS_MESSAGES_CONSUMED.labels(topic).inc()
+
+
+async def redis_consume_stream(
+    topic: Topic,
+    queue: asyncio.Queue[Delivery[T]],
+    model: Type[T],
+    group: str,
+):
+    """
+    Consume a stream topic indefinitely as a member of a consumer group.
+    Every message is delivered to one consumer of the group and must be
+    acknowledged once processed. Messages left pending by consumers that
+    died are reclaimed after STREAM_CLAIM_IDLE.
+    """
+    # shared by the threads of this process, each read still gets other entries
+    consumer = f"{platform.node()}-{os.getpid()}"
+    streams = topic.partitions()
+    log.info("begin consuming stream", topic=topic, group=group, consumer=consumer)
+    queue_depth: Gauge = instrumentation.QUEUE_DEPTH.labels(
+        queue=topic,
+        consumer=group,
+        maxdepth=queue.maxsize,
+    )
+    backoff = RECONNECT_MIN_DELAY
+    while True:
+        try:
+            for stream in streams:
+                await create_group(stream, group)
+            backoff = RECONNECT_MIN_DELAY
+            await read_streams(topic, queue, model, group, consumer, queue_depth)
+        except asyncio.CancelledError:
+            log.info("stop consuming stream", topic=topic, group=group)
+            raise
+        except (RedisError, OSError) as e:
+            log.warning("lost connection to stream", topic=topic, retry_in=backoff, exc_info=e)
+        await asyncio.sleep(backoff)
+        backoff = min(backoff * 2, RECONNECT_MAX_DELAY)
+
+
+async def read_streams(
+    topic: Topic,
+    queue: asyncio.Queue[Delivery[T]],
+    model: Type[T],
+    group: str,
+    consumer: str,
+    queue_depth: Gauge,
+):
+    streams = topic.partitions()
+    last_claim = 0.0
+    while True:
+        queue_depth.set(queue.qsize())
+        if time.monotonic() - last_claim > STREAM_CLAIM_INTERVAL.total_seconds():
+            last_claim = time.monotonic()
+            for stream in streams:
+                limit = read_count(queue)
+                claimed = await claim_pending(stream, group, consumer, limit)
+                if len(claimed) >= limit:
+                    # more may be idle, claim again after the next read
+                    last_claim = 0.0
+                for entry_id, fields, deliveries in claimed:
+                    await deliver_entry(
+                        topic, queue, model, stream, group, entry_id, fields, deliveries
+                    )
+                await delete_idle_consumers(stream, group, consumer)
+
+        response = await db.client().xreadgroup(
+            groupname=group,
+            consumername=consumer,
+            streams={stream: ">" for stream in streams},
+            count=read_count(queue),
+            block=int(STREAM_BLOCK.total_seconds() * 1000),
+        )
+        for stream, entries in response or []:
+            for entry_id, fields in entries:
+                await deliver_entry(
+                    topic, queue, model, stream.decode("utf-8"), group, entry_id, fields
+                )
+
+
+def read_count(queue: asyncio.Queue[Any]) -> int:
+    """
+    The number of entries to read so a consumer does not take more than its
+    queue has room for while other consumers of the group are idle
+    """
+    if queue.maxsize <= 0:
+        return STREAM_READ_COUNT
+    return max(1, min(STREAM_READ_COUNT, queue.maxsize - queue.qsize()))
+
+
+async def create_group(stream: str, group: str) -> None:
+    try:
+        await db.client().xgroup_create(stream, group, id="$", mkstream=True)
+    except ResponseError as e:
+        if "BUSYGROUP" not in str(e):
+            raise
+
+
+async def claim_pending(
+    stream: str, group: str, consumer: str, limit: int = STREAM_READ_COUNT
+) -> list[tuple[bytes, Any, int]]:
+    """
+    Take over up to limit entries that have been pending for longer than
+    STREAM_CLAIM_IDLE. Returns each entry with the number of times it has
+    been delivered.
+    """
+    claimed: list[tuple[bytes, Any]] = []
+    start: bytes | str = "0-0"
+    while len(claimed) < limit:
+        response = await db.client().xautoclaim(
+            stream,
+            group,
+            consumer,
+            min_idle_time=int(STREAM_CLAIM_IDLE.total_seconds() * 1000),
+            start_id=start,
+            count=limit - len(claimed),
+        )
+        start, entries = response[0], response[1]
+        # entries deleted by trimming come back without fields
+        claimed.extend((entry_id, fields) for entry_id, fields in entries if fields)
+        if start in (b"0-0", "0-0"):
+            break
+    if not claimed:
+        return []
+    log.info("reclaimed pending messages", stream=stream, group=group, count=len(claimed))
+    async with db.client().pipeline(transaction=False) as pipe:
+        for entry_id, _ in claimed:
+            pipe.xpending_range(stream, group, min=entry_id, max=entry_id, count=1)
+        pending = await pipe.execute()
+    return [
+        (entry_id, fields, found[0]["times_delivered"] if found else 1)
+        for (entry_id, fields), found in zip(claimed, pending, strict=True)
+    ]
+
+
+async def delete_idle_consumers(stream: str, group: str, consumer: str) -> None:
+    """
+    Remove the consumers of stopped processes once nothing is pending for
+    them. A live consumer that is removed is added back by its next read.
+    """
+    idle = int(STREAM_CLAIM_IDLE.total_seconds() * 1000)
+    for info in await db.client().xinfo_consumers(stream, group):
+        name = info["name"].decode("utf-8")
+        if name != consumer and not info["pending"] and info["idle"] >= idle:
+            await db.client().xgroup_delconsumer(stream, group, name)
+            log.info("deleted idle consumer", stream=stream, group=group, consumer=name)
+
+
+async def deliver_entry(
+    topic: Topic,
+    queue: asyncio.Queue[Delivery[T]],
+    model: Type[T],
+    stream: str,
+    group: str,
+    entry_id: bytes,
+    fields: dict[bytes, bytes],
+    deliveries: int = 1,
+) -> None:
+    try:
+        delivery = Delivery(
+            model.model_validate_json(fields[b"msg"]), stream, group, entry_id, deliveries
+        )
+    except Exception as e:
+        log.error(
+            "failed to deserialize message from stream",
+            topic=topic,
+            model=model,
+            object=fields,
+            exc_info=e,
+        )
+        # it will never deserialize so do not let it be redelivered
+        await db.client().xack(stream, group, entry_id)
+        return
+    published_ms = int(entry_id.split(b"-")[0])
+    REDIS_MESSAGE_LAG.labels(topic).observe(max(0.0, time.time() - published_ms / 1000))
+    await queue.put(delivery)
+    REDIS_MESSAGES_CONSUMED.labels(topic).inc()
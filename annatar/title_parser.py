@@ -0,0 +1,180 @@
+"""
+Memoized torrent title parsing.
+
+Parsing a title with PTN is pure CPU work that runs on the event loop of the
+API workers and the processor threads, which share one GIL in the run.py
+process. Parsed titles are kept in a bounded LRU memo since the same
+titles are parsed over and over. In the process running the torrent processors large
+batches of new titles are parsed in a small pool of worker processes so
+they do not block the event loops, see enable_pool. Other processes, like
+the API workers, parse inline.
+"""
+
+import asyncio
+import math
+import multiprocessing
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import structlog
+from prometheus_client import Counter
+
+from annatar import instrumentation
+from annatar.torrent import TorrentMeta
+
+log = structlog.get_logger(__name__)
+
+PARSE_CACHE_SIZE = int(os.getenv("PARSE_CACHE_SIZE", "50000"))
+PARSE_PROCESSES = int(os.getenv("PARSE_PROCESSES") or min(4, os.cpu_count() or 1))
+# batches with fewer new titles are parsed inline because sending them to
+# another process costs more than parsing them
+PARSE_POOL_MIN_BATCH = int(os.getenv("PARSE_POOL_MIN_BATCH", "64"))
+
+TITLES_PARSED = Counter(
+    name="titles_parsed",
+    documentation="Parsed torrent titles by whether they were memoized or parsed inline or in the pool",
+    labelnames=["result"],
+    registry=instrumentation.registry(),
+)
+
+
+class Memo:
+    """
+    Thread safe LRU of parsed titles. Callers get copies since TorrentMeta
+    is mutable.
+    """
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self._entries: OrderedDict[str, TorrentMeta] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, title: str) -> TorrentMeta | None:
+        with self._lock:
+            meta = self._entries.get(title)
+            if meta is None:
+                return None
+            self._entries.move_to_end(title)
+        return meta.model_copy(deep=True)
+
+    def put(self, title: str, meta: TorrentMeta) -> None:
+        with self._lock:
+            self._entries[title] = meta.model_copy(deep=True)
+            self._entries.move_to_end(title)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+MEMO = Memo(PARSE_CACHE_SIZE)
+
+_pool: ProcessPoolExecutor | None = None
+_pool_enabled = False
+_pool_lock = threading.Lock()
+
+
+def enable_pool() -> None:
+    """
+    Parse large batches in worker processes. Only called by the process
+    running the torrent processors so every API worker does not start a
+    pool of its own.
+    """
+    global _pool_enabled  # noqa: PLW0603
+    _pool_enabled = True
+
+
+def pool() -> ProcessPoolExecutor:
+    """
+    The worker processes, started on first use. They are spawned rather
+    than forked because the parent runs many threads.
+    """
+    global _pool  # noqa: PLW0603
+    with _pool_lock:
+        if _pool is None:
+            log.info("starting title parser processes", processes=PARSE_PROCESSES)
+            _pool = ProcessPoolExecutor(
+                max_workers=PARSE_PROCESSES,
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+        return _pool
+
+
+def shutdown() -> None:
+    global _pool  # noqa: PLW0603
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown(wait=False, cancel_futures=True)
+            _pool = None
+
+
+def parse_title(title: str) -> TorrentMeta:
+    """
+    TorrentMeta.parse_title through the memo
+    """
+    if (meta := MEMO.get(title)) is not None:
+        TITLES_PARSED.labels(result="memo").inc()
+        return meta
+    meta = TorrentMeta.parse_title(title)
+    MEMO.put(title, meta)
+    TITLES_PARSED.labels(result="inline").inc()
+    return meta
+
+
+async def parse_titles(titles: list[str]) -> list[TorrentMeta]:
+    """
+    Parse many titles. Titles that are not memoized are parsed in the
+    worker processes if the pool is enabled and there are at least
+    PARSE_POOL_MIN_BATCH of them.
+    """
+    parsed: dict[str, TorrentMeta] = {}
+    for title in dict.fromkeys(titles):
+        if (meta := MEMO.get(title)) is not None:
+            parsed[title] = meta
+    TITLES_PARSED.labels(result="memo").inc(len(parsed))
+
+    missing = [t for t in dict.fromkeys(titles) if t not in parsed]
+    if _pool_enabled and len(missing) >= PARSE_POOL_MIN_BATCH:
+        parsed.update(zip(missing, await _parse_in_pool(missing), strict=True))
+        TITLES_PARSED.labels(result="pool").inc(len(missing))
+    else:
+        parsed.update((t, TorrentMeta.parse_title(t)) for t in missing)
+        TITLES_PARSED.labels(result="inline").inc(len(missing))
+    for title in missing:
+        MEMO.put(title, parsed[title])
+
+    # duplicate titles get their own copy
+    seen: set[str] = set()
+    results: list[TorrentMeta] = []
+    for title in titles:
+        meta = parsed[title]
+        results.append(meta.model_copy(deep=True) if title in seen else meta)
+        seen.add(title)
+    return results
+
+
+async def _parse_in_pool(titles: list[str]) -> list[TorrentMeta]:
+    loop = asyncio.get_running_loop()
+    size = math.ceil(len(titles) / PARSE_PROCESSES)
+    chunks = [titles[i : i + size] for i in range(0, len(titles), size)]
+    try:
+        results = await asyncio.gather(
+            *[loop.run_in_executor(pool(), _parse_chunk, chunk) for chunk in chunks]
+        )
+    except BrokenProcessPool as e:
+        log.error("title parser processes died, parsing inline", exc_info=e)
+        shutdown()
+        return _parse_chunk(titles)
+    return [meta for chunk in results for meta in chunk]
+
+
+def _parse_chunk(titles: list[str]) -> list[TorrentMeta]:
+    return [TorrentMeta.parse_title(title) for title in titles]
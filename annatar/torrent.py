@@ -1,11 +1,26 @@
+import functools
+import re
 from enum import Enum
-from typing import Any, Generator
+from typing import Any, Generator, NamedTuple
 
 import Levenshtein
 import PTN
 import structlog
 from pydantic import BaseModel, Field, field_validator
 
+# The fast parser reuses the patterns and helpers of PTN, which are not part
+# of its public API. Titles are parsed with PTN.parse if they are missing.
+try:
+    from PTN.extras import exceptions as ptn_exceptions
+    from PTN.parse import PTN as PTNParser
+    from PTN.patterns import patterns as ptn_patterns
+    from PTN.patterns import patterns_allow_overlap, patterns_ordered
+    from PTN.patterns import types as ptn_types
+
+    FAST_PARSE = True
+except ImportError:
+    FAST_PARSE = False
+
 log = structlog.get_logger(__name__)
 
 # Space required for values
@@ -15,6 +30,10 @@ log = structlog.get_logger(__name__)
 # 4 bits: 16 values  (0 to 15)
 # I'm not using any more than this. 8 is far too wide a decision tree
 
+# Version of the parsed TorrentMeta stored alongside each torrent. Bump this
+# whenever parse_title output changes so stored entries are re-parsed.
+META_SCHEMA_VERSION = 3
+
 TRASH = ["Cam", "Telesync", "Telecine", "Screener", "Workprint"]
 SEASON_MATCH_BIT_POS = 20
 RESOLUTION_BIT_POS = 14
@@ -63,6 +82,469 @@ def get_resolution(score: int) -> str:
     return "Unknown"
 
 
+# Fast title parsing
+#
+# PTN runs each of its several hundred patterns over the whole title and
+# post-processes the leftovers into fields that are never used here. The
+# fast parser splits a title into its words and the tags of a small
+# vocabulary in one scan, reads the scoring fields of each distinct tag with
+# PTN's own patterns once, and picks the values PTN would pick from them.
+# The title is the words before the first tag. Titles with anything outside
+# the vocabulary after the title, or with words PTN could read as a field,
+# are left to PTN.
+
+FAST_PARSE_KEYS = [
+    key
+    for key in patterns_ordered
+    if key
+    in {
+        "resolution",
+        "quality",
+        "season",
+        "episode",
+        "year",
+        "codec",
+        "audio",
+        "bitDepth",
+        "hdr",
+        "remux",
+    }
+]
+
+# keys whose patterns PTN does not wrap in word boundaries
+UNBOUNDED_KEYS = {"season", "episode", "site", "language", "genre"}
+
+FAST_AUDIO = (
+    r"(?:DTS-HD[. ]MA|DTS-HD|DTS-?X|DTS-?ES|DTS-?EX|DTS|TrueHD|Atmos"
+    r"|DDP|DD\+|DD|EAC-?3|AC-?3|AAC|FLAC|MP3)"
+)
+FAST_CHANNELS = r"[1-7][. ]?[01](?:ch)?"
+
+# the vocabulary, longer tags first where one starts with another
+FAST_TAGS = [
+    # seasons and episodes
+    r"S\d{1,2}(?:[. ]S\d{1,2})+",
+    r"S\d{1,2}-S?\d{1,2}",
+    r"S\d{1,2}(?:E\d{1,3}(?:-?E?\d{1,3})*)?",
+    r"\d{1,2}x\d{2}",
+    # years and resolutions
+    r"(?:19|20)\d\d",
+    r"\d{3,4}[pi]",
+    r"[2458]K",
+    r"UHD",
+    # sources
+    r"WEB[. -]?DL(?:Rip|Mux)?",
+    r"WEB-?Rip",
+    r"WEB",
+    r"HDTV",
+    r"Blu-?Ray",
+    r"BDRip",
+    r"BRRip",
+    r"BDRemux",
+    r"DVDRip",
+    r"HDRip",
+    r"REMUX",
+    r"(?:HD)?CAM",
+    r"(?:HD)?TS",
+    r"TELESYNC",
+    r"(?:HD)?TC",
+    r"(?:DVD)?SCR",
+    r"PDTV",
+    r"DVD(?:R|5|9)?",
+    # codecs
+    r"[HX][. ]?26[345]",
+    r"HEVC",
+    r"AVC",
+    r"XviD",
+    r"AV1",
+    r"VC-1",
+    # audio
+    rf"{FAST_AUDIO}(?:[. ]?{FAST_CHANNELS})?",
+    r"[1-7]\.[01]",
+    # video
+    r"(?:8|10|12)-?bits?",
+    r"HDR(?:10\+?)?",
+    r"DV",
+    r"DoVi",
+    r"HLG",
+    r"SDR",
+    # editions, networks and languages
+    r"PROPER",
+    r"REPACK",
+    r"RERIP",
+    r"EXTENDED",
+    r"IMAX",
+    r"UNRATED",
+    r"REMASTERED",
+    r"LIMITED",
+    r"INTERNAL",
+    r"COMPLETE",
+    r"MULTi",
+    r"DUBBED",
+    r"SUBBED",
+    r"AMZN",
+    r"NF",
+    r"DSNP",
+    r"HMAX",
+    r"ATVP",
+    r"HULU",
+    r"PCOK",
+    r"PMTP",
+    r"AMC",
+    r"MAX",
+    r"ENG",
+    r"ITA",
+    r"FRENCH",
+    r"TRUEFRENCH",
+    r"GERMAN",
+    r"SPANISH",
+    r"VOSTFR",
+    r"HINDI",
+    r"JAPANESE",
+    r"KOREAN",
+]
+
+FAST_TOKEN = re.compile(
+    rf"(?P<tag>{'|'.join(FAST_TAGS)})(?=[. ]|-[A-Za-z0-9]+$|$)"
+    r"|(?P<word>[A-Za-z0-9']+)(?=[. ]|$)"
+    r"|(?P<sep>[. ])"
+    r"|(?P<group>-[A-Za-z0-9]+$)",
+    re.IGNORECASE,
+)
+
+# words that PTN reads as part of a field together with the tag before them
+FAST_CONTINUATIONS = {
+    "aac",
+    "audio",
+    "cap",
+    "ch",
+    "channel",
+    "cut",
+    "dl",
+    "es",
+    "ex",
+    "hd",
+    "lc",
+    "ma",
+    "main",
+    "main10",
+    "mux",
+    "part",
+    "pt",
+    "rip",
+    "x",
+}
+
+# a title word, which must have a letter since PTN reads numbers as fields
+# together with the words around them
+FAST_TITLE_WORD = re.compile(r"[A-Za-z0-9']*[A-Za-z][A-Za-z0-9']*")
+
+# words that PTN reads as a field together with the word before them, or
+# strips from the end of titles
+FAST_TITLE_STOPWORDS = {
+    "aud",
+    "audio",
+    "audios",
+    "complete",
+    "cut",
+    "liv",
+    "season",
+    "seasons",
+}
+
+# PTN only matches audio after the year or season if this is present
+AUDIO_AFTER_TITLE = re.compile(r"LiNE", re.IGNORECASE)
+
+
+class _Option(NamedTuple):
+    # number of the group around the option in the combined pattern
+    group: int
+    # capture groups of the option itself
+    groups: int
+    replace: Any
+    transforms: Any
+
+
+class _Combined(NamedTuple):
+    key: str
+    pattern: re.Pattern[str]
+    options: dict[int, tuple[int, _Option]]
+
+
+class _TagMatch(NamedTuple):
+    key: str
+    option: int
+    start: int
+    end: int
+    value: Any
+
+
+def _bounded(key: str, pattern: str) -> str:
+    if key in UNBOUNDED_KEYS:
+        return pattern
+    return rf"\b(?:{pattern})\b"
+
+
+def _combine(key: str) -> _Combined:
+    """
+    Combine the options of a PTN key into one pattern. Each option is wrapped
+    in a group so the option that matched is known.
+    """
+    alternatives: list[str] = []
+    options: dict[int, tuple[int, _Option]] = {}
+    group = 1
+    for i, (pattern, replace, transforms) in enumerate(
+        PTNParser.normalise_pattern_options(ptn_patterns[key])
+    ):
+        bounded = _bounded(key, pattern)
+        groups = re.compile(bounded).groups
+        alternatives.append(f"({bounded})")
+        options[group] = (i, _Option(group, groups, replace, transforms))
+        group += groups + 1
+    return _Combined(key, re.compile("|".join(alternatives), re.IGNORECASE), options)
+
+
+def _any_pattern(keys: list[str]) -> re.Pattern[str]:
+    return re.compile(
+        "|".join(
+            _bounded(key, pattern)
+            for key in keys
+            for pattern, _, _ in PTNParser.normalise_pattern_options(ptn_patterns[key])
+        ),
+        re.IGNORECASE,
+    )
+
+
+FAST_PATTERNS: list[_Combined] = []
+# any PTN pattern, to find title words PTN would read as a field
+ANY_PATTERN = re.compile(r"(?!)")
+# the patterns that can start at the last title word and go on into the
+# first tag. Languages are left out since PTN only matches them after the
+# title, and a language starting the match is a field on its own.
+CROSS_PATTERN = re.compile(r"(?!)")
+EXCEPTION_TITLES: set[str] = set()
+if FAST_PARSE:
+    try:
+        FAST_PATTERNS = [_combine(key) for key in FAST_PARSE_KEYS]
+        ANY_PATTERN = _any_pattern(patterns_ordered)
+        CROSS_PATTERN = _any_pattern([key for key in patterns_ordered if key != "language"])
+        EXCEPTION_TITLES = {e["parsed_title"] for e in ptn_exceptions}
+    except (AttributeError, KeyError, TypeError, ValueError, re.error) as e:
+        log.warning("PTN internals changed, fast title parsing is disabled", exc_info=e)
+        FAST_PARSE = False
+
+
+def _clean(key: str, option: _Option, match: list[Any]) -> Any:
+    """
+    The value PTN gives a match with standardise and coherent_types, or None
+    if it has none
+    """
+    if key in ("season", "episode"):
+        clean = PTNParser.get_season_episode(match)
+    elif ptn_types.get(key) == "boolean":
+        return True
+    else:
+        clean = match[PTNParser.get_match_indexes(match)["clean"]]
+        if ptn_types.get(key) == "integer":
+            clean = int(clean)
+    if clean is None:
+        return None
+    if option.replace:
+        clean = option.replace
+    for transform, args in filter(lambda t: t[0], option.transforms or []):
+        clean = getattr(clean, transform)(*args)
+    return tuple(clean) if isinstance(clean, list) else (clean,)
+
+
+@functools.lru_cache(maxsize=4096)
+def _tag_matches(tag: str) -> tuple[_TagMatch, ...] | None:
+    """
+    The matches of the PTN patterns of the scoring fields in a tag, or None
+    if PTN gives one of them no value
+    """
+    matches: list[_TagMatch] = []
+    for combined in FAST_PATTERNS:
+        for m in combined.pattern.finditer(tag):
+            option_index, option = combined.options[m.lastindex or 0]
+            if option.groups:
+                first = option.group + 1
+                match = [m.group(g) for g in range(first, first + option.groups)]
+            else:
+                match = [m.group(option.group)]
+            value = _clean(combined.key, option, match)
+            if value is None:
+                return None
+            matches.append(_TagMatch(combined.key, option_index, m.start(), m.end(), value))
+    return tuple(matches)
+
+
+@functools.lru_cache(maxsize=65536)
+def _reads_field(word: str) -> bool:
+    """
+    Whether PTN reads a field in a title word
+    """
+    return ANY_PATTERN.search(word) is not None
+
+
+def fast_parse(title: str) -> dict[str, Any] | None:
+    """
+    Parse the fields of a title used for scoring and filtering like PTN
+    does. Returns None if PTN might parse the title differently.
+    """
+    if not FAST_PARSE:
+        return None
+    name = title.strip()
+    if AUDIO_AFTER_TITLE.search(name):
+        return None
+    scanned = _scan(name)
+    if scanned is None:
+        return None
+    title_end, found = scanned
+
+    parts, recorded = _pick(found)
+    if not recorded or min(recorded) != title_end:
+        return None
+
+    words = _title_words(name, title_end)
+    if words is None:
+        return None
+    title_text = " ".join(words)
+    if title_text in EXCEPTION_TITLES:
+        return None
+    parts["title"] = title_text
+    return parts
+
+
+def _scan(name: str) -> tuple[int, list[_TagMatch]] | None:
+    """
+    Split a name into the title and the matches of its tags. Returns where
+    the title ends and the matches, or None if anything after the title is
+    not a tag.
+    """
+    # where the title ends and the tags start
+    title_end: int | None = None
+    found: list[_TagMatch] = []
+    pos = 0
+    for token in FAST_TOKEN.finditer(name):
+        if token.start() != pos:
+            return None
+        pos = token.end()
+        kind = token.lastgroup
+        if kind == "sep" or (kind == "word" and title_end is None):
+            continue
+        if kind == "word":
+            # after the title only tags and the release group are known
+            return None
+        text, start = token.group(), token.start()
+        if kind == "group":
+            text, start = text[1:], start + 1
+            if text.lower() in FAST_CONTINUATIONS:
+                return None
+        elif title_end is None:
+            title_end = start
+        matches = _tag_matches(text)
+        if matches is None:
+            return None
+        found.extend(m._replace(start=start + m.start, end=start + m.end) for m in matches)
+    # titles starting with a tag are named by PTN's leftovers
+    if pos != len(name) or not title_end:
+        return None
+    return title_end, found
+
+
+def _title_words(name: str, title_end: int) -> list[str] | None:
+    """
+    The words of the title before title_end, or None if PTN could read any
+    of them as a field
+    """
+    raw = name[:title_end]
+    separator = raw[-1]
+    if separator not in ". " or (separator == "." and " " in raw):
+        return None
+    words = raw[:-1].split(separator)
+    for word in words:
+        if (
+            not FAST_TITLE_WORD.fullmatch(word)
+            or word.lower() in FAST_TITLE_STOPWORDS
+            or _reads_field(word)
+        ):
+            return None
+    # a field starting in the last word and running into the tags
+    if CROSS_PATTERN.match(name, title_end - len(words[-1]) - 1):
+        return None
+    return words
+
+
+def _pick(found: list[_TagMatch]) -> tuple[dict[str, Any], list[int]]:
+    """
+    Pick the value of each key from the matches like PTN: the options of a
+    key are tried in order, each with its first match (the last one for the
+    year), and a match overlapping an earlier field is skipped. Returns the
+    fields and the starts of the matches PTN records.
+    """
+    parts: dict[str, Any] = {}
+    part_slices: dict[str, tuple[int, int]] = {}
+    recorded: list[int] = []
+    for key in FAST_PARSE_KEYS:
+        chosen: dict[int, _TagMatch] = {}
+        for m in found:
+            if m.key != key:
+                continue
+            if m.option not in chosen or key == "year":
+                chosen[m.option] = m
+        for option in sorted(chosen):
+            m = chosen[option]
+            if key in parts:
+                recorded.append(m.start)
+                continue
+            overlaps = any(
+                s < m.start < e or s < m.end < e
+                for part, (s, e) in part_slices.items()
+                if part not in patterns_allow_overlap
+            )
+            if overlaps:
+                continue
+            parts[key] = list(m.value) if isinstance(m.value, tuple) else m.value
+            part_slices[key] = (m.start, m.end)
+            recorded.append(m.start)
+    return parts, recorded
+
+
+def match_series(seasons: list[int], episodes: list[int], season: int, episode: int) -> int:
+    """
+    Score a torrent based on season and episode where the rank is as follows:
+       3 -> Whole series matches
+       2 -> Whole season matches
+       1 -> Single episode matches
+       0 -> No match at all
+    -100 -> Mismatch Season
+     -10 -> Mismatch Episode
+      -1 -> Unknown mismatch
+    """
+    if not season and not episode:
+        # no season or episode. Probably a movie
+        return 0
+    if seasons and season not in seasons:
+        # season mismatch
+        return -100
+    if episodes and episode not in episodes:
+        # episode mismatch
+        return -10
+    if not seasons and not episodes:
+        # no season or episode
+        return 0
+    if len(seasons) > 1 and season in seasons:
+        # series matches
+        return 3
+    if season in seasons and not episodes:
+        # whole season matches
+        return 2
+    if season in seasons and episode in episodes:
+        # single episode matches
+        return 1
+    return -1
+
+
 class Category(str, Enum):
     Movie = "movie"
     Series = "series"
@@ -140,10 +622,32 @@ class TorrentMeta(BaseModel):
 
     @staticmethod
     def parse_title(title: str) -> "TorrentMeta":
-        meta: dict[Any, Any] = PTN.parse(title, standardise=True, coherent_types=True)
+        """
+        Parse a title with the fast parser, or PTN if the fast parser is not
+        sure to parse it like PTN
+        """
+        meta = fast_parse(title)
+        if meta is None:
+            meta = PTN.parse(title, standardise=True, coherent_types=True)
         meta["raw_title"] = title
         return TorrentMeta.model_validate(meta)
 
+    def dump_compact(self) -> str:
+        """
+        Serialize only the parsed fields that differ from their defaults. The
+        raw title is left out because it is always stored next to it.
+        """
+        return self.model_dump_json(
+            include=set(TorrentMeta.model_fields.keys()) - {"raw_title"},
+            exclude_defaults=True,
+        )
+
+    @staticmethod
+    def load_compact(data: str, raw_title: str) -> "TorrentMeta":
+        meta = TorrentMeta.model_validate_json(data)
+        meta.raw_title = raw_title
+        return meta
+
     @property
     def audio_channels(self) -> Generator[str, None, None]:
         if any("7.1" in a for a in self.audio):
@@ -158,38 +662,7 @@ class TorrentMeta(BaseModel):
         return any(x in self.quality for x in TRASH)
 
     def score_series(self, season: int, episode: int) -> int:
-        """
-        Score a torrent based on season and episode where the rank is as follows:
-           3 -> Whole series matches
-           2 -> Whole season matches
-           1 -> Single episode matches
-           0 -> No match at all
-        -100 -> Mismatch Season
-         -10 -> Mismatch Episode
-          -1 -> Unknown mismatch
-        """
-        if not season and not episode:
-            # no season or episode. Probably a movie
-            return 0
-        if self.season and season not in self.season:
-            # season mismatch
-            return -100
-        if self.episode and episode not in self.episode:
-            # episode mismatch
-            return -10
-        if not self.season and not self.episode:
-            # no season or episode
-            return 0
-        if len(self.season) > 1 and season in self.season:
-            # series matches
-            return 3
-        if season in self.season and not self.episode:
-            # whole season matches
-            return 2
-        if season in self.season and episode in self.episode:
-            # single episode matches
-            return 1
-        return -1
+        return match_series(self.season, self.episode, season=season, episode=episode)
 
     def matches_name(self, title: str) -> bool:
         return Levenshtein.ratio(self.title.lower(), title.lower()) > 0.9
@@ -198,7 +671,7 @@ class TorrentMeta(BaseModel):
     def score(self):
         return self.match_score(
             title=self.title,
-            year=self.year.pop() if self.year else 0,
+            year=self.year[-1] if self.year else 0,
             season=self.season[0] if self.season else 0,
             episode=self.episode[0] if self.episode else 0,
         )
@@ -223,7 +696,7 @@ class TorrentMeta(BaseModel):
         if season_match_score < 0:
             return season_match_score
         resolution_score = (
-            score_resolution(self.resolution.pop()) << RESOLUTION_BIT_POS
+            score_resolution(self.resolution[-1]) << RESOLUTION_BIT_POS
             if len(self.resolution) > 0
             else 0
         )
@@ -1,3 +1,5 @@
+import asyncio
+
 import structlog
 from fastapi import APIRouter, Request
 from fastapi.responses import HTMLResponse
@@ -5,7 +7,8 @@ from fastapi.templating import Jinja2Templates
 from pydantic import BaseModel
 
 from annatar.api import filters
-from annatar.config import APP_ID, VERSION, UserConfig, parse_config
+from annatar.clients import indexer_health
+from annatar.config import APP_ID, JACKETT_INDEXERS_LIST, VERSION, UserConfig, parse_config
 from annatar.debrid.providers import list_providers
 
 router = APIRouter()
@@ -19,6 +22,7 @@ class FormConfig(BaseModel):
     version: str = VERSION
     available_filters: dict[str, list[filters.Filter]]
     available_debrid_providers: list[dict[str, str]]
+    indexers: list[indexer_health.IndexerStats] = []
 
     user_config: UserConfig
 
@@ -42,6 +46,9 @@ async def configure(request: Request, config: UserConfig) -> HTMLResponse:
             for category in set(f.category for f in filters.ALL)
         },
         available_debrid_providers=list_providers(),
+        indexers=await asyncio.gather(
+            *[indexer_health.cached_stats(indexer) for indexer in JACKETT_INDEXERS_LIST]
+        ),
     )
     return templates.TemplateResponse(
         request=request,
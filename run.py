@@ -5,7 +5,7 @@ import threading
 import uvicorn
 from prometheus_client import CollectorRegistry, multiprocess
 
-from annatar import config, instrumentation
+from annatar import config, instrumentation, title_parser
 from annatar.logging import init as init_logging
 from annatar.torrent import Category
 
@@ -22,16 +22,37 @@ if WORKERS > 1:
 
 
 def start_torrent_processor(worker_id: int) -> None:
+    from annatar.clients import http
     from annatar.pubsub.consumers.torrent_processor import TorrentProcessor
 
     loop: asyncio.AbstractEventLoop = asyncio.new_event_loop()
     asyncio.set_event_loop(loop)
     _ = worker_id
     loop.run_until_complete(TorrentProcessor.run(WORKERS))
+    loop.run_until_complete(http.close())
+    loop.close()
+
+
+def start_cache_invalidator() -> None:
+    from annatar.database import cache
+
+    loop: asyncio.AbstractEventLoop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    loop.run_until_complete(cache.watch_invalidations())
+    loop.close()
+
+
+def start_refresh_scheduler() -> None:
+    from annatar.pubsub import popularity
+
+    loop: asyncio.AbstractEventLoop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    loop.run_until_complete(popularity.run())
     loop.close()
 
 
 def start_search_processor(indexer: str) -> None:
+    from annatar.clients import http
     from annatar.pubsub.consumers.torrent_search.base_jackett_processor import BaseJackettProcessor
 
     loop: asyncio.AbstractEventLoop = asyncio.new_event_loop()
@@ -40,14 +61,33 @@ def start_search_processor(indexer: str) -> None:
         indexer=indexer,
         supports_imdb=True,
         num_workers=WORKERS,
-        queue_size=WORKERS * 5,
+        queue_size=WORKERS,
         categories=[Category.Movie, Category.Series],
     )
     loop.run_until_complete(p.run())
+    loop.run_until_complete(http.close())
     loop.close()
 
 
 if __name__ == "__main__":
+    # Only this process parses in worker processes, the API workers parse
+    # inline
+    title_parser.enable_pool()
+
+    # Keep the in-process cache of the processor threads coherent
+    threading.Thread(
+        target=start_cache_invalidator,
+        daemon=True,
+        name="cache-invalidator",
+    ).start()
+
+    # Keep the search results of popular titles from expiring
+    threading.Thread(
+        target=start_refresh_scheduler,
+        daemon=True,
+        name="refresh-scheduler",
+    ).start()
+
     # Start Redis processor threads
     for worker_id in range(WORKERS):
         thread: threading.Thread = threading.Thread(
@@ -73,7 +113,8 @@ if __name__ == "__main__":
         port=config.PORT,
         proxy_headers=True,
         reload=False,
-        workers=WORKERS,
+        # the in-process broker only reaches workers of this process
+        workers=1 if config.PUBSUB_BROKER == "memory" else WORKERS,
         loop="uvloop",
         log_level="error",
     )
@@ -0,0 +1,97 @@
+import asyncio
+import unittest
+from typing import AsyncGenerator
+from unittest import mock
+
+from annatar.api.core import prefetch
+from annatar.database import db, odm
+from annatar.database.semaphore import Priority
+from annatar.debrid.debrid_service import DebridService
+from annatar.debrid.models import StreamLink
+from annatar.pubsub.events import SearchRequest
+
+
+class FakeDebrid(DebridService):
+    def __init__(self):
+        super().__init__(api_key="key", source_ip="")
+        self.lookups: list[tuple[list[str], int]] = []
+
+    def shared_cache(self) -> bool:
+        return False
+
+    def short_name(self) -> str:
+        return "FD"
+
+    def name(self) -> str:
+        return "fake"
+
+    def id(self) -> str:
+        return "fake"
+
+    async def get_stream_links(
+        self,
+        torrents: list[str],
+        stop: asyncio.Event,
+        max_results: int,
+        season: int = 0,
+        episode: int = 0,
+    ) -> AsyncGenerator[StreamLink, None]:
+        self.lookups.append((torrents, episode))
+        for info_hash in torrents:
+            yield StreamLink(size=1, name=info_hash, url="")
+
+
+class NextEpisodes(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        db.configure(db_path=None)
+        self.assertTrue(await db.ping())
+        self.debrid = FakeDebrid()
+        self.torrents: dict[int, list[str]] = {}
+        self.published: list[SearchRequest] = []
+
+        async def list_torrents(episode: int, **_) -> list[str]:
+            return self.torrents.get(episode, [])
+
+        for patcher in [
+            mock.patch.object(odm, "list_torrents", side_effect=list_torrents),
+            mock.patch.object(SearchRequest, "publish", side_effect=self.published.append),
+        ]:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    async def asyncTearDown(self):
+        await db.client().flushall()
+        await db.close()
+
+    async def prefetch(self):
+        await prefetch.next_episodes(self.debrid, "tt2802850", 1, 5, 5, [])
+
+    async def test_warms_the_next_episodes_once(self):
+        self.torrents = {6: ["A" * 40], 7: ["B" * 40]}
+
+        await self.prefetch()
+        await self.prefetch()
+
+        self.assertEqual(self.debrid.lookups, [(["A" * 40], 6), (["B" * 40], 7)])
+        self.assertEqual(self.published, [])
+
+    async def test_searches_episodes_without_torrents(self):
+        self.torrents = {7: ["B" * 40]}
+
+        await self.prefetch()
+
+        self.assertEqual(len(self.published), 1)
+        self.assertEqual(self.published[0].episode, 6)
+        self.assertEqual(self.published[0].priority, Priority.BACKGROUND)
+        self.assertEqual(self.debrid.lookups, [(["B" * 40], 7)])
+
+        # retried once the search found torrents
+        self.torrents = {6: ["A" * 40]}
+        await self.prefetch()
+        self.assertEqual(self.debrid.lookups[-1], (["A" * 40], 6))
+
+    async def test_drops_prefetches_when_busy(self):
+        with mock.patch.object(prefetch, "PREFETCH_MAX_CONCURRENT", 1):
+            self.assertTrue(prefetch.schedule(self.debrid, "tt2802850", 1, 5, 5, []))
+            self.assertFalse(prefetch.schedule(self.debrid, "tt2802850", 1, 6, 5, []))
+            await asyncio.gather(*prefetch._running)  # noqa: SLF001
@@ -0,0 +1,62 @@
+import asyncio
+import unittest
+
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+
+from annatar import instrumentation
+from annatar.clients import http
+
+
+def connections(upstream: http.Upstream, result: str) -> float:
+    return (
+        instrumentation.registry().get_sample_value(
+            "http_client_pool_connections_total", {"upstream": str(upstream), "result": result}
+        )
+        or 0
+    )
+
+
+class Session(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        app = web.Application()
+        app.router.add_get("/", lambda _: web.Response(text="ok"))
+        self.server = TestServer(app)
+        await self.server.start_server()
+
+    async def asyncTearDown(self):
+        await http.close()
+        await self.server.close()
+
+    async def test_shares_one_session_per_upstream(self):
+        self.assertIs(http.session(http.Upstream.Jackett), http.session(http.Upstream.Jackett))
+        self.assertIsNot(http.session(http.Upstream.Jackett), http.session(http.Upstream.Cinemeta))
+
+    async def test_reuses_connections(self):
+        created = connections(http.Upstream.Jackett, "created")
+        reused = connections(http.Upstream.Jackett, "reused")
+
+        for _ in range(3):
+            async with http.session(http.Upstream.Jackett).get(self.server.make_url("/")) as r:
+                self.assertEqual(await r.text(), "ok")
+
+        self.assertEqual(connections(http.Upstream.Jackett, "created") - created, 1)
+        self.assertEqual(connections(http.Upstream.Jackett, "reused") - reused, 2)
+
+    async def test_close_opens_new_sessions(self):
+        session = http.session(http.Upstream.Jackett)
+
+        await http.close()
+
+        self.assertTrue(session.closed)
+        self.assertIsNot(http.session(http.Upstream.Jackett), session)
+
+    async def test_sessions_are_per_event_loop(self):
+        session = http.session(http.Upstream.Jackett)
+
+        async def other_loop() -> bool:
+            other = http.session(http.Upstream.Jackett)
+            await http.close()
+            return other is session
+
+        self.assertFalse(await asyncio.to_thread(asyncio.run, other_loop()))
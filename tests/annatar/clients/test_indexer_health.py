@@ -0,0 +1,42 @@
+import unittest
+
+from annatar.clients import indexer_health
+from annatar.clients.indexer_health import QueryType
+from annatar.database import db
+
+
+class Record(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        db.configure(db_path=None)
+        self.assertTrue(await db.ping())
+
+    async def asyncTearDown(self):
+        await db.client().flushall()
+        await db.close()
+
+    async def test_aggregates_queries(self):
+        await indexer_health.record("yts", "movie", QueryType.IMDB, 1.5, False, 10, unique=4)
+        await indexer_health.record("yts", "movie", QueryType.IMDB, 0.5, True, 0)
+        await indexer_health.record("yts", "series", QueryType.TITLE, 1, False, 0)
+
+        stats = await indexer_health.stats("yts")
+
+        imdb = stats.query("movie", QueryType.IMDB)
+        self.assertEqual((imdb.queries, imdb.errors, imdb.results, imdb.unique), (2, 1, 10, 4))
+        self.assertEqual(imdb.error_rate, 0.5)
+        self.assertEqual(imdb.mean_latency, 1)
+        self.assertEqual(stats.total.queries, 3)
+        self.assertFalse(stats.breaker_open)
+
+    async def test_opens_the_circuit_after_consecutive_failures(self):
+        for _ in range(indexer_health.BREAKER_THRESHOLD - 1):
+            await indexer_health.record("yts", "movie", QueryType.IMDB, 1, True, 0)
+        await indexer_health.record("yts", "movie", QueryType.IMDB, 1, False, 1)
+        for _ in range(indexer_health.BREAKER_THRESHOLD - 1):
+            await indexer_health.record("yts", "movie", QueryType.IMDB, 1, True, 0)
+        self.assertFalse((await indexer_health.stats("yts")).breaker_open)
+
+        await indexer_health.record("yts", "movie", QueryType.IMDB, 1, True, 0)
+
+        self.assertTrue((await indexer_health.stats("yts")).breaker_open)
+        self.assertFalse((await indexer_health.stats("eztv")).breaker_open)
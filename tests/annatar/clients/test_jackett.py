@@ -0,0 +1,85 @@
+import asyncio
+import re
+import unittest
+from unittest import mock
+
+from aioresponses import aioresponses
+
+from annatar.clients import http, jackett
+from annatar.clients.jackett_models import SearchResponse
+from annatar.database import db
+from annatar.torrent import Category
+
+RESULTS_URL = re.compile(r".*/api/v2.0/indexers/all/results.*")
+
+
+class Deadline(unittest.TestCase):
+    def setUp(self):
+        patcher = mock.patch.object(jackett, "LATENCIES", jackett.Latencies(window=100))
+        self.latencies = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_uses_the_timeout_until_enough_samples(self):
+        for _ in range(jackett.LATENCY_MIN_SAMPLES - 1):
+            self.latencies.observe("yts", 1)
+
+        self.assertEqual(jackett.deadline("yts", 60), 60)
+
+    def test_scales_the_p95_latency(self):
+        for i in range(100):
+            self.latencies.observe("yts", 10 if i < 95 else 30)
+
+        self.assertEqual(jackett.deadline("yts", 60), 60)
+        self.assertEqual(jackett.deadline("yts", 45), 45)
+        for _ in range(100):
+            self.latencies.observe("yts", 4)
+        self.assertEqual(jackett.deadline("yts", 60), 8)
+
+    def test_never_goes_below_the_minimum(self):
+        for _ in range(100):
+            self.latencies.observe("yts", 0.1)
+
+        self.assertEqual(jackett.deadline("yts", 60), jackett.JACKETT_MIN_TIMEOUT)
+
+    def test_tracks_indexers_separately(self):
+        for _ in range(100):
+            self.latencies.observe("yts", 4)
+
+        self.assertEqual(jackett.deadline("eztv", 60), 60)
+
+
+class Search(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        db.configure(db_path=None)
+        self.assertTrue(await db.ping())
+
+    async def asyncTearDown(self):
+        await http.close()
+        await db.client().flushall()
+        await db.close()
+
+    async def search(self) -> SearchResponse:
+        return await jackett.search("Fargo", Category.Series, indexers=["yts"], timeout=5)
+
+    async def test_caches_results(self):
+        with aioresponses() as m:
+            m.get(RESULTS_URL, payload={"Results": [{"Title": "Fargo S01", "Guid": "a"}]})
+
+            first = await self.search()
+            second = await self.search()
+
+        self.assertFalse(first.cached)
+        self.assertTrue(second.cached)
+        self.assertEqual(second.Results, first.Results)
+
+    async def test_caches_timeouts_briefly(self):
+        with aioresponses() as m:
+            m.get(RESULTS_URL, exception=asyncio.TimeoutError())
+
+            first = await self.search()
+            second = await self.search()
+
+        self.assertTrue(first.failed)
+        self.assertFalse(first.cached)
+        self.assertTrue(second.failed)
+        self.assertTrue(second.cached)
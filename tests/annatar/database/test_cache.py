@@ -0,0 +1,129 @@
+import asyncio
+import unittest
+from datetime import timedelta
+from unittest import mock
+
+from pydantic import BaseModel
+from redis.exceptions import ResponseError
+
+from annatar.database import cache, db
+
+
+class Media(BaseModel):
+    name: str
+
+
+class L1Cache(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        db.configure(db_path=None)
+        self.assertTrue(await db.ping())
+        self.watcher = asyncio.create_task(cache.watch_invalidations())
+        async with asyncio.timeout(5):
+            while not cache.watching():
+                await asyncio.sleep(0.01)
+
+    async def asyncTearDown(self):
+        self.watcher.cancel()
+        await asyncio.gather(self.watcher, return_exceptions=True)
+        await db.client().flushall()
+        await db.close()
+
+    async def test_returns_cached_model(self):
+        key = "cinemeta:movie:tt0000001"
+        await db.set_model(key, Media(name="foo"), ttl=timedelta(minutes=1))
+
+        first = await db.get_model(key, Media)
+        second = await db.get_model(key, Media)
+
+        self.assertEqual(first, Media(name="foo"))
+        self.assertEqual(first, second)
+
+    async def test_hits_are_copies(self):
+        key = "cinemeta:movie:tt0000003"
+        await db.set_model(key, Media(name="foo"), ttl=timedelta(minutes=1))
+        await db.get_model(key, Media)
+
+        first = await db.get_model(key, Media)
+        first.name = "bar"  # type: ignore
+
+        self.assertEqual(await db.get_model(key, Media), Media(name="foo"))
+
+    async def test_invalidates_on_write(self):
+        key = "cinemeta:movie:tt0000002"
+        await db.set_model(key, Media(name="foo"), ttl=timedelta(minutes=1))
+        self.assertEqual(await db.get_model(key, Media), Media(name="foo"))
+
+        await db.set_model(key, Media(name="bar"), ttl=timedelta(minutes=1))
+        async with asyncio.timeout(5):
+            while cache.family(key).get(key) is not None:  # type: ignore
+                await asyncio.sleep(0.01)
+
+        self.assertEqual(await db.get_model(key, Media), Media(name="bar"))
+
+    async def test_ignores_uncached_families(self):
+        key = "rd:torrent:foo"
+        await db.set_model(key, Media(name="foo"), ttl=timedelta(minutes=1))
+
+        first = await db.get_model(key, Media)
+        second = await db.get_model(key, Media)
+
+        self.assertEqual(first, second)
+        self.assertIsNot(first, second)
+
+    async def test_first_read_is_a_copy(self):
+        key = "cinemeta:movie:tt0000004"
+        await db.set_model(key, Media(name="foo"), ttl=timedelta(minutes=1))
+
+        first = await db.get_model(key, Media)
+        first.name = "bar"  # type: ignore
+
+        self.assertEqual(await db.get_model(key, Media), Media(name="foo"))
+        self.assertEqual(cache.family(key).get(key), Media(name="foo"))  # type: ignore
+
+
+class RefusedConfig(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        db.configure(db_path=None)
+        self.assertTrue(await db.ping())
+
+    async def asyncTearDown(self):
+        await db.close()
+
+    async def test_stays_disabled(self):
+        with mock.patch.object(
+            db.client(),
+            "config_get",
+            side_effect=ResponseError("unknown command 'CONFIG'"),
+        ) as config_get:
+            async with asyncio.timeout(5):
+                await cache.watch_invalidations()
+
+        config_get.assert_called_once()
+        self.assertFalse(cache.watching())
+
+
+class Family(unittest.TestCase):
+    def test_evicts_least_recently_used(self):
+        family = cache.Family("test", "test:", max_entries=2, max_ttl=timedelta(minutes=1))
+        cache._watching.set()
+        try:
+            for key in ["test:a", "test:b"]:
+                family.put(key, key, ttl=None, generation=family.generation)
+            family.get("test:a")
+            family.put("test:c", "test:c", ttl=None, generation=family.generation)
+        finally:
+            cache._watching.clear()
+
+        self.assertEqual(family.get("test:a"), "test:a")
+        self.assertIsNone(family.get("test:b"))
+        self.assertEqual(family.get("test:c"), "test:c")
+
+    def test_ttl_capped_by_redis_ttl(self):
+        family = cache.Family("test", "test:", max_entries=2, max_ttl=timedelta(minutes=1))
+        cache._watching.set()
+        try:
+            family.put("test:a", "a", ttl=timedelta(0), generation=family.generation)
+        finally:
+            cache._watching.clear()
+
+        self.assertIsNone(family.get("test:a"))
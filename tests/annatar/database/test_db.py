@@ -0,0 +1,33 @@
+import asyncio
+import threading
+import unittest
+from unittest import mock
+
+from annatar.database import db
+
+
+class Pool(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        db.configure(db_path=None)
+
+    async def asyncTearDown(self):
+        await db.close()
+
+    async def test_waits_for_a_free_connection(self):
+        with mock.patch.object(db, "REDIS_MAX_CONNECTIONS", 2):
+            results = await asyncio.gather(*[db.ping() for _ in range(20)])
+
+        self.assertTrue(all(results))
+
+    async def test_starts_one_embedded_server(self):
+        db.configure(db_path=None)
+        started: list[object] = []
+        threads = [
+            threading.Thread(target=lambda: started.append(db._embedded())) for _ in range(4)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(len({id(s) for s in started}), 1)
@@ -0,0 +1,216 @@
+import asyncio
+import unittest
+from datetime import timedelta
+from hashlib import sha1
+from unittest import mock
+
+from annatar import torrent
+from annatar.api import filters
+from annatar.database import db, odm
+
+
+def new_info_hash(s: str) -> str:
+    return sha1(s.encode()).hexdigest().upper()
+
+
+class GetTorrentMetaMany(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        db.configure(db_path=None)
+        self.assertTrue(await db.ping())
+
+    async def asyncTearDown(self):
+        await db.client().flushall()
+        await db.close()
+
+    async def test_returns_meta_by_info_hash(self):
+        titles = ["Fargo S01E01 1080p", "Fargo S01E02 720p"]
+        for title in titles:
+            await odm.set_torrent_title(new_info_hash(title), title)
+
+        missing = new_info_hash("missing")
+        result = await odm.get_torrent_meta_many([new_info_hash(t) for t in titles] + [missing])
+
+        self.assertEqual(
+            {h: m["title"] for h, m in result.items()},
+            {new_info_hash(t): t for t in titles},
+        )
+
+    async def test_empty(self):
+        self.assertEqual(await odm.get_torrent_meta_many([]), {})
+
+
+def new_torrent(title: str, imdb: str = "tt0000001") -> odm.NewTorrent:
+    meta = torrent.TorrentMeta.parse_title(title)
+    return odm.NewTorrent(
+        info_hash=new_info_hash(title),
+        title=title,
+        imdb=imdb,
+        score=1,
+        category="series",
+        size=1,
+        indexer="mock",
+        season=meta.season[0],
+        episode=meta.episode[0] if meta.episode else None,
+        seasons=meta.season,
+        episodes=meta.episode,
+        meta=meta,
+    )
+
+
+class AddTorrents(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        db.configure(db_path=None)
+        self.assertTrue(await db.ping())
+
+    async def asyncTearDown(self):
+        await db.client().flushall()
+        await db.close()
+
+    async def test_writes_concurrent_adds_together(self):
+        first = [new_torrent("Fargo S01E01 1080p"), new_torrent("Fargo S01-S03 1080p")]
+        second = [new_torrent("Fargo S01E01 1080p"), new_torrent("Fargo S02 720p")]
+
+        with (
+            mock.patch.object(db, "eval_script", wraps=db.eval_script) as eval_script,
+            mock.patch.object(odm, "publish_added") as publish_added,
+        ):
+            added = await asyncio.gather(
+                odm.add_torrents(first, ttl=timedelta(hours=1)),
+                odm.add_torrents(second, ttl=timedelta(hours=1)),
+            )
+
+        self.assertEqual(eval_script.call_count, 1)
+        publish_added.assert_called_once_with([*first, second[1]])
+        self.assertEqual(added, [first, second[1:]])
+        self.assertEqual(
+            await odm.list_torrents("tt0000001", season=2, episode=1),
+            [first[1].info_hash, second[1].info_hash],
+        )
+        meta = await odm.get_torrent_meta(first[1].info_hash)
+        self.assertEqual((meta or {}).get(odm.Fields.SEASONS), ",1,2,3,")
+        self.assertGreater(await db.client().ttl(odm.Keys.series_packs("tt0000001")), 0)
+
+    async def test_skips_existing_torrents(self):
+        torrents = [new_torrent("Fargo S01E01 1080p")]
+        self.assertEqual(await odm.add_torrents(torrents, ttl=timedelta(hours=1)), torrents)
+        self.assertEqual(await odm.add_torrents(torrents, ttl=timedelta(hours=1)), [])
+
+    async def test_fails_every_caller(self):
+        with mock.patch.object(db, "eval_script", side_effect=ConnectionError("down")):
+            results = await asyncio.gather(
+                odm.add_torrents([new_torrent("Fargo S01E01 1080p")], ttl=timedelta(hours=1)),
+                odm.add_torrents([new_torrent("Fargo S01E02 1080p")], ttl=timedelta(hours=1)),
+                return_exceptions=True,
+            )
+        self.assertTrue(all(isinstance(r, ConnectionError) for r in results))
+
+
+class GetParsedTorrentMetaMany(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        db.configure(db_path=None)
+        self.assertTrue(await db.ping())
+
+    async def asyncTearDown(self):
+        await db.client().flushall()
+        await db.close()
+
+    async def test_loads_stored_meta(self):
+        title = "Fargo S01E01 2020 1080p HULU WEB-DL DDP5 1 H 264"
+        info_hash = new_info_hash(title)
+        meta = torrent.TorrentMeta.parse_title(title)
+        await odm.set_torrent_meta(info_hash, odm.encode_torrent_meta(title, meta))
+
+        result = await odm.get_parsed_torrent_meta_many([info_hash])
+
+        self.assertEqual(result[info_hash], meta)
+
+    async def test_reparses_stale_meta(self):
+        title = "Fargo S01E01 2020 1080p HULU WEB-DL DDP5 1 H 264"
+        info_hash = new_info_hash(title)
+        await odm.set_torrent_title(info_hash, title)
+
+        result = await odm.get_parsed_torrent_meta_many([info_hash])
+
+        self.assertEqual(result[info_hash], torrent.TorrentMeta.parse_title(title))
+        stored = await odm.get_torrent_meta(info_hash)
+        self.assertIsNotNone(stored)
+        self.assertEqual(odm.decode_torrent_meta(stored or {}), result[info_hash])
+
+
+class ListTorrentsFiltered(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        db.configure(db_path=None)
+        self.assertTrue(await db.ping())
+
+    async def asyncTearDown(self):
+        await db.client().flushall()
+        await db.close()
+
+    async def add(self, title: str, score: int, store_meta: bool = True) -> str:
+        info_hash = new_info_hash(title)
+        await db.unique_list_add(odm.Keys.torrents("tt0000001"), info_hash, score=score)
+        if store_meta:
+            meta = torrent.TorrentMeta.parse_title(title)
+            await odm.set_torrent_meta(info_hash, odm.encode_torrent_meta(title, meta))
+        else:
+            await odm.set_torrent_title(info_hash, title)
+        return info_hash
+
+    async def test_filters_by_stored_features(self):
+        uhd = await self.add("Oppenheimer 2023 2160p", score=3)
+        fhd = await self.add("Oppenheimer 2023 1080p x265", score=2)
+        hd = await self.add("Oppenheimer 2023 720p", score=1)
+
+        result = await odm.list_torrents("tt0000001", filters=[filters.by_id("4k")])
+        self.assertEqual(result, [fhd, hd])
+
+        result = await odm.list_torrents(
+            "tt0000001", filters=[filters.by_id("4k"), filters.by_id("x265")]
+        )
+        self.assertEqual(result, [hd])
+
+        result = await odm.list_torrents("tt0000001", filters=[filters.by_id("720p")], limit=1)
+        self.assertEqual(result, [uhd])
+
+    async def test_filters_torrents_without_stored_features(self):
+        await self.add("Oppenheimer 2023 2160p", score=3, store_meta=False)
+        fhd = await self.add("Oppenheimer 2023 1080p", score=2, store_meta=False)
+
+        result = await odm.list_torrents("tt0000001", filters=[filters.by_id("4k")], limit=1)
+        self.assertEqual(result, [fhd])
+
+    async def test_stops_reading_at_the_limit(self):
+        added = [await self.add(f"Oppenheimer 2023 {i} 1080p", score=i) for i in range(6, 0, -1)]
+
+        with (
+            mock.patch.object(odm, "LIST_PAGE_SIZE", 2),
+            mock.patch.object(db, "zrange_desc_many", wraps=db.zrange_desc_many) as pages,
+        ):
+            result = await odm.list_torrents("tt0000001", filters=[filters.by_id("4k")], limit=2)
+
+        self.assertEqual(result, added[:2])
+        self.assertEqual(pages.call_count, 2)
+
+    async def test_merges_lists_by_score(self):
+        lists = {
+            odm.Keys.season_torrents("tt0000001", 1): {"a": 5, "b": 3, "c": 3, "d": 1},
+            odm.Keys.series_packs("tt0000001"): {"e": 4, "b": 6, "f": 3, "g": 2},
+        }
+        for name, members in lists.items():
+            for member, score in members.items():
+                await db.unique_list_add(name, new_info_hash(member), score=score)
+        keys = list(lists)
+
+        expected = await odm.list_filtered_torrents(keys, [], 100, season=1, episode=1)
+        for page_size in [1, 2, 3]:
+            with mock.patch.object(odm, "LIST_PAGE_SIZE", page_size):
+                for limit in [1, 4, 100]:
+                    with self.subTest(page_size=page_size, limit=limit):
+                        result = await odm.list_filtered_torrents(
+                            keys, [], limit, season=1, episode=1
+                        )
+                        self.assertEqual(result, expected[:limit])
+        self.assertEqual(
+            [item.score for item in expected],
+            [6, 5, 4, 3, 3, 2, 1],
+        )
@@ -0,0 +1,81 @@
+import asyncio
+import unittest
+from datetime import timedelta
+from unittest import mock
+
+from annatar.database import db, semaphore
+from annatar.database.semaphore import Priority, Semaphore
+
+LEASE = timedelta(seconds=10)
+
+
+class Acquire(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        db.configure(db_path=None)
+        self.assertTrue(await db.ping())
+
+    async def asyncTearDown(self):
+        await db.client().flushall()
+        await db.close()
+
+    def acquire(self, semaphores: list[Semaphore], priority=Priority.USER, wait=0.0):
+        return semaphore.acquire("test", semaphores, priority, wait, LEASE)
+
+    async def test_limits_concurrent_holders(self):
+        limit = Semaphore("global", 2)
+        async with self.acquire([limit]), self.acquire([limit]):
+            with self.assertRaises(semaphore.Timeout):
+                async with self.acquire([limit]):
+                    pass
+        async with self.acquire([limit]):
+            pass
+
+    async def test_requires_every_semaphore(self):
+        shared = Semaphore("global", 2)
+        async with self.acquire([shared, Semaphore("yts", 1)]):
+            with self.assertRaises(semaphore.Timeout):
+                async with self.acquire([shared, Semaphore("yts", 1)]):
+                    pass
+            async with self.acquire([shared, Semaphore("eztv", 1)]):
+                pass
+
+    async def test_reserves_capacity_for_users(self):
+        limit = Semaphore("global", 4, reserved=0.5)
+        async with (
+            self.acquire([limit], Priority.BACKGROUND),
+            self.acquire([limit], Priority.BACKGROUND),
+        ):
+            with self.assertRaises(semaphore.Timeout):
+                async with self.acquire([limit], Priority.BACKGROUND):
+                    pass
+            async with self.acquire([limit]), self.acquire([limit]):
+                pass
+
+    async def test_waits_for_a_release(self):
+        limit = Semaphore("global", 1)
+        released = asyncio.Event()
+
+        async def hold():
+            async with self.acquire([limit]):
+                await asyncio.sleep(0.1)
+            released.set()
+
+        holder = asyncio.create_task(hold())
+        await asyncio.sleep(0.01)
+        async with self.acquire([limit], wait=5):
+            self.assertTrue(released.is_set())
+        await holder
+
+    async def test_reclaims_expired_permits(self):
+        limit = Semaphore("global", 1)
+        with mock.patch.object(semaphore, "release"):
+            async with semaphore.acquire("test", [limit], Priority.USER, 0, timedelta(0)):
+                pass
+
+        async with self.acquire([limit]):
+            pass
+
+    async def test_runs_without_a_permit_when_redis_fails(self):
+        with mock.patch.object(db, "eval_script", side_effect=ConnectionError):
+            async with self.acquire([Semaphore("global", 0)]):
+                pass
@@ -0,0 +1,76 @@
+import asyncio
+import unittest
+from datetime import timedelta
+
+from annatar.database import db, singleflight
+
+
+class Do(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        db.configure(db_path=None)
+        self.assertTrue(await db.ping())
+        self.fetches = 0
+
+    async def asyncTearDown(self):
+        await db.client().flushall()
+        await db.close()
+
+    async def fetch(self) -> str:
+        self.fetches += 1
+        await asyncio.sleep(0.05)
+        await db.set("key", "fetched")
+        return "fetched"
+
+    async def cached(self) -> str | None:
+        return await db.get("key")
+
+    def do(self, lease: timedelta = timedelta(seconds=5)):
+        return singleflight.do("test", "key", self.fetch, self.cached, lease)
+
+    async def test_coalesces_concurrent_callers(self):
+        results = await asyncio.gather(*[self.do() for _ in range(5)])
+
+        self.assertEqual(results, ["fetched"] * 5)
+        self.assertEqual(self.fetches, 1)
+
+    async def test_cancelled_caller_does_not_cancel_the_request(self):
+        first = asyncio.create_task(self.do())
+        second = asyncio.create_task(self.do())
+        await asyncio.sleep(0.01)
+        first.cancel()
+
+        self.assertEqual(await second, "fetched")
+        self.assertEqual(self.fetches, 1)
+
+    async def test_waits_for_request_in_another_process(self):
+        self.assertTrue(await db.try_lock("singleflight:lease:key", timedelta(seconds=5)))
+        waiter = asyncio.create_task(self.do())
+        async with asyncio.timeout(5):
+            while await db.client().pubsub_numsub("singleflight:done:key") != [
+                (b"singleflight:done:key", 1)
+            ]:
+                await asyncio.sleep(0.01)
+
+        await db.set("key", "from another process")
+        await db.client().publish("singleflight:done:key", "done")
+
+        self.assertEqual(await waiter, "from another process")
+        self.assertEqual(self.fetches, 0)
+
+    async def test_fetches_when_the_lease_expires(self):
+        self.assertTrue(await db.try_lock("singleflight:lease:key", timedelta(seconds=5)))
+
+        self.assertEqual(await self.do(lease=timedelta(milliseconds=100)), "fetched")
+        self.assertEqual(self.fetches, 1)
+
+    async def test_keeps_a_lease_taken_over_by_another_process(self):
+        lease_key = "singleflight:lease:key"
+
+        async def fetch() -> str:
+            # the lease expired and another process took it
+            await db.client().set(lease_key, "other")
+            return "fetched"
+
+        await singleflight.do("test", "key", fetch, self.cached, timedelta(seconds=5))
+
+        self.assertEqual(await db.client().get(lease_key), b"other")
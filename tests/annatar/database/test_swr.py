@@ -0,0 +1,85 @@
+import asyncio
+import unittest
+from datetime import timedelta
+
+from pydantic import BaseModel
+
+from annatar.database import db, swr
+from annatar.database.swr import Hit
+
+POLICY = swr.Policy(
+    fresh=timedelta(minutes=10),
+    stale=timedelta(minutes=10),
+    negative=timedelta(minutes=1),
+)
+
+
+class Media(BaseModel):
+    name: str
+
+
+class Get(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        db.configure(db_path=None)
+        self.assertTrue(await db.ping())
+        self.fetched: list[Media | None] = []
+        self.next: Media | None = Media(name="fetched")
+
+    async def asyncTearDown(self):
+        await asyncio.gather(*swr._refreshes)  # noqa: SLF001
+        await db.client().flushall()
+        await db.close()
+
+    async def fetch(self) -> Media | None:
+        self.fetched.append(self.next)
+        return self.next
+
+    def get(self):
+        return swr.get(
+            name="test",
+            key="key",
+            model=Media,
+            fetch=self.fetch,
+            policy=POLICY,
+            lease=timedelta(seconds=5),
+            empty=lambda m: not m.name,
+        )
+
+    async def test_fetches_on_miss_and_serves_fresh(self):
+        self.assertEqual(await self.get(), (Media(name="fetched"), Hit.MISS))
+        self.assertEqual(await self.get(), (Media(name="fetched"), Hit.FRESH))
+        self.assertEqual(len(self.fetched), 1)
+
+    async def test_serves_stale_while_refreshing(self):
+        await db.set_model("key", Media(name="old"), ttl=POLICY.stale)
+
+        self.assertEqual(await self.get(), (Media(name="old"), Hit.STALE))
+
+        await asyncio.gather(*swr._refreshes)  # noqa: SLF001
+        self.assertEqual(await self.get(), (Media(name="fetched"), Hit.FRESH))
+        self.assertEqual(len(self.fetched), 1)
+
+    async def test_keeps_stale_value_if_refresh_fails(self):
+        await db.set_model("key", Media(name="old"), ttl=POLICY.stale)
+        self.next = None
+
+        await self.get()
+        await asyncio.gather(*swr._refreshes)  # noqa: SLF001
+
+        self.assertEqual(await self.get(), (Media(name="old"), Hit.STALE))
+
+    async def test_caches_missing_values(self):
+        self.next = None
+
+        self.assertEqual(await self.get(), (None, Hit.MISS))
+        self.assertEqual(await self.get(), (None, Hit.NEGATIVE))
+        self.assertEqual(len(self.fetched), 1)
+        self.assertLessEqual(await db.ttl(swr.negative_key("key")), 60)
+
+    async def test_caches_empty_values_briefly(self):
+        self.next = Media(name="")
+
+        self.assertEqual(await self.get(), (Media(name=""), Hit.MISS))
+        self.assertEqual(await self.get(), (Media(name=""), Hit.NEGATIVE))
+        self.assertEqual(len(self.fetched), 1)
+        self.assertLessEqual(await db.ttl("key"), 60)
@@ -6,15 +6,20 @@ from uuid import uuid4
 
 import structlog
 from aioresponses import aioresponses
-from redislite.client import StrictRedis
 
 from annatar import magnet
+from annatar.clients import http
 from annatar.database import db, odm
 from annatar.pubsub.consumers.torrent_processor import (
-    process_message,
+    process_batch,
     resolve_magnet_link,
 )
-from annatar.pubsub.events import TorrentSearchCriteria, TorrentSearchResult
+from annatar.pubsub.events import (
+    TorrentSearchCriteria,
+    TorrentSearchHit,
+    TorrentSearchResult,
+    TorrentSearchResults,
+)
 from annatar.torrent import Category, TorrentMeta
 
 log = structlog.get_logger(__name__)
@@ -49,13 +54,26 @@ def mock_search_result(title: str) -> TorrentSearchResult:
     )
 
 
+async def process(result: TorrentSearchResult) -> list[odm.NewTorrent]:
+    """
+    Process a search with a single result
+    """
+    return await process_batch(
+        TorrentSearchResults(
+            search_criteria=result.search_criteria,
+            results=[TorrentSearchHit(**result.model_dump(exclude={"search_criteria"}))],
+        )
+    )
+
+
 class map_matched_result(unittest.IsolatedAsyncioTestCase):
     async def asyncSetUp(self):
-        db.redis = StrictRedis()
-        self.assertTrue(db.redis.ping())
+        db.configure(db_path=None)
+        self.assertTrue(await db.ping())
 
     async def asyncTearDown(self):
-        db.redis.flushall()
+        await db.client().flushall()
+        await db.close()
 
     @mock.patch("annatar.torrent.TorrentMeta.match_score")
     async def test_does_not_allow_low_meta_scores(self, mock_match_score):
@@ -63,7 +81,7 @@ class map_matched_result(unittest.IsolatedAsyncioTestCase):
         search_result = mock_search_result(title)
 
         mock_match_score.return_value = 0
-        await process_message(search_result)
+        await process(search_result)
         mock_match_score.assert_called_once()
         torrents = await odm.list_torrents(imdb=search_result.imdb)
         self.assertNotIn(search_result.info_hash, torrents)
@@ -73,25 +91,26 @@ class map_matched_result(unittest.IsolatedAsyncioTestCase):
         search_result = mock_search_result(title)
         search_result.search_criteria.imdb = mock_imdb()
 
-        await process_message(search_result)
+        await process(search_result)
         torrents = await odm.list_torrents(imdb=search_result.imdb)
         self.assertNotIn(search_result.info_hash, torrents)
 
 
 class ProcessMessage(unittest.IsolatedAsyncioTestCase):
     async def asyncSetUp(self):
-        db.redis = StrictRedis()
-        self.assertTrue(db.redis.ping())
+        db.configure(db_path=None)
+        self.assertTrue(await db.ping())
 
     async def asyncTearDown(self):
-        db.redis.flushall()
+        await db.client().flushall()
+        await db.close()
 
     async def test_does_not_store_low_scores(self):
         title = "The Lord of the Rings The Return of the King 2003 1080p X265"
         search_result = mock_search_result(title)
         search_result.search_criteria.imdb = mock_imdb()
 
-        await process_message(search_result)
+        await process(search_result)
         torrents = await odm.list_torrents(imdb=search_result.imdb)
         self.assertNotIn(search_result.info_hash, torrents)
 
@@ -99,7 +118,7 @@ class ProcessMessage(unittest.IsolatedAsyncioTestCase):
         title = "The Lord of the Rings The Return of the King 2003 1080p X265"
         search_result = mock_search_result(title)
 
-        await process_message(search_result)
+        await process(search_result)
         torrents = await odm.list_torrents(imdb=search_result.imdb)
         self.assertIn(search_result.info_hash, torrents)
 
@@ -107,7 +126,7 @@ class ProcessMessage(unittest.IsolatedAsyncioTestCase):
         title = "Fargo S01 2020 1080p HULU WEB-DL DDP5 1 H 264"
         search_result = mock_search_result(title)
 
-        await process_message(search_result)
+        await process(search_result)
         torrents = await odm.list_torrents(imdb=search_result.imdb, season=1, episode=0)
         self.assertIn(search_result.info_hash, torrents)
 
@@ -115,7 +134,7 @@ class ProcessMessage(unittest.IsolatedAsyncioTestCase):
         title = "Fargo S01-S05 2020 1080p HULU WEB-DL DDP5 1 H 264"
         search_result = mock_search_result(title)
 
-        await process_message(search_result)
+        await process(search_result)
         for season in range(1, 6):
             torrents = await odm.list_torrents(imdb=search_result.imdb, season=season, episode=0)
             self.assertIn(search_result.info_hash, torrents, f"season {season}")
@@ -124,7 +143,7 @@ class ProcessMessage(unittest.IsolatedAsyncioTestCase):
         title = "Fargo S01 E01-E05 2020 1080p HULU WEB-DL DDP5 1 H 264"
         search_result = mock_search_result(title)
 
-        await process_message(search_result)
+        await process(search_result)
         for episode in range(1, 6):
             torrents = await odm.list_torrents(
                 imdb=search_result.imdb,
@@ -133,15 +152,66 @@ class ProcessMessage(unittest.IsolatedAsyncioTestCase):
             )
             self.assertIn(search_result.info_hash, torrents, f"episode {episode}")
 
+    async def test_stores_packs_once(self):
+        title = "Fargo S01-S05 2020 1080p HULU WEB-DL DDP5 1 H 264"
+        search_result = mock_search_result(title)
+
+        added = await process(search_result)
+
+        self.assertEqual(len(added), 1)
+        self.assertEqual(added[0].seasons, [1, 2, 3, 4, 5])
+        packs = await db.unique_list_get(odm.Keys.series_packs(search_result.imdb))
+        self.assertEqual(packs, [search_result.info_hash])
+        torrents = await odm.list_torrents(imdb=search_result.imdb, season=6, episode=1)
+        self.assertNotIn(search_result.info_hash, torrents)
+
+    async def test_episodes_are_not_season_packs(self):
+        title = "Fargo S01 E01-E05 2020 1080p HULU WEB-DL DDP5 1 H 264"
+        search_result = mock_search_result(title)
+
+        await process(search_result)
+        for season, episode in [(1, 0), (1, 6), (2, 1)]:
+            torrents = await odm.list_torrents(
+                imdb=search_result.imdb, season=season, episode=episode
+            )
+            self.assertNotIn(search_result.info_hash, torrents, f"S{season}E{episode}")
+
+    async def test_ranks_series_season_and_episode_packs(self):
+        imdb = mock_imdb()
+        titles = [
+            "Fargo S01E02 2020 2160p HULU WEB-DL DDP5 1 H 264",
+            "Fargo S01 2020 1080p HULU WEB-DL DDP5 1 H 264",
+            "Fargo S01-S05 2020 720p HULU WEB-DL DDP5 1 H 264",
+        ]
+        for title in titles:
+            search_result = mock_search_result(title)
+            search_result.imdb = search_result.search_criteria.imdb = imdb
+            await process(search_result)
+
+        torrents = await odm.list_torrents(imdb=imdb, season=1, episode=2)
+        self.assertEqual(torrents, [new_info_hash(t) for t in reversed(titles)])
+
     async def test_sets_title(self):
         title = "Fargo S01E01 2020 1080p HULU WEB-DL DDP5 1 H 264"
         search_result = mock_search_result(title)
 
-        await process_message(search_result)
+        await process(search_result)
 
         dbtitle = await odm.get_torrent_title(search_result.info_hash)
         self.assertEqual(dbtitle, title)
 
+    async def test_stores_parsed_meta(self):
+        title = "Fargo S01E01 2020 1080p HULU WEB-DL DDP5 1 H 264"
+        search_result = mock_search_result(title)
+
+        await process(search_result)
+
+        stored = await odm.get_torrent_meta(search_result.info_hash)
+        self.assertEqual(
+            odm.decode_torrent_meta(stored or {}),
+            TorrentMeta.parse_title(title),
+        )
+
     @mock.patch("annatar.pubsub.consumers.torrent_processor.resolve_magnet_link")
     async def test_resolves_magnet_links(self, mock_resolve_magnet_link: mock.MagicMock):
         title = "The Hobbit The Battle of the Five Armies 2014 1080p X265"
@@ -151,19 +221,68 @@ class ProcessMessage(unittest.IsolatedAsyncioTestCase):
         search_result.magnet_link = "http://example.tld"
 
         mock_resolve_magnet_link.return_value = info_hash
-        await process_message(search_result)
+        await process(search_result)
 
         torrents = await odm.list_torrents(imdb=search_result.imdb)
         self.assertIn(info_hash, torrents)
 
 
+def mock_search_results(titles: list[str]) -> TorrentSearchResults:
+    first = mock_search_result(titles[0])
+    return TorrentSearchResults(
+        search_criteria=first.search_criteria,
+        results=[
+            TorrentSearchHit(
+                **mock_search_result(title).model_dump(exclude={"search_criteria", "imdb"}),
+                imdb=first.imdb,
+            )
+            for title in titles
+        ],
+    )
+
+
+class ProcessBatch(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        db.configure(db_path=None)
+        self.assertTrue(await db.ping())
+
+    async def asyncTearDown(self):
+        await db.client().flushall()
+        await db.close()
+
+    async def test_adds_every_result(self):
+        batch = mock_search_results(
+            [
+                "The Lord of the Rings The Return of the King 2003 1080p X265",
+                "The Lord of the Rings The Return of the King 2003 720p BluRay",
+            ]
+        )
+
+        added = await process_batch(batch)
+
+        self.assertEqual(len(added), 2)
+        torrents = await odm.list_torrents(imdb=batch.search_criteria.imdb)
+        self.assertCountEqual(torrents, [r.info_hash for r in batch.results])
+
+    async def test_skips_processed_results(self):
+        batch = mock_search_results(
+            ["The Lord of the Rings The Return of the King 2003 1080p X265"]
+        )
+
+        self.assertEqual(len(await process_batch(batch)), 1)
+        await db.client().delete(odm.Keys.torrents(batch.search_criteria.imdb))
+        self.assertEqual(await process_batch(batch), [])
+
+
 class ResolveMagnetLink(unittest.IsolatedAsyncioTestCase):
     async def asyncSetUp(self):
-        db.redis = StrictRedis()
-        self.assertTrue(db.redis.ping())
+        db.configure(db_path=None)
+        self.assertTrue(await db.ping())
 
     async def asyncTearDown(self):
-        db.redis.flushall()
+        await http.close()
+        await db.client().flushall()
+        await db.close()
 
     async def test_resolves_magnet_links(self):
         guid = uuid4().hex
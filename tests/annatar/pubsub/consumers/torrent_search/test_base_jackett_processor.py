@@ -0,0 +1,222 @@
+import asyncio
+import unittest
+from unittest import mock
+
+from annatar.clients import indexer_health
+from annatar.clients.cinemeta import MediaInfo
+from annatar.clients.indexer_health import IndexerStats, QueryStats
+from annatar.clients.jackett_models import SearchResponse, SearchResult
+from annatar.pubsub.consumers.torrent_search.base_jackett_processor import BaseJackettProcessor
+from annatar.pubsub.events import SearchRequest
+from annatar.torrent import Category
+
+MODULE = "annatar.pubsub.consumers.torrent_search.base_jackett_processor"
+
+
+def response(*titles: str) -> SearchResponse:
+    return SearchResponse(Results=[SearchResult(Title=t, Guid=t) for t in titles])
+
+
+def processor() -> BaseJackettProcessor:
+    return BaseJackettProcessor(
+        indexer="mock",
+        supports_imdb=True,
+        num_workers=1,
+        queue_size=1,
+        categories=[Category.Movie, Category.Series],
+    )
+
+
+def healthy() -> IndexerStats:
+    return IndexerStats(indexer="mock")
+
+
+class ProcessMessage(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        patcher = mock.patch.object(indexer_health, "record")
+        self.record = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    async def test_publishes_each_query_as_it_completes(self):
+        slow_query = asyncio.Event()
+        published: list[list[str]] = []
+
+        async def search_imdb(**_):
+            return response("Fargo S01E01 1080p", "Fargo S01 720p")
+
+        async def search(query: str, **_):
+            if query == "Fargo S01":
+                await slow_query.wait()
+                return response("Fargo S01 720p", "Fargo S01 2160p")
+            return response()
+
+        async def publish(_request, results, _media_info):
+            published.append([r.Title for r in results])
+            if len(published) == 1:
+                slow_query.set()
+
+        with (
+            mock.patch("annatar.clients.jackett.search_imdb", side_effect=search_imdb),
+            mock.patch("annatar.clients.jackett.search", side_effect=search),
+            mock.patch.object(BaseJackettProcessor, "publish_search_results", side_effect=publish),
+        ):
+            await asyncio.wait_for(
+                processor().process_message(
+                    SearchRequest(imdb="tt2802850", category=Category.Series, season=1),
+                    MediaInfo(id="tt2802850", type="series", name="Fargo"),
+                ),
+                timeout=5,
+            )
+
+        published = [p for p in published if p]
+        self.assertEqual(
+            published,
+            [["Fargo S01E01 1080p", "Fargo S01 720p"], ["Fargo S01 2160p"]],
+        )
+        # the slow query is credited with the result the fast one published
+        season = next(
+            c.kwargs
+            for c in self.record.call_args_list
+            if c.kwargs["query"] == indexer_health.QueryType.SEASON
+        )
+        self.assertEqual((season["results"], season["unique"]), (2, 1))
+
+
+class ProcessRequest(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.health = healthy()
+        for name, value in [("record", None), ("cached_stats", self.health)]:
+            patcher = mock.patch.object(indexer_health, name, return_value=value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    async def test_starts_the_imdb_query_before_the_metadata_arrives(self):
+        imdb_query_started = asyncio.Event()
+        published: list[str] = []
+
+        async def search_imdb(**_):
+            imdb_query_started.set()
+            return response("Fargo S01E01 1080p")
+
+        async def get_media_info(imdb: str, _category):
+            await imdb_query_started.wait()
+            return MediaInfo(id=imdb, type="series", name="Fargo")
+
+        async def publish(_request, results, _media_info):
+            published.extend(r.Title for r in results)
+
+        with (
+            mock.patch(f"{MODULE}.db.try_lock", return_value=True),
+            mock.patch(f"{MODULE}.get_media_info", side_effect=get_media_info),
+            mock.patch("annatar.clients.jackett.search_imdb", side_effect=search_imdb),
+            mock.patch("annatar.clients.jackett.search", return_value=response()),
+            mock.patch.object(BaseJackettProcessor, "publish_search_results", side_effect=publish),
+        ):
+            await asyncio.wait_for(
+                processor().process_request(
+                    SearchRequest(imdb="tt2802850", category=Category.Series, season=1)
+                ),
+                timeout=5,
+            )
+
+        self.assertEqual(published, ["Fargo S01E01 1080p"])
+
+    async def test_cancels_the_imdb_query_without_metadata(self):
+        imdb_query = asyncio.Event()
+
+        async def search_imdb(**_):
+            await imdb_query.wait()
+            return response()
+
+        with (
+            mock.patch(f"{MODULE}.db.try_lock", return_value=True),
+            mock.patch(f"{MODULE}.get_media_info", return_value=None),
+            mock.patch("annatar.clients.jackett.search_imdb", side_effect=search_imdb),
+        ):
+            await processor().process_request(
+                SearchRequest(imdb="tt2802850", category=Category.Series)
+            )
+            await asyncio.sleep(0)
+
+        tasks = [t for t in asyncio.all_tasks() if t is not asyncio.current_task()]
+        self.assertEqual(tasks, [])
+
+    async def test_skips_indexers_with_an_open_circuit(self):
+        self.health.breaker_open = True
+
+        with (
+            mock.patch(f"{MODULE}.db.try_lock", return_value=True) as try_lock,
+            mock.patch("annatar.clients.jackett.search_imdb") as search_imdb,
+        ):
+            await processor().process_request(
+                SearchRequest(imdb="tt2802850", category=Category.Series)
+            )
+
+        try_lock.assert_not_called()
+        search_imdb.assert_not_called()
+
+
+class Plan(unittest.TestCase):
+    def test_skips_query_types_without_yield(self):
+        health = IndexerStats(
+            indexer="yts",
+            queries={
+                "series:imdb": QueryStats(queries=50, results=0),
+                "series:title": QueryStats(queries=50, results=3),
+                "movie:imdb": QueryStats(queries=50, results=40),
+            },
+        )
+        request = SearchRequest(imdb="tt2802850", category=Category.Series, season=1)
+
+        self.assertEqual(
+            processor().plan(request, health),
+            [indexer_health.QueryType.TITLE, indexer_health.QueryType.SEASON],
+        )
+
+    def test_does_not_skip_failing_query_types(self):
+        health = IndexerStats(
+            indexer="yts",
+            queries={"movie:imdb": QueryStats(queries=50, errors=50)},
+        )
+        request = SearchRequest(imdb="tt0120737", category=Category.Movie)
+
+        self.assertIn(indexer_health.QueryType.IMDB, processor().plan(request, health))
+
+
+class Prefilter(unittest.IsolatedAsyncioTestCase):
+    media_info = MediaInfo(id="tt15398776", type="movie", name="Oppenheimer", releaseInfo="2023")
+    request = SearchRequest(imdb="tt15398776", category=Category.Movie)
+
+    async def prefilter(
+        self, results: list[SearchResult], seen: set[str] | None = None
+    ) -> list[str]:
+        candidates = await processor().prefilter(self.request, self.media_info, results)
+        return [c.result.Guid for c in processor().unpublished(candidates, seen or set())]
+
+    async def test_drops_duplicates_by_guid_and_info_hash(self):
+        results = [
+            SearchResult(Title="Oppenheimer 2023 1080p", Guid="a", InfoHash="abc"),
+            SearchResult(Title="Oppenheimer 2023 1080p", Guid="b", InfoHash="ABC"),
+            SearchResult(Title="Oppenheimer 2023 720p", Guid="a"),
+            SearchResult(Title="Oppenheimer 2023 2160p", Guid="c", InfoHash="def"),
+            SearchResult(Title="Oppenheimer 2023 720p", Guid="d"),
+        ]
+
+        self.assertEqual(await self.prefilter(results, seen={"DEF"}), ["a", "d"])
+
+    async def test_drops_results_the_torrent_processor_rejects(self):
+        results = [
+            SearchResult(Title="Oppenheimer 2023 1080p", Guid="ok"),
+            SearchResult(Title="Oppenheimer 2023 HDCAM", Guid="trash"),
+            SearchResult(Title="Oppenheimer 1964 1080p", Guid="year"),
+            SearchResult(Title="Barbie 2023 1080p", Guid="title"),
+            SearchResult(Title="Oppenheimer 2023 1080p", Guid="imdb", Imdb=1517268),
+            SearchResult(Title="Oppenheimer", Guid="score"),
+        ]
+
+        self.assertEqual(await self.prefilter(results), ["ok"])
+
+    async def test_trusts_the_imdb_id_over_the_title(self):
+        results = [SearchResult(Title="Oppenheimer Film 2023 1080p", Guid="a", Imdb=15398776)]
+
+        self.assertEqual(await self.prefilter(results), ["a"])
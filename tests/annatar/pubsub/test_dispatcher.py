@@ -0,0 +1,87 @@
+import asyncio
+import unittest
+
+from annatar.database import db
+from annatar.pubsub import dispatcher
+from annatar.pubsub.pubsub import Topic
+from annatar.pubsub.events import TorrentAdded
+from annatar.torrent import Category
+
+
+def torrent_added(imdb: str, season: int | None = None, episode: int | None = None):
+    return TorrentAdded(
+        info_hash="A" * 40,
+        title="Fargo",
+        imdb=imdb,
+        size=1,
+        indexer="mock",
+        category=Category.Series if season else Category.Movie,
+        season=season,
+        episode=episode,
+    )
+
+
+class Dispatch(unittest.TestCase):
+    def test_routes_events_by_key(self):
+        d = dispatcher.TorrentAddedDispatcher()
+        episode = dispatcher.Waiter(episode=2)
+        movie = dispatcher.Waiter(episode=0)
+        d._waiters[("tt1", 1)].add(episode)  # noqa: SLF001
+        d._waiters[("tt2", 0)].add(movie)  # noqa: SLF001
+
+        d.dispatch(torrent_added("tt1", 1, 1))
+        d.dispatch(torrent_added("tt1", 1, 2))
+        d.dispatch(torrent_added("tt1", 1))
+        d.dispatch(torrent_added("tt1", 2, 2))
+        d.dispatch(torrent_added("tt2"))
+
+        self.assertEqual(episode.received, 2)
+        self.assertEqual(movie.received, 1)
+
+    def test_routes_packs_to_every_episode(self):
+        d = dispatcher.TorrentAddedDispatcher()
+        first = dispatcher.Waiter(episode=2)
+        second = dispatcher.Waiter(episode=7)
+        season = dispatcher.Waiter(episode=0)
+        d._waiters[("tt1", 1)].update([first, season])  # noqa: SLF001
+        d._waiters[("tt1", 3)].add(second)  # noqa: SLF001
+
+        d.dispatch(torrent_added("tt1", 1, 1).model_copy(update={"episodes": [1, 2, 3]}))
+        d.dispatch(torrent_added("tt1", 1).model_copy(update={"seasons": [1, 2, 3]}))
+
+        self.assertEqual(first.received, 2)
+        self.assertEqual(second.received, 1)
+        self.assertEqual(season.received, 1)
+
+
+class Watch(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        db.configure(db_path=None)
+        self.assertTrue(await db.ping())
+
+    async def asyncTearDown(self):
+        await db.client().flushall()
+        await db.close()
+
+    async def test_shares_one_subscription(self):
+        async with dispatcher.watch("tt1", 1, 1) as first, dispatcher.watch("tt1", 1, 1) as second:
+            async with asyncio.timeout(5):
+                while not await TorrentAdded.publish(torrent_added("tt1", 1, 1)):
+                    await asyncio.sleep(0.01)
+                await first.wait(1)
+                await second.wait(1)
+            subscribers = await db.client().pubsub_numsub(str(Topic.TorrentAdded))
+            self.assertEqual(subscribers, [(str(Topic.TorrentAdded).encode(), 1)])
+        self.assertEqual(dispatcher.dispatcher().waiting(), 0)
+
+    async def test_deregisters_cancelled_waiters(self):
+        async def wait():
+            async with dispatcher.watch("tt1", 1, 1) as waiter:
+                await waiter.wait(1)
+
+        task = asyncio.create_task(wait())
+        await asyncio.sleep(0.01)
+        self.assertEqual(dispatcher.dispatcher().waiting(), 1)
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+        self.assertEqual(dispatcher.dispatcher().waiting(), 0)
@@ -0,0 +1,101 @@
+import asyncio
+import threading
+import unittest
+
+from annatar.pubsub import pubsub
+from annatar.pubsub.events import SearchRequest, TorrentAdded, TorrentsAdded
+from annatar.pubsub.pubsub import Delivery
+from annatar.torrent import Category
+
+
+def torrent_added() -> TorrentAdded:
+    return TorrentAdded(
+        info_hash="A" * 40,
+        title="Oppenheimer 2023 1080p",
+        imdb="tt0000001",
+        size=1,
+        indexer="mock",
+        category=Category.Movie,
+    )
+
+
+class LocalBroker(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        pubsub.configure("memory")
+        self.tasks: list[asyncio.Task[None]] = []
+
+    async def asyncTearDown(self):
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        pubsub.configure("redis")
+
+    async def listen(self, coro) -> None:
+        self.tasks.append(asyncio.create_task(coro))
+        # let the consumer register
+        await asyncio.sleep(0)
+
+    async def test_passes_messages_without_serialization(self):
+        first: asyncio.Queue[TorrentAdded] = asyncio.Queue()
+        second: asyncio.Queue[TorrentAdded] = asyncio.Queue()
+        await self.listen(pubsub.consume_topic(pubsub.Topic.TorrentAdded, first, TorrentAdded, "a"))
+        await self.listen(
+            pubsub.consume_topic(pubsub.Topic.TorrentAdded, second, TorrentAdded, "b")
+        )
+        event = torrent_added()
+
+        self.assertEqual(await TorrentAdded.publish(event), 2)
+
+        self.assertIs(await asyncio.wait_for(first.get(), timeout=1), event)
+        self.assertIs(await asyncio.wait_for(second.get(), timeout=1), event)
+
+    async def test_reads_single_events_as_batches(self):
+        queue: asyncio.Queue[TorrentsAdded] = asyncio.Queue()
+        await self.listen(TorrentsAdded.listen(queue, "test"))
+        event = torrent_added()
+
+        await TorrentAdded.publish(event)
+
+        batch = await asyncio.wait_for(queue.get(), timeout=1)
+        self.assertEqual(batch.torrents, [event])
+
+    async def test_delivers_each_message_once_per_group(self):
+        workers: list[asyncio.Queue[Delivery[SearchRequest]]] = [asyncio.Queue(), asyncio.Queue()]
+        other: asyncio.Queue[Delivery[SearchRequest]] = asyncio.Queue()
+        for queue in workers:
+            await self.listen(SearchRequest.listen(queue, "indexer-a"))
+        await self.listen(SearchRequest.listen(other, "indexer-b"))
+
+        requests = [SearchRequest(imdb=f"tt000000{i}", category=Category.Movie) for i in range(6)]
+        for request in requests:
+            await SearchRequest.publish(request)
+        await asyncio.sleep(0.01)
+
+        received = [q.get_nowait().message for q in workers for _ in range(q.qsize())]
+        self.assertCountEqual(received, requests)
+        self.assertCountEqual([other.get_nowait().message for _ in requests], requests)
+
+    async def test_delivers_to_consumers_on_other_threads(self):
+        received: list[SearchRequest] = []
+        ready = threading.Event()
+
+        async def consume():
+            queue: asyncio.Queue[Delivery[SearchRequest]] = asyncio.Queue()
+            task = asyncio.create_task(SearchRequest.listen(queue, "worker"))
+            await asyncio.sleep(0)
+            ready.set()
+            delivery = await asyncio.wait_for(queue.get(), timeout=5)
+            await delivery.ack()
+            received.append(delivery.message)
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+
+        thread = threading.Thread(target=asyncio.run, args=(consume(),))
+        thread.start()
+        await asyncio.to_thread(ready.wait, 5)
+        request = SearchRequest(imdb="tt0000001", category=Category.Movie)
+
+        self.assertEqual(await SearchRequest.publish(request), 1)
+
+        await asyncio.to_thread(thread.join, 5)
+        self.assertEqual(received, [request])
@@ -0,0 +1,78 @@
+import unittest
+from datetime import timedelta
+from unittest import mock
+
+from annatar import config
+from annatar.database import db
+from annatar.database.semaphore import Priority
+from annatar.pubsub import popularity
+from annatar.pubsub.events import SearchRequest
+from annatar.torrent import Category
+
+MOVIE = SearchRequest(imdb="tt15398776", category=Category.Movie)
+SERIES = SearchRequest(imdb="tt2802850", category=Category.Series, season=1, episode=2)
+RARE = SearchRequest(imdb="tt0000001", category=Category.Movie)
+
+
+class Tick(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        db.configure(db_path=None)
+        self.assertTrue(await db.ping())
+        self.published: list[SearchRequest] = []
+        for patcher in [
+            mock.patch.object(SearchRequest, "publish", side_effect=self.published.append),
+            mock.patch.object(config, "JACKETT_INDEXERS_LIST", ["yts", "eztv"]),
+        ]:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    async def asyncTearDown(self):
+        await db.client().flushall()
+        await db.close()
+
+    async def search(self, request: SearchRequest, times: int) -> None:
+        for _ in range(times):
+            await popularity.record(request)
+        # as if the searches happened a while ago
+        await db.unlock(popularity.refreshed_key(popularity.member(request)))
+
+    async def test_refreshes_popular_titles_once_per_period(self):
+        await self.search(MOVIE, 5)
+        await self.search(SERIES, 3)
+        await self.search(RARE, 1)
+
+        self.assertEqual(await popularity.tick(), 2)
+        self.assertEqual(await popularity.tick(), 0)
+
+        self.assertEqual([r.imdb for r in self.published], [MOVIE.imdb, SERIES.imdb])
+        self.assertTrue(all(r.priority == Priority.BACKGROUND for r in self.published))
+        self.assertEqual(self.published[1].episode, 2)
+
+    async def test_user_searches_postpone_the_refresh(self):
+        await self.search(MOVIE, 5)
+        await popularity.record(MOVIE)
+
+        self.assertEqual(await popularity.tick(), 0)
+
+    async def test_stays_within_the_jackett_budget(self):
+        await self.search(MOVIE, 5)
+        await self.search(SERIES, 3)
+
+        # the movie costs 4 requests and the series 6
+        with mock.patch.object(popularity, "REFRESH_AHEAD_JACKETT_CALLS_PER_MINUTE", 9):
+            self.assertEqual(await popularity.tick(), 1)
+            self.assertEqual(await popularity.tick(), 1)
+
+        self.assertEqual([r.imdb for r in self.published], [MOVIE.imdb, SERIES.imdb])
+
+    async def test_decays_the_counters(self):
+        await self.search(MOVIE, 4)
+
+        with mock.patch.object(popularity, "POPULARITY_HALF_LIFE", timedelta(minutes=1)):
+            await popularity.tick()
+            await popularity.tick()
+
+        self.assertEqual(
+            await db.zrange_desc(popularity.POPULARITY_KEY, 0, 0, 10),
+            [(popularity.member(MOVIE), 1.0)],
+        )
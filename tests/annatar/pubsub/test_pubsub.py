@@ -0,0 +1,183 @@
+import asyncio
+import unittest
+from unittest import mock
+
+from annatar.database import db
+from annatar.pubsub import pubsub
+from annatar.pubsub.events import SearchRequest, TorrentAdded
+from annatar.pubsub.pubsub import Delivery
+from annatar.torrent import Category
+
+
+def torrent_added() -> TorrentAdded:
+    return TorrentAdded(
+        info_hash="A" * 40,
+        title="Oppenheimer 2023 1080p",
+        imdb="tt0000001",
+        size=1,
+        indexer="mock",
+        category=Category.Movie,
+    )
+
+
+class ConsumeTopic(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        db.configure(db_path=None)
+        self.assertTrue(await db.ping())
+
+    async def asyncTearDown(self):
+        await db.client().flushall()
+        await db.close()
+
+    async def test_receives_published_messages_without_polling(self):
+        queue: asyncio.Queue[TorrentAdded] = asyncio.Queue()
+        consumer = asyncio.create_task(
+            pubsub.consume_topic(pubsub.Topic.TorrentAdded, queue, TorrentAdded, "test")
+        )
+        try:
+            event = torrent_added()
+            # wait for the subscription to be established
+            async with asyncio.timeout(5):
+                while not await TorrentAdded.publish(event):
+                    await asyncio.sleep(0.01)
+
+            received = await asyncio.wait_for(queue.get(), timeout=0.5)
+            self.assertEqual(received, event)
+        finally:
+            consumer.cancel()
+            await asyncio.gather(consumer, return_exceptions=True)
+
+    def test_decodes_messages_without_envelope(self):
+        event = torrent_added()
+
+        msg, published_at = pubsub.decode(event.model_dump_json(), TorrentAdded)
+
+        self.assertEqual(msg, event)
+        self.assertIsNone(published_at)
+
+
+class ConsumeStream(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        db.configure(db_path=None)
+        self.assertTrue(await db.ping())
+        self.tasks: list[asyncio.Task[None]] = []
+
+    async def asyncTearDown(self):
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        await db.client().flushall()
+        await db.close()
+
+    async def consume(self, group: str) -> asyncio.Queue[Delivery[SearchRequest]]:
+        queue: asyncio.Queue[Delivery[SearchRequest]] = asyncio.Queue()
+        self.tasks.append(asyncio.create_task(SearchRequest.listen(queue, group)))
+        # wait for the group to be created
+        stream = pubsub.Topic.SearchRequest.partition(None)
+        async with asyncio.timeout(5):
+            while not await db.client().exists(stream) or group.encode() not in [
+                g["name"] for g in await db.client().xinfo_groups(stream)
+            ]:
+                await asyncio.sleep(0.01)
+        return queue
+
+    async def test_delivers_each_message_once_per_group(self):
+        workers = [await self.consume("indexer-a"), await self.consume("indexer-a")]
+        other = await self.consume("indexer-b")
+
+        requests = [SearchRequest(imdb=f"tt000000{i}", category=Category.Movie) for i in range(6)]
+        for request in requests:
+            await SearchRequest.publish(request)
+
+        received: list[SearchRequest] = []
+        async with asyncio.timeout(5):
+            while len(received) < len(requests):
+                for queue in workers:
+                    if not queue.empty():
+                        delivery = queue.get_nowait()
+                        await delivery.ack()
+                        received.append(delivery.message)
+                await asyncio.sleep(0.01)
+            others = [(await other.get()).message for _ in requests]
+
+        await asyncio.sleep(0.1)
+        self.assertTrue(all(queue.empty() for queue in workers))
+        self.assertCountEqual(received, requests)
+        self.assertCountEqual(others, requests)
+
+    async def test_reclaims_unacknowledged_messages(self):
+        stream = pubsub.Topic.SearchRequest.partition(None)
+        await pubsub.create_group(stream, "indexer")
+        request = SearchRequest(imdb="tt0000001", category=Category.Movie)
+        await SearchRequest.publish(request)
+        # a consumer that read the message and died before acknowledging it
+        await db.client().xreadgroup("indexer", "dead", {stream: ">"})
+
+        with mock.patch.object(pubsub, "STREAM_CLAIM_IDLE", pubsub.timedelta(0)):
+            queue = await self.consume("indexer")
+            delivery = await asyncio.wait_for(queue.get(), timeout=5)
+        await delivery.ack()
+
+        self.assertEqual(delivery.message, request)
+        pending = await db.client().xpending(stream, "indexer")
+        self.assertEqual(pending["pending"], 0)
+
+    async def test_drops_messages_that_failed_too_many_times(self):
+        stream = pubsub.Topic.SearchRequest.partition(None)
+        await pubsub.create_group(stream, "indexer")
+        request = SearchRequest(imdb="tt0000001", category=Category.Movie)
+        await SearchRequest.publish(request)
+        await db.client().xreadgroup("indexer", "dead", {stream: ">"})
+
+        with (
+            mock.patch.object(pubsub, "STREAM_CLAIM_IDLE", pubsub.timedelta(0)),
+            mock.patch.object(pubsub, "STREAM_MAX_DELIVERIES", 3),
+        ):
+            [(entry_id, _, deliveries)] = await pubsub.claim_pending(stream, "indexer", "alive")
+            await Delivery(request, stream, "indexer", entry_id, deliveries).fail()
+            retried = (await db.client().xpending(stream, "indexer"))["pending"]
+
+            [(entry_id, _, deliveries)] = await pubsub.claim_pending(stream, "indexer", "alive")
+            await Delivery(request, stream, "indexer", entry_id, deliveries).fail()
+            dropped = (await db.client().xpending(stream, "indexer"))["pending"]
+
+        self.assertEqual(deliveries, 3)
+        self.assertEqual(retried, 1)
+        self.assertEqual(dropped, 0)
+
+    async def test_deletes_idle_consumers(self):
+        stream = pubsub.Topic.SearchRequest.partition(None)
+        await pubsub.create_group(stream, "indexer")
+        await SearchRequest.publish(SearchRequest(imdb="tt0000001", category=Category.Movie))
+        await db.client().xreadgroup("indexer", "busy", {stream: ">"})
+        await db.client().xreadgroup("indexer", "stopped", {stream: ">"})
+
+        with mock.patch.object(pubsub, "STREAM_CLAIM_IDLE", pubsub.timedelta(0)):
+            await pubsub.delete_idle_consumers(stream, "indexer", "alive")
+
+        consumers = await db.client().xinfo_consumers(stream, "indexer")
+        self.assertEqual([c["name"] for c in consumers], [b"busy"])
+
+    async def test_reads_no_more_than_the_queue_holds(self):
+        queue: asyncio.Queue[Delivery[SearchRequest]] = asyncio.Queue(maxsize=3)
+        self.assertEqual(pubsub.read_count(queue), 3)
+
+        queue.put_nowait(mock.Mock())
+        self.assertEqual(pubsub.read_count(queue), 2)
+
+        queue.put_nowait(mock.Mock())
+        queue.put_nowait(mock.Mock())
+        self.assertEqual(pubsub.read_count(queue), 1)
+        self.assertEqual(pubsub.read_count(asyncio.Queue()), pubsub.STREAM_READ_COUNT)
+
+    async def test_claims_up_to_the_limit(self):
+        stream = pubsub.Topic.SearchRequest.partition(None)
+        await pubsub.create_group(stream, "indexer")
+        for i in range(5):
+            await SearchRequest.publish(SearchRequest(imdb=f"tt000000{i}", category=Category.Movie))
+        await db.client().xreadgroup("indexer", "dead", {stream: ">"})
+
+        with mock.patch.object(pubsub, "STREAM_CLAIM_IDLE", pubsub.timedelta(0)):
+            claimed = await pubsub.claim_pending(stream, "indexer", "alive", limit=2)
+
+        self.assertEqual(len(claimed), 2)
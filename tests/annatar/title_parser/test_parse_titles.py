@@ -0,0 +1,79 @@
+import unittest
+from unittest import mock
+
+from annatar import title_parser
+from annatar.torrent import TorrentMeta
+
+TITLES = [
+    "Oppenheimer 2023 1080p BluRay x264 DTS-HD MA 5.1",
+    "Fargo S01E05 720p HDTV x264",
+    "Fargo S01 COMPLETE 2160p WEB-DL DDP5.1 HDR",
+    "The Office US S01-S09 1080p",
+]
+
+
+class ParseTitles(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        title_parser.MEMO.clear()
+
+    @classmethod
+    def tearDownClass(cls):
+        title_parser.shutdown()
+
+    async def test_matches_ptn(self):
+        parsed = await title_parser.parse_titles(TITLES)
+
+        self.assertEqual(parsed, [TorrentMeta.parse_title(t) for t in TITLES])
+
+    async def test_memoizes_titles(self):
+        await title_parser.parse_titles(TITLES)
+
+        with mock.patch.object(TorrentMeta, "parse_title") as parse:
+            parsed = await title_parser.parse_titles(TITLES)
+            single = title_parser.parse_title(TITLES[0])
+
+        parse.assert_not_called()
+        self.assertEqual(parsed, [TorrentMeta.parse_title(t) for t in TITLES])
+        self.assertEqual(single, parsed[0])
+
+    async def test_returns_copies(self):
+        first, duplicate = await title_parser.parse_titles([TITLES[0], TITLES[0]])
+        first.year.pop()
+
+        self.assertEqual(duplicate.year, [2023])
+        self.assertEqual(title_parser.parse_title(TITLES[0]).year, [2023])
+
+    async def test_parses_large_batches_in_processes(self):
+        titles = [f"{t} {i}" for i in range(10) for t in TITLES]
+
+        with (
+            mock.patch.object(title_parser, "_pool_enabled", True),
+            mock.patch.object(title_parser, "PARSE_POOL_MIN_BATCH", 10),
+            mock.patch.object(title_parser, "PARSE_PROCESSES", 2),
+        ):
+            parsed = await title_parser.parse_titles(titles)
+
+        self.assertEqual(parsed, [TorrentMeta.parse_title(t) for t in titles])
+
+    async def test_parses_inline_unless_pool_enabled(self):
+        titles = [f"{t} {i}" for i in range(10) for t in TITLES]
+        title_parser.shutdown()
+
+        with (
+            mock.patch.object(title_parser, "PARSE_POOL_MIN_BATCH", 10),
+            mock.patch.object(title_parser, "pool") as pool,
+        ):
+            parsed = await title_parser.parse_titles(titles)
+
+        pool.assert_not_called()
+        self.assertEqual(parsed, [TorrentMeta.parse_title(t) for t in titles])
+
+    def test_evicts_least_recently_used(self):
+        memo = title_parser.Memo(max_entries=2)
+        for title in TITLES[:2]:
+            memo.put(title, TorrentMeta.parse_title(title))
+        memo.get(TITLES[0])
+        memo.put(TITLES[2], TorrentMeta.parse_title(TITLES[2]))
+
+        self.assertIsNotNone(memo.get(TITLES[0]))
+        self.assertIsNone(memo.get(TITLES[1]))
@@ -0,0 +1,84 @@
+import time
+import unittest
+from pathlib import Path
+from unittest import mock
+
+import PTN
+
+from annatar import torrent
+from annatar.torrent import TorrentMeta
+
+# release names seen in Jackett results plus edge cases of the fast parser
+TITLES = (Path(__file__).parent / "titles.txt").read_text().splitlines()
+
+FIELDS = [*torrent.FAST_PARSE_KEYS, "title"]
+
+
+def ptn_parse(title: str) -> dict:
+    return PTN.parse(title, standardise=True, coherent_types=True)
+
+
+class TestFastParse(unittest.TestCase):
+    def test_matches_ptn(self):
+        for title in TITLES:
+            parsed = torrent.fast_parse(title)
+            if parsed is None:
+                continue
+            with self.subTest(title=title):
+                expected = {k: v for k, v in ptn_parse(title).items() if k in FIELDS}
+                self.assertEqual(expected, parsed)
+
+    def test_parse_title_matches_ptn(self):
+        for title in TITLES:
+            with self.subTest(title=title):
+                expected = TorrentMeta.model_validate({**ptn_parse(title), "raw_title": title})
+                meta = TorrentMeta.parse_title(title)
+                self.assertEqual(
+                    expected.model_dump(include=set(FIELDS)), meta.model_dump(include=set(FIELDS))
+                )
+                self.assertEqual(expected.score, meta.score)
+
+    def test_coverage(self):
+        fast = [t for t in TITLES if torrent.fast_parse(t) is not None]
+        self.assertGreater(len(fast) / len(TITLES), 0.7)
+
+    def test_falls_back_to_ptn(self):
+        for title in [
+            "Oppenheimer (2023) [1080p] [WEBRip] [x265] [10bit] [5.1] [YTS.MX]",
+            "The.Office.US.S05E10.Stress.Relief.720p.HDTV.x264-GROUP",
+            "Inception.2010.1080p.BluRay.x264.E-AC-3.5.1-GROUP",
+            "The.LiNE.2010.1080p.BluRay.x264-GROUP",
+            "Inception",
+        ]:
+            with self.subTest(title=title):
+                self.assertIsNone(torrent.fast_parse(title))
+
+    def test_uses_ptn_without_its_internals(self):
+        title = "Oppenheimer.2023.1080p.BluRay.x264-GROUP"
+
+        with mock.patch.object(torrent, "FAST_PARSE", False):
+            self.assertIsNone(torrent.fast_parse(title))
+            meta = TorrentMeta.parse_title(title)
+
+        self.assertEqual(meta, TorrentMeta.model_validate({**ptn_parse(title), "raw_title": title}))
+
+    def test_faster_than_ptn(self):
+        fast = [t for t in TITLES if torrent.fast_parse(t) is not None]
+        start = time.perf_counter()
+        for title in fast:
+            ptn_parse(title)
+        ptn_time = time.perf_counter() - start
+        start = time.perf_counter()
+        for title in fast:
+            torrent.fast_parse(title)
+        fast_time = time.perf_counter() - start
+        # typically 15-20x, kept loose for slow CI machines
+        self.assertLess(
+            fast_time * 5,
+            ptn_time,
+            f"PTN {ptn_time / len(fast) * 1e6:.0f}us, fast {fast_time / len(fast) * 1e6:.0f}us",
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
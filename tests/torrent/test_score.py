@@ -57,3 +57,9 @@ class TestScore(unittest.TestCase):
 
         result = Torrent.parse_title(title="Friends S05-E10").score_series(season=5, episode=10)
         self.assertEqual(result, 1)
+
+    def test_score_keeps_year(self):
+        meta = Torrent.parse_title(title="The Matrix 1999 1080p")
+
+        self.assertEqual(meta.score, meta.score)
+        self.assertEqual(meta.year, [1999])